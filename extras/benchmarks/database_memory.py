@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Measures the memory used by the FIX Gateway database for databases of
+# different sizes.  The databases are built with variable expansion the same
+# way a large engine monitor configuration would be.
+#
+#   python extras/benchmarks/database_memory.py [--top N] [count ...]
+#
+# With --top the N source lines that allocated the most memory are listed for
+# each size as well, which shows where the per item cost actually goes.
+
+import argparse
+
+import io
+import logging
+import tracemalloc
+
+import fixgw.database as database
+
+config = """
+variables:
+  n: {count}
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 2000
+- key: AUXITEMn
+  description: Generic Item with aux %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+  aux: [Min,Max,lowWarn,highWarn,lowAlarm,highAlarm]
+"""
+
+
+def measure(count, top=0):
+    # Half of the items have aux data and half do not
+    f = io.StringIO(config.format(count=count // 2))
+    tracemalloc.start()
+    database.init(f)
+    size, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics("lineno")[:top] if top else []
+    tracemalloc.stop()
+    return size, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FIX Gateway database memory")
+    parser.add_argument("--top", type=int, default=0, help="Show the top N lines")
+    parser.add_argument("counts", type=int, nargs="*", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    print("{:>10} {:>14} {:>14}".format("Items", "Total (kB)", "Per Item (B)"))
+    for count in args.counts:
+        size, stats = measure(count, args.top)
+        print("{:>10} {:>14.1f} {:>14.1f}".format(count, size / 1024, size / count))
+        for stat in stats:
+            frame = stat.traceback[0]
+            print(
+                "{:>25.1f}  {}:{}".format(
+                    stat.size / count, frame.filename.split("/")[-1], frame.lineno
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Connects many asyncio Net-FIX clients to one server from a single thread
+# and measures how long it takes them all to connect and sync the database
+# and then how long a value change takes to reach every one of them.  The
+# number of threads in the process is shown to make the point that the
+# clients don't need any.
+#
+#   python extras/benchmarks/netfix_aio.py [clients ...]
+
+import argparse
+import asyncio
+import io
+import logging
+import threading
+import time
+
+import fixgw.database as database
+import fixgw.plugins.netfix as netfix
+from fixgw.netfix.aio import Client
+
+PORT = 34970
+
+config = """
+variables:
+  n: 200
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+"""
+
+
+async def run(count, port):
+    clients = [Client("127.0.0.1", port, timeout=10.0) for i in range(count)]
+    start = time.monotonic()
+    await asyncio.gather(*[c.connect() for c in clients])
+    await asyncio.gather(*[c.sync(subscribe=True) for c in clients])
+    synced = time.monotonic() - start
+    threads = threading.active_count()
+
+    updates = [c.updates() for c in clients]
+    start = time.monotonic()
+    database.write("ITEM1", 42.0)
+    await asyncio.gather(*[u.__anext__() for u in updates])
+    delivered = time.monotonic() - start
+    for u in updates:
+        await u.aclose()
+    await asyncio.gather(*[c.close() for c in clients])
+    return synced * 1000, delivered * 1000, threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("counts", type=int, nargs="*", default=[10, 100, 500])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("fixgw.netfix").setLevel(logging.CRITICAL)
+    print(
+        "{:>8} {:>16} {:>14} {:>8}".format("Clients", "Connect+sync ms", "Update ms", "Threads")
+    )
+    port = PORT
+    for count in args.counts:
+        port += 1
+        database.init(io.StringIO(config))
+        pl = netfix.Plugin(
+            "netfix",
+            {
+                "type": "server",
+                "mode": "select",
+                "host": "127.0.0.1",
+                "port": port,
+                "backlog": 128,
+                "timeout": 1.0,
+            },
+            None,
+        )
+        pl.start()
+        time.sleep(0.3)
+        synced, delivered, threads = asyncio.run(run(count, port))
+        pl.stop()
+        print("{:>8} {:>16.1f} {:>14.1f} {:>8}".format(count, synced, delivered, threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Measures the CPU time that the Net-FIX server plugin spends in the database
+# write for each update as the number of subscribed clients goes up.  No
+# sockets are used, each client is just a connection object whose output
+# queue is emptied after every write, so this only shows the cost of
+# building and queueing the messages.  --no-share builds the message
+# separately for every client the way the plugin used to.
+#
+#   python extras/benchmarks/netfix_encode.py [--no-share] [--updates 20000]
+#                                             [clients ...]
+
+import argparse
+import io
+import logging
+import time
+
+import fixgw.database as database
+import fixgw.plugins.netfix as netfix
+
+config = """
+entries:
+- key: ROLL
+  description: Roll Angle
+  type: float
+  min: -180.0
+  max: 180.0
+  units: deg
+  initial: 0.0
+  tol: 0
+"""
+
+
+def run(clients, updates):
+    database.init(io.StringIO(config))
+    pl = netfix.Plugin("netfix", {"type": "server"}, None)
+    connections = []
+    for i in range(clients):
+        co = netfix.Connection(pl, None, ("bench", i))
+        co.handle_request("@sROLL")
+        co.queue.get_nowait()
+        connections.append(co)
+
+    start = time.process_time()
+    for i in range(updates):
+        database.write("ROLL", float(i % 360 - 180))
+        for co in connections:
+            co.queue.get_nowait()
+    return (time.process_time() - start) / updates * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-share", action="store_true")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("clients", type=int, nargs="*")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.no_share:
+        netfix.value_frame = netfix.encode_value
+    counts = args.clients or [1, 5, 10, 20, 40]
+
+    print("{:>8} {:>14} {:>18}".format("Clients", "us/Update", "us/Update/Client"))
+    for count in counts:
+        us = run(count, args.updates)
+        print("{:>8} {:>14.2f} {:>18.2f}".format(count, us, us / count))
+
+
+if __name__ == "__main__":
+    main()
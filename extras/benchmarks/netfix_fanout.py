@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Measures how many value updates per second the Net-FIX server plugin can
+# deliver to subscribed clients as the number of clients goes up.  Every
+# client is subscribed to every item and a single writer writes a fixed number
+# of updates to the database as fast as it can.  The time is taken from the
+# first write until every client has received the last value that was
+# written.  Slow clients may have some updates conflated so the delivered rate
+# counts the lines that were actually received.
+#
+#   python extras/benchmarks/netfix_fanout.py [--mode threads|select|both]
+#                                             [--updates 20000] [clients ...]
+
+import argparse
+import io
+import logging
+import socket
+import threading
+import time
+
+import fixgw.database as database
+import fixgw.plugins.netfix as netfix
+
+ITEMS = 50
+PORT = 34900
+
+config = """
+variables:
+  n: {count}
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 100000.0
+  units: none
+  initial: 0.0
+  tol: 0
+"""
+
+
+class Reader(threading.Thread):
+    def __init__(self, port):
+        super(Reader, self).__init__(daemon=True)
+        self.lines = 0
+        self.counting = False
+        self.marker = None
+        self.tail = b""
+        self.done = threading.Event()
+        # Retry until we get a connection that answers
+        while True:
+            try:
+                self.sock = socket.create_connection(("127.0.0.1", port))
+                self.sock.settimeout(1.0)
+                self.sock.sendall(b"@rITEM1\n")
+                if self.sock.recv(1024):
+                    break
+            except OSError:
+                pass
+            self.sock.close()
+            time.sleep(0.05)
+        self.sock.settimeout(None)
+
+    def subscribe(self):
+        for i in range(ITEMS):
+            self.sock.sendall("@sITEM{}\n".format(i + 1).encode())
+
+    def run(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            if self.counting:
+                self.lines += data.count(b"\n")
+                buf = self.tail + data
+                if self.marker in buf:
+                    self.done.set()
+                self.tail = buf[-len(self.marker) :]
+
+
+def run(mode, clients, updates, port):
+    database.init(io.StringIO(config.format(count=ITEMS)))
+    pl = netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": mode,
+            "host": "127.0.0.1",
+            "port": port,
+            "buffer_size": 4096,
+            "timeout": 1.0,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.3)
+    readers = [Reader(port) for i in range(clients)]
+    for r in readers:
+        r.start()
+        r.subscribe()
+    time.sleep(0.5)  # Let the subscription responses go by
+
+    last = updates - 1
+    for r in readers:
+        r.marker = "\nITEM{};{};".format(last % ITEMS + 1, float(last)).encode()
+        r.counting = True
+    start = time.monotonic()
+    for i in range(updates):
+        database.write("ITEM{}".format(i % ITEMS + 1), float(i))
+    written = time.monotonic() - start
+    for r in readers:
+        r.done.wait(max(0, 120 - (time.monotonic() - start)))
+    elapsed = time.monotonic() - start
+    delivered = sum(r.lines for r in readers)
+
+    for r in readers:
+        r.sock.close()
+    pl.stop()
+    return updates / written, delivered / elapsed, (elapsed - written) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="both", choices=["threads", "select", "both"])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("clients", type=int, nargs="*")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    modes = ["threads", "select"] if args.mode == "both" else [args.mode]
+    counts = args.clients or [1, 5, 10, 20, 40]
+
+    print(
+        "{:>8} {:>8} {:>14} {:>16} {:>16} {:>12}".format(
+            "Mode", "Clients", "Writes/s", "Delivered/s", "Per Client/s", "Catch Up ms"
+        )
+    )
+    port = PORT
+    for mode in modes:
+        for count in counts:
+            port += 1
+            w, d, c = run(mode, count, args.updates, port)
+            print(
+                "{:>8} {:>8} {:>14.0f} {:>16.0f} {:>16.0f} {:>12.1f}".format(
+                    mode, count, w, d, d / count, c
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
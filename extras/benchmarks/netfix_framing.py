@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Measures how many Net-FIX messages per second can be split out of received
+# data.  The data is fed in recv() sized chunks so that messages are split
+# across chunks the way they are on a real connection.  The framer used by the
+# server and the client library is compared with the old way of decoding each
+# chunk and adding it to a string a character at a time, and with finding each
+# line and deleting it from the front of the buffer.  The messages are only
+# framed, nothing is done with them.
+#
+#   python extras/benchmarks/netfix_framing.py [--lines 200000] [--chunk 1024]
+
+import argparse
+import time
+
+import fixgw.netfix.binary as binary
+from fixgw.netfix.framing import Framer
+
+
+def character_at_a_time(chunks):
+    count = 0
+    buff = ""
+    for data in chunks:
+        for d in data.decode("utf-8"):
+            if d == "\n":
+                count += 1
+                buff = ""
+            else:
+                buff += d
+    return count
+
+
+def delete_each_line(chunks):
+    count = 0
+    buf = bytearray()
+    for data in chunks:
+        buf += data
+        while True:
+            i = buf.find(b"\n")
+            if i < 0:
+                break
+            line = bytes(buf[:i])
+            del buf[: i + 1]
+            count += 1
+    return count
+
+
+def framer(chunks, binary_mode=False):
+    count = 0
+    f = Framer()
+    f.binary = binary_mode
+    for data in chunks:
+        f.feed(data)
+        for ftype, payload in f:
+            count += 1
+    return count
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def measure(function, chunks, *args):
+    start = time.perf_counter()
+    count = function(chunks, *args)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--chunk", type=int, default=1024, help="recv() size")
+    args = parser.parse_args()
+
+    lines = [
+        "ITEM{};{};00000\n".format(i % 500 + 1, 1234.5 + i).encode()
+        for i in range(args.lines)
+    ]
+    ascii = split(b"".join(lines), args.chunk)
+    frames = split(b"".join(binary.text_frame(x) for x in lines), args.chunk)
+
+    print("{:>28} {:>14}".format("Method", "Messages/s"))
+    print("{:>28} {:>14.0f}".format("Character at a time", measure(character_at_a_time, ascii)))
+    print("{:>28} {:>14.0f}".format("Delete each line", measure(delete_each_line, ascii)))
+    print("{:>28} {:>14.0f}".format("Framer ASCII", measure(framer, ascii)))
+    print("{:>28} {:>14.0f}".format("Framer binary", measure(framer, frames, True)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Measures how many reads per second a Net-FIX client can make when it waits
+# for each response before sending the next command and when it sends all of
+# the commands at once with readFuture() and then waits for the answers.
+#
+#   python extras/benchmarks/netfix_pipeline.py [--mode threads|select] [count ...]
+
+import argparse
+import io
+import logging
+import time
+
+import fixgw.database as database
+import fixgw.netfix
+import fixgw.plugins.netfix as netfix
+
+PORT = 34960
+
+config = """
+variables:
+  n: 100
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+"""
+
+
+def one_at_a_time(client, count):
+    for i in range(count):
+        client.read("ITEM{}".format(i % 100 + 1))
+
+
+def pipelined(client, count):
+    futures = [client.readFuture("ITEM{}".format(i % 100 + 1)) for i in range(count)]
+    for future in futures:
+        client.wait(future)
+
+
+def run(mode, count, port):
+    database.init(io.StringIO(config))
+    pl = netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": mode,
+            "host": "127.0.0.1",
+            "port": port,
+            "buffer_size": 4096,
+            "timeout": 1.0,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.3)
+    rates = []
+    client = fixgw.netfix.Client("127.0.0.1", port, timeout=5.0)
+    client.connect()
+    client.cthread.connectWait(5.0)
+    for method in (one_at_a_time, pipelined):
+        start = time.monotonic()
+        method(client, count)
+        rates.append(count / (time.monotonic() - start))
+    client.disconnect()
+    pl.stop()
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="threads", choices=["threads", "select"])
+    parser.add_argument("counts", type=int, nargs="*", default=[1000, 10000])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # The client complains when the server goes away at the end of each run
+    logging.getLogger("fixgw.netfix").setLevel(logging.CRITICAL)
+    print("{:>8} {:>18} {:>14} {:>10}".format("Reads", "One at a time /s", "Pipelined /s", "Speedup"))
+    port = PORT
+    for count in args.counts:
+        port += 1
+        slow, fast = run(args.mode, count, port)
+        print("{:>8} {:>18.0f} {:>14.0f} {:>10.1f}".format(count, slow, fast, fast / slow))
+
+
+if __name__ == "__main__":
+    main()
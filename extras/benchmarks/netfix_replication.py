@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Measures how many item values per second client mode can send to another
+# gateway.  The old client mode sent each change with writeValue() and waited
+# for the answer before sending the next one.  The peer sender reads the
+# values of everything that has changed and pipelines the writes batch_size
+# at a time.  Every item is changed in each round so no changes are merged,
+# this is only the cost of getting them to the other gateway.  A second
+# gateway is simulated by a server plugin in this process.
+#
+#   python extras/benchmarks/netfix_replication.py [--mode threads|select] [--batch 64] [rounds]
+
+import argparse
+import io
+import logging
+import time
+from types import SimpleNamespace
+
+import fixgw.database as database
+import fixgw.netfix
+import fixgw.plugins.netfix as netfix
+
+PORT = 34970
+
+config = """
+variables:
+  n: 100
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+"""
+
+KEYS = ["ITEM{}".format(i + 1) for i in range(100)]
+
+
+def one_at_a_time(client, rounds, batch):
+    for r in range(rounds):
+        for key in KEYS:
+            client.writeValue(key, database.read(key)[0])
+
+
+def peer_worker(client, rounds, batch):
+    parent = SimpleNamespace(log=logging.getLogger("bench"), db_read=database.read)
+    worker = netfix.PeerWorker(parent, client, batch_size=batch, interval=0)
+    for r in range(rounds):
+        # The server is in this process and blocks the keys we write to it
+        # from being sent back to us, which would stop us sending them again
+        netfix.client_block.clear()
+        worker.send(KEYS)
+    assert worker.sent == rounds * len(KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="threads", choices=["threads", "select"])
+    parser.add_argument("--batch", type=int, default=64, help="batch_size")
+    parser.add_argument("rounds", type=int, nargs="?", default=100)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("fixgw.netfix").setLevel(logging.CRITICAL)
+
+    database.init(io.StringIO(config))
+    pl = netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": args.mode,
+            "host": "127.0.0.1",
+            "port": PORT,
+            "buffer_size": 4096,
+            "timeout": 1.0,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.3)
+    client = fixgw.netfix.Client("127.0.0.1", PORT, timeout=5.0)
+    client.connect()
+    client.cthread.connectWait(5.0)
+    count = args.rounds * len(KEYS)
+    print("{:>22} {:>14}".format("Method", "Values/s"))
+    try:
+        for method in (one_at_a_time, peer_worker):
+            start = time.monotonic()
+            method(client, args.rounds, args.batch)
+            rate = count / (time.monotonic() - start)
+            print("{:>22} {:>14.0f}".format(method.__name__.replace("_", " "), rate))
+    finally:
+        client.disconnect()
+        pl.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Measures how long a Net-FIX client takes to get the report, the value and
+# the aux values of every item in the database and subscribe to them.  This
+# is what fixgw.netfix.db.Database does when it connects.  It is done once
+# with a round trip for each piece of information, the way the client library
+# used to do it, and once with the @xsync command.
+#
+#   python extras/benchmarks/netfix_sync.py [--mode threads|select] [count ...]
+
+import argparse
+import io
+import logging
+import time
+
+import fixgw.database as database
+import fixgw.netfix
+import fixgw.plugins.netfix as netfix
+
+PORT = 34950
+
+config = """
+variables:
+  n: {count}
+entries:
+- key: ITEMn
+  description: Generic Item %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+- key: AUXITEMn
+  description: Generic Item with aux %n
+  type: float
+  min: 0.0
+  max: 1000.0
+  units: degC
+  initial: 0.0
+  tol: 0
+  aux: [Min,Max,lowWarn,highWarn]
+"""
+
+
+def one_at_a_time(client):
+    for key in client.getList():
+        report = fixgw.netfix.Report(client.getReport(key))
+        client.read(key)
+        for aux in report.aux:
+            client.read("{}.{}".format(key, aux))
+        client.subscribe(key)
+
+
+def run(mode, count, port):
+    # Half of the items have aux data and half do not
+    database.init(io.StringIO(config.format(count=count // 2)))
+    pl = netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": mode,
+            "host": "127.0.0.1",
+            "port": port,
+            "buffer_size": 4096,
+            "timeout": 1.0,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.3)
+    times = []
+    for sync in (one_at_a_time, lambda c: c.sync(subscribe=True)):
+        client = fixgw.netfix.Client("127.0.0.1", port, timeout=1.0)
+        client.connect()
+        client.cthread.connectWait(5.0)
+        start = time.monotonic()
+        sync(client)
+        times.append((time.monotonic() - start) * 1000)
+        client.disconnect()
+    pl.stop()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="threads", choices=["threads", "select"])
+    parser.add_argument("counts", type=int, nargs="*", default=[100, 1000, 5000])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # The clients complain when the server goes away at the end of each run
+    logging.getLogger("fixgw.netfix").setLevel(logging.CRITICAL)
+    print(
+        "{:>8} {:>16} {:>12} {:>10}".format("Items", "One at a time ms", "Sync ms", "Speedup")
+    )
+    port = PORT
+    for count in args.counts:
+        port += 1
+        slow, fast = run(args.mode, count, port)
+        print("{:>8} {:>16.1f} {:>12.1f} {:>10.1f}".format(count, slow, fast, slow / fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Feeds value changes to Qt database items from a worker thread, the way the
+# Net-FIX client thread does, and counts how many times the slots connected
+# to them run in the GUI thread and how much CPU time the GUI thread uses.
+# It is run once with a signal for every change and once with the signals
+# coalesced to the frame rate.
+#
+#   python extras/benchmarks/qtdb_coalesce.py [--items 50] [--rate 50] [--seconds 3]
+
+import argparse
+import threading
+import time
+
+from PyQt6.QtCore import QCoreApplication, QTimer
+
+import fixgw.netfix.QtDb as qtdb
+
+
+class Item:
+    def __init__(self):
+        for name in (
+            "valueChanged",
+            "valueWrite",
+            "annunciateChanged",
+            "oldChanged",
+            "badChanged",
+            "failChanged",
+            "secFailChanged",
+            "auxChanged",
+            "reportReceived",
+            "destroyed",
+        ):
+            setattr(self, name, None)
+
+
+def run(app, items, rate, seconds, frame_rate):
+    coalescer = qtdb.SignalCoalescer(frame_rate) if frame_rate else None
+    plain = [Item() for i in range(items)]
+    qt_items = [
+        qtdb.QtDB_Item("ITEM{}".format(i), x, coalescer) for i, x in enumerate(plain)
+    ]
+    calls = [0]
+
+    def slot(value):
+        calls[0] += 1
+
+    for each in qt_items:
+        each.valueChanged.connect(slot)
+
+    def feed():
+        n = 0
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            for each in plain:
+                each.valueChanged(n)
+            n += 1
+            time.sleep(1 / rate)
+
+    start = time.thread_time()
+    worker = threading.Thread(target=feed)
+    worker.start()
+    QTimer.singleShot(round(seconds * 1000), app.quit)
+    app.exec()
+    if coalescer is not None:
+        coalescer.stop()
+    worker.join()
+    return calls[0] / seconds, (time.thread_time() - start) / seconds * 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=50.0, help="changes/s per item")
+    parser.add_argument("--frame-rate", type=float, default=30.0)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    app = QCoreApplication([])
+    print("{:>14} {:>14} {:>12}".format("Mode", "Slot calls/s", "GUI CPU %"))
+    for label, frame_rate in (("Every change", None), ("Coalesced", args.frame_rate)):
+        calls, cpu = run(app, args.items, args.rate, args.seconds, frame_rate)
+        print("{:>14} {:>14.0f} {:>12.1f}".format(label, calls, cpu))
+
+
+if __name__ == "__main__":
+    main()
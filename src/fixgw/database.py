@@ -18,46 +18,358 @@ import logging
 import threading
 import time
 import copy
+import contextlib
+import heapq
+import itertools
+import re
+from collections import OrderedDict, namedtuple, deque
+from collections.abc import Mapping
+from types import MappingProxyType
 from fixgw import cfg
 
 __database = {}
-_update_thread = globals().get("_update_thread")
-_update_thread_stop = globals().get("_update_thread_stop")
+# Every registered callback indexed by owner name and then by (function, udata)
+# giving the set of keys it is attached to.  This lets a plugin remove all of
+# its callbacks by only visiting the items that it actually subscribed to.
+__callbacks = {}
+# Prefix and regular expression subscriptions.  The key is the handle that
+# was returned for the subscription and the value is the function that
+# matches keys.  Keys are matched once, when the subscription is made or when
+# a key is added to the database, never on a write.
+__patterns = {}
+# The keys that each callback was added to one at a time with callback_add(),
+# indexed by (name, function, udata).  A key stays attached to a callback as
+# long as it was added this way or a pattern subscription still matches it.
+__explicit = {}
+# A trie of the database keys for looking up all the keys with a given prefix.
+# It is built the first time a prefix is looked up.
+__trie = None
+__callback_lock = threading.Lock()
+_stale_thread = globals().get("_stale_thread")
+# Every change to an item is stamped with the next number from this so that
+# changes can be put in order and found later.
+_sequence = itertools.count(1)
+# The most recent changes as (seq, key) in the order they were made.  Aux
+# changes use the "KEY.aux" form of the key.  _horizon is the seq of the last
+# change that has been pushed out of the journal.
+JOURNAL_SIZE = 4096
+_journal = deque(maxlen=JOURNAL_SIZE)
+_journal_lock = threading.Lock()
+_horizon = 0
 
 
+# This thread sets the old flag on items when they have not been written
+# within their time to live.  Each item with a time to live is kept in a heap
+# ordered by the time that it will go stale.  A write only moves the item's
+# deadline, if the item is found to have been written when it comes to the
+# top of the heap it is simply pushed back with its new deadline.  This keeps
+# a single entry per item in the heap and items with a zero time to live are
+# never put in the heap at all.
+class StaleThread(threading.Thread):
+    def __init__(self):
+        super(StaleThread, self).__init__()
+        self.daemon = True
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.getout = False
 
-class UpdateThread(threading.Thread):
-    def __init__(self, func, delay, stop_event=None):
-        super(UpdateThread, self).__init__()
-        self.delay = delay
-        self.func = func
-        self.stop_event = stop_event or threading.Event()
+    # Called with the item lock held to put the item in the heap at the time
+    # in item._armed
+    def arm(self, item):
+        with self.cond:
+            heapq.heappush(self.heap, (item._armed, next(self.counter), item))
+            if self.heap[0][2] is item:
+                self.cond.notify()
 
     def run(self):
-        while not self.stop_event.wait(self.delay):
-            self.func()
+        while True:
+            with self.cond:
+                while not self.getout:
+                    if self.heap:
+                        delay = self.heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self.cond.wait(delay)
+                    else:
+                        self.cond.wait()
+                if self.getout:
+                    break
+                armed, _, item = heapq.heappop(self.heap)
+            with item.lock:
+                if item._armed != armed:
+                    # Replaced by an earlier deadline
+                    continue
+                if item._deadline is not None and item._deadline > time.monotonic():
+                    # Written since it was armed so try again later
+                    item._armed = item._deadline
+                    self.arm(item)
+                    continue
+                item._armed = None
+            log.debug(f"item.old set True for fixid {item.key}")
+            item.old = True
+
+    def stop(self):
+        with self.cond:
+            self.getout = True
+            self.cond.notify()
+
+
+def _stop_stale_thread():
+    global _stale_thread
+    if _stale_thread and _stale_thread.is_alive():
+        _stale_thread.stop()
+        _stale_thread.join(timeout=1.0)
+    _stale_thread = None
+
+
+def _start_stale_thread():
+    global _stale_thread
+    _stale_thread = StaleThread()
+    _stale_thread.start()
+
+
+# Callbacks are normally called on the thread that writes the value.  When the
+# dispatcher is started each callback owner (the name given to callback_add)
+# gets its own bounded queue and worker thread instead so that a slow
+# subscriber cannot hold up the writer.  What happens when an owner's queue is
+# full is set by the overflow policy...
+#   drop-oldest - the oldest queued callback is thrown away
+#   conflate - a queued callback for the same key and function is replaced by
+#              the newer value.  If nothing can be replaced the oldest is dropped
+#   block - the writer waits until there is room in the queue
+OVERFLOW_POLICIES = ["drop-oldest", "conflate", "block"]
+_dispatcher = globals().get("_dispatcher")
+
+# Where the change that is being made came from.  See origin()
+_origin = threading.local()
+
+
+# Changes made inside the with block are tagged with tag.  A callback for one
+# of those changes can call get_origin() to find out where it came from, for
+# example so that a change isn't echoed back to the client that sent it.  This
+# works the same whether the callback runs on the writer's thread or in the
+# dispatcher.
+@contextlib.contextmanager
+def origin(tag):
+    last = getattr(_origin, "tag", None)
+    _origin.tag = tag
+    try:
+        yield
+    finally:
+        _origin.tag = last
+
+
+def get_origin():
+    return getattr(_origin, "tag", None)
+
+
+class CallbackWorker(threading.Thread):
+    def __init__(self, owner, size=256, overflow="conflate"):
+        super(CallbackWorker, self).__init__()
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy - " + str(overflow))
+        self.daemon = True
+        self.owner = owner
+        self.size = int(size)
+        self.overflow = overflow
+        # Keyed by (key, function) for conflation, otherwise by a counter
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.getout = False
+        self.count = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.max_depth = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def post(self, function, key, value, udata, tag=None):
+        with self.cond:
+            entry = (function, key, value, udata, time.monotonic(), tag)
+            if self.overflow == "conflate":
+                slot = (key, function)
+                if slot in self.pending:
+                    # Keep the original position (and age) but send the new
+                    # value and where it came from
+                    self.pending[slot] = entry[:4] + self.pending[slot][4:5] + entry[5:]
+                    self.conflated += 1
+                    return
+            else:
+                slot = self.count
+                self.count += 1
+            if len(self.pending) >= self.size:
+                if self.overflow == "block":
+                    # A callback writing to the database must not wait on
+                    # its own queue
+                    while (
+                        len(self.pending) >= self.size
+                        and not self.getout
+                        and threading.current_thread() is not self
+                    ):
+                        self.cond.wait()
+                else:
+                    self.pending.popitem(last=False)
+                    self.dropped += 1
+            self.pending[slot] = entry
+            self.max_depth = max(self.max_depth, len(self.pending))
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.getout:
+                    self.cond.wait()
+                if self.getout:
+                    break
+                function, key, value, udata, posted, tag = self.pending.popitem(
+                    last=False
+                )[1]
+                self.cond.notify_all()
+            try:
+                with origin(tag):
+                    function(key, value, udata)
+            except Exception as e:
+                log.error(
+                    f"Callback name: {self.owner}, fixid: {key}, udata: {udata} function: {function} exception: {e}"
+                )
+            self.last_latency = (time.monotonic() - posted) * 1000
+            self.max_latency = max(self.max_latency, self.last_latency)
+            self.dispatched += 1
+
+    def stop(self):
+        with self.cond:
+            self.getout = True
+            self.cond.notify_all()
+
+    def get_status(self):
+        d = OrderedDict()
+        d["Overflow"] = self.overflow
+        d["Queue Depth"] = len(self.pending)
+        d["Max Queue Depth"] = self.max_depth
+        d["Dispatched"] = self.dispatched
+        d["Dropped"] = self.dropped
+        d["Conflated"] = self.conflated
+        d["Last Latency (ms)"] = "%.3f" % self.last_latency
+        d["Max Latency (ms)"] = "%.3f" % self.max_latency
+        return d
+
+
+class Dispatcher(object):
+    def __init__(self, size=256, overflow="conflate", owners=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy - " + str(overflow))
+        self.size = size
+        self.overflow = overflow
+        # Per owner overrides of size and overflow
+        self.owners = owners or {}
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def get_worker(self, owner):
+        try:
+            return self.workers[owner]
+        except KeyError:
+            pass
+        with self.lock:
+            if owner not in self.workers:
+                o = self.owners.get(owner, {})
+                worker = CallbackWorker(
+                    owner,
+                    o.get("queue size", self.size),
+                    o.get("overflow", self.overflow),
+                )
+                worker.start()
+                self.workers[owner] = worker
+            return self.workers[owner]
 
+    def post(self, owner, function, key, value, udata, tag=None):
+        self.get_worker(owner).post(function, key, value, udata, tag)
 
-def _stop_update_thread():
-    global _update_thread
-    global _update_thread_stop
-    if _update_thread and _update_thread.is_alive():
-        _update_thread_stop.set()
-        _update_thread.join(timeout=_update_thread.delay + 1.0)
-    _update_thread = None
-    _update_thread_stop = None
+    def stop(self):
+        with self.lock:
+            for worker in self.workers.values():
+                worker.stop()
+            for worker in self.workers.values():
+                worker.join(1.0)
+            self.workers = {}
+
+    def get_status(self):
+        d = OrderedDict()
+        for owner in sorted(self.workers):
+            d[owner] = self.workers[owner].get_status()
+        return d
+
+
+# Start sending callbacks through per owner queues.  size is the default
+# queue size, overflow the default overflow policy and owners is a dictionary
+# of owner names that each hold a dictionary with 'queue size' and/or
+# 'overflow' to override the defaults for that owner.
+def start_dispatcher(size=256, overflow="conflate", owners=None):
+    global _dispatcher
+    stop_dispatcher()
+    _dispatcher = Dispatcher(size, overflow, owners)
+    log.info("Callback dispatcher started, overflow: {}".format(overflow))
+
+
+def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+    _dispatcher = None
+
+
+def dispatch_status():
+    if _dispatcher is None:
+        return None
+    return _dispatcher.get_status()
 
 
-def _start_update_thread():
-    global _update_thread
-    global _update_thread_stop
-    _update_thread_stop = threading.Event()
-    _update_thread = UpdateThread(update, 1.0, _update_thread_stop)
-    _update_thread.daemon = True
-    _update_thread.start()
+# Items share a fixed pool of locks instead of each having its own.  Nothing
+# holds the lock of more than one item at a time, except snapshot() which
+# takes all of them in order, so sharing cannot deadlock.
+LOCK_STRIPES = 64
+_locks = [threading.Lock() for i in range(LOCK_STRIPES)]
+
+# Shared by every item that has no aux data.  init_aux() gives the item its
+# own dictionary when there is something to put in it.
+_no_aux = MappingProxyType({})
+
+# The same goes for items that nothing has subscribed to.  _attach() gives the
+# item its own dictionary and _detach() puts this back when it is empty.
+_no_callbacks = MappingProxyType({})
 
 
 class db_item(object):
+    # Large databases are mostly made up of these so keep them small
+    __slots__ = (
+        "dtype",
+        "typestring",
+        "key",
+        "_value",
+        "description",
+        "units",
+        "_annunciate",
+        "_old",
+        "_bad",
+        "_fail",
+        "_secfail",
+        "_max",
+        "_min",
+        "_tol",
+        "timestamp",
+        "_deadline",
+        "_armed",
+        "seq",
+        "notify_on_change",
+        "_deadband",
+        "_reported",
+        "aux",
+        "callbacks",
+        "lock",
+    )
+
     def __init__(self, key, dtype="float"):
         types = {"float": float, "int": int, "bool": bool, "str": str}
         try:
@@ -78,14 +390,22 @@ class db_item(object):
         self._max = None
         self._min = None
         self._tol = 100  # Time to live in milliseconds.  Any older and quality is bad
-        self.timestamp = time.time()
-        self.aux = {}
-        self.callbacks = []
-        self.lock = threading.Lock()
+        self.timestamp = time.monotonic()
+        self._deadline = None  # When the item goes stale, None if never
+        self._armed = None  # Deadline the item is in the stale thread heap at
+        self.seq = 0  # Sequence number of the last change
+        self.notify_on_change = False  # Only send callbacks when something changed
+        self._deadband = 0  # Value changes smaller than this are not sent
+        self._reported = None  # Last value the callbacks were sent for
+        self.aux = _no_aux
+        self.callbacks = _no_callbacks  # (name, function, udata) tuples in the keys
+        self.lock = _locks[hash(key) % LOCK_STRIPES]
 
     # initialize the auxiliary data dictionary.  aux should be a comma delimited
     # string of the items to include.
     def init_aux(self, aux):
+        if aux and self.aux is _no_aux:
+            self.aux = {}
         for each in aux:
             self.aux[each.strip()] = None
 
@@ -93,24 +413,41 @@ class db_item(object):
         return list(self.aux.keys())
 
     def set_aux_value(self, name, value):
+        value = self._convert_aux(name, value)
+        with self.lock:
+            self.aux[name] = value
+            self._stamp(name)
+        self.send_aux_callbacks(name)
+
+    # Check and convert an aux value without storing it.  Raises KeyError for
+    # an unknown aux name and ValueError for a bad value.
+    def _convert_aux(self, name, value):
         if name not in self.aux:
             log.error("No aux {0} for {1}".format(name, self.description))
             log.error("{0} contains aux keys {1}".format(self.key, self.get_aux_list()))
             raise KeyError("Aux name {} not found for item {}".format(name, self.key))
         try:
-            self.aux[name] = self.dtype(value)
-            if self.aux[name] < self._min:
-                self.aux[name] = self._min
-            if self.aux[name] > self._max:
-                self.aux[name] = self._max
+            value = self.dtype(value)
+            if value < self._min:
+                value = self._min
+            if value > self._max:
+                value = self._max
         except ValueError:
             if value == "None":
-                self.aux[name] = None
+                value = None
             else:
                 log.error("Bad Value for aux {0} {1}".format(name, value))
                 raise
-        for func in self.callbacks:
-            func[1]("{0}.{1}".format(self.key, name), self.aux[name], func[2])
+        return value
+
+    def send_aux_callbacks(self, name):
+        key = "{0}.{1}".format(self.key, name)
+        value = self.aux[name]
+        for func in tuple(self.callbacks):
+            if _dispatcher is not None:
+                _dispatcher.post(func[0], func[1], key, value, func[2], get_origin())
+            else:
+                func[1](key, value, func[2])
 
     def get_aux_value(self, name):
         try:
@@ -119,11 +456,21 @@ class db_item(object):
             log.error("No aux {0} for {1}".format(name, self.description))
             raise
 
+    # Every callback is given the same value tuple so that subscribers can
+    # tell that they are looking at the same change.
     def send_callbacks(self):
-        for func in self.callbacks:
+        if not self.callbacks:
+            return
+        value = self.value
+        if _dispatcher is not None:
+            tag = get_origin()
+            for func in tuple(self.callbacks):
+                _dispatcher.post(func[0], func[1], self.key, value, func[2], tag)
+            return
+        for func in tuple(self.callbacks):
             log.debug("Calling Callback for {0}".format(self.key))
             try:
-                func[1](self.key, self.value, func[2])
+                func[1](self.key, value, func[2])
             except Exception as e:
                 log.error(
                     f"Callback name: {func[0]}, fixid: {self.key}, udata: {func[1]} function: {func[2]} exception: {e}"
@@ -132,7 +479,7 @@ class db_item(object):
     # return the age of the item in milliseconds
     @property
     def age(self):
-        return (time.time() - self.timestamp) * 1000
+        return (time.monotonic() - self.timestamp) * 1000
 
     @property
     def value(self):
@@ -155,48 +502,143 @@ class db_item(object):
     # contains the property flags as well.  (value, annunc, bad, fail)
     @value.setter
     def value(self, x):
+        state = self._convert(x)
         with self.lock:
-            if isinstance(x, tuple):
-                if len(x) < 4:
-                    raise ValueError("Tuple too small for {}".format(self.key))
-                self._annunciate = x[1]
-                self._bad = x[2]
-                self._fail = x[3]
-                if len(x) >= 5:
-                    self._secfail = x[4]
-                x = x[0]
-            if self.dtype is bool:
-                self._value = (
-                    x == True
-                    or (isinstance(x, str) and x.lower() in ["yes", "true", "1"])
-                    or (isinstance(x, int) and x != 0)
-                )
-            else:
+            notify = self._store(state)
+        if notify:
+            self.send_callbacks()
+
+    # Convert a value or value tuple into the state that would be stored in
+    # the item without changing anything.  Returns a tuple of
+    # (value, annunc, bad, fail, secfail) where flags that were not given
+    # are None.  Raises ValueError on bad data.
+    def _convert(self, x):
+        annunciate = bad = fail = secfail = None
+        if isinstance(x, tuple):
+            if len(x) < 4:
+                raise ValueError("Tuple too small for {}".format(self.key))
+            annunciate = x[1]
+            bad = x[2]
+            fail = x[3]
+            if len(x) >= 5:
+                secfail = x[4]
+            x = x[0]
+        if self.dtype is bool:
+            value = (
+                x == True
+                or (isinstance(x, str) and x.lower() in ["yes", "true", "1"])
+                or (isinstance(x, int) and x != 0)
+            )
+        else:
+            try:
+                if self.dtype is str and x is None:
+                    value = ""
+                else:
+                    value = self.dtype(x)
+            except ValueError:
+                log.error("Bad value '" + str(x) + "' given for " + self.description)
+                raise
+            if self.dtype is not str:
+                # bounds check and cap
                 try:
-                    if self.dtype is str and x is None:
-                        self._value = ""
-                    else:
-                        self._value = self.dtype(x)
-                except ValueError:
-                    log.error(
-                        "Bad value '" + str(x) + "' given for " + self.description
-                    )
-                    raise
-                if self.dtype is not str:
-                    # bounds check and cap
-                    try:
-                        if self._value < self._min:
-                            self._value = self._min
-                    except:  # Probably only fails if min has not been set
-                        pass  # ignore at this point
-                    try:
-                        if self._value > self._max:
-                            self._value = self._max
-                    except:  # Probably only fails if max has not been set
-                        pass  # ignore at this point
-                    # set the timestamp to right now
-            self.timestamp = time.time()
-        self.send_callbacks()
+                    if value < self._min:
+                        value = self._min
+                except:  # Probably only fails if min has not been set
+                    pass  # ignore at this point
+                try:
+                    if value > self._max:
+                        value = self._max
+                except:  # Probably only fails if max has not been set
+                    pass  # ignore at this point
+        return (value, annunciate, bad, fail, secfail)
+
+    # Set the value and any of the quality flags as a single operation.  Flags
+    # that are left as None are not changed.  The callbacks are sent at most
+    # once no matter how many of the flags changed.  Returns True if the value
+    # or any of the flags are different from what was stored before.
+    def update(self, value, annunciate=None, bad=None, fail=None, secfail=None):
+        state = list(self._convert(value))
+        for i, flag in enumerate((annunciate, bad, fail, secfail), 1):
+            if flag is not None:
+                state[i] = bool(flag)
+        with self.lock:
+            last = (
+                self._value,
+                self._annunciate,
+                self._bad,
+                self._fail,
+                self._secfail,
+            )
+            notify = self._store(state)
+            changed = last != (
+                self._value,
+                self._annunciate,
+                self._bad,
+                self._fail,
+                self._secfail,
+            )
+        if notify:
+            self.send_callbacks()
+        return changed
+
+    # Returns False if storing state would not change anything that the
+    # callbacks need to hear about.  Only items with notify_on_change or a
+    # deadband are ever quiet and they always notify when the old flag is set
+    # so that the clearing of the flag is seen.
+    def _should_notify(self, state):
+        if not (self.notify_on_change or self._deadband) or self._old:
+            return True
+        flags = (self._annunciate, self._bad, self._fail, self._secfail)
+        for current, new in zip(flags, state[1:]):
+            if new is not None and new != current:
+                return True
+        if self._deadband:
+            # Compared to the last value sent so slow drift is still reported
+            return (
+                self._reported is None
+                or abs(state[0] - self._reported) >= self._deadband
+            )
+        return state[0] != self._value
+
+    # Mark the item, or one of its aux values, as changed and add it to the
+    # journal.  Must be called with the lock held.
+    def _stamp(self, aux=None):
+        global _horizon
+        with _journal_lock:
+            self.seq = next(_sequence)
+            if len(_journal) == JOURNAL_SIZE:
+                _horizon = _journal[0][0]
+            _journal.append((self.seq, self.key if aux is None else self.key + "." + aux))
+
+    # Store a state tuple returned by _convert().  The caller must hold the
+    # lock and is responsible for sending the callbacks if this returns True.
+    # The timestamp is always refreshed even if the callbacks are not needed.
+    def _store(self, state):
+        notify = self._should_notify(state)
+        if notify:
+            self._reported = state[0]
+        self._value = state[0]
+        if state[1] is not None:
+            self._annunciate = state[1]
+        if state[2] is not None:
+            self._bad = state[2]
+        if state[3] is not None:
+            self._fail = state[3]
+        if state[4] is not None:
+            self._secfail = state[4]
+        # set the timestamp to right now
+        self.timestamp = time.monotonic()
+        self._stamp()
+        if self._tol:
+            self._deadline = self.timestamp + self._tol / 1000
+            # Only goes in the heap if it is not there already, unless the
+            # time to live was shortened
+            if _stale_thread is not None and (
+                self._armed is None or self._deadline < self._armed
+            ):
+                self._armed = self._deadline
+                _stale_thread.arm(self)
+        return notify
 
     @property
     def min(self):
@@ -237,6 +679,27 @@ class db_item(object):
         except ValueError:
             log.error("Time to live should be an integer for " + self.description)
 
+    # The deadband can be given as an absolute value or as a percentage of
+    # the range between min and max, i.e. "2%".  It is only used for float
+    # and int items.
+    @property
+    def deadband(self):
+        return self._deadband
+
+    @deadband.setter
+    def deadband(self, x):
+        try:
+            if isinstance(x, str) and x.strip().endswith("%"):
+                x = float(x.strip()[:-1]) * (self._max - self._min) / 100
+            x = abs(float(x or 0))
+        except (ValueError, TypeError):
+            log.error("Bad deadband '" + str(x) + "' given for " + self.description)
+            return
+        if x and self.dtype not in (int, float):
+            log.error("Deadband is only used for numbers " + self.description)
+            return
+        self._deadband = x
+
     @property
     def annunciate(self):
         with self.lock:
@@ -247,6 +710,8 @@ class db_item(object):
         with self.lock:
             last = self._annunciate
             self._annunciate = bool(x)
+            if self._annunciate != last:
+                self._stamp()
         if self._annunciate != last:
             self.send_callbacks()
 
@@ -260,6 +725,8 @@ class db_item(object):
         with self.lock:
             last = self._old
             self._old = bool(x)
+            if self._old != last:
+                self._stamp()
         if self._old != last:
             self.send_callbacks()
 
@@ -273,6 +740,8 @@ class db_item(object):
         with self.lock:
             last = self._bad
             self._bad = bool(x)
+            if self._bad != last:
+                self._stamp()
         if self._bad != last:
             self.send_callbacks()
 
@@ -286,6 +755,8 @@ class db_item(object):
         with self.lock:
             last = self._fail
             self._fail = bool(x)
+            if self._fail != last:
+                self._stamp()
         if self._fail != last:
             self.send_callbacks()
 
@@ -299,6 +770,8 @@ class db_item(object):
         with self.lock:
             last = self._secfail
             self._secfail = bool(x)
+            if self._secfail != last:
+                self._stamp()
         if self._secfail != last:
             self.send_callbacks()
 
@@ -353,7 +826,15 @@ def add_item(entry):
     else:
         newitem.value = entry.get("initial", None)
     newitem.init_aux(entry.get("aux", []))
+    newitem.notify_on_change = bool(entry.get("notify_on_change", False))
+    newitem.deadband = entry.get("deadband", 0)
     __database[entry["key"]] = newitem
+    with __callback_lock:
+        if __trie is not None:
+            _trie_insert(__trie, newitem.key)
+        for (name, spec, function, udata), match in __patterns.items():
+            if match(newitem.key):
+                _attach(name, newitem.key, function, udata)
     return newitem
 
 
@@ -361,12 +842,26 @@ def add_item(entry):
 def init(f):
     global log
     global __database
+    global __callbacks
+    global __patterns
+    global __explicit
+    global __trie
+    global _horizon
     global variables
-    _stop_update_thread()
+    _stop_stale_thread()
+    stop_dispatcher()
     __database = {}
+    __callbacks = {}
+    __patterns = {}
+    __explicit = {}
+    __trie = None
+    with _journal_lock:
+        _journal.clear()
+        _horizon = 0
     variables = {}
     log = logging.getLogger("database")
     log.info("Initializing Database")
+    _start_stale_thread()
 
     # Did not seem to be used: state = "var"
     # Load database
@@ -386,8 +881,6 @@ def init(f):
         else:
             add_item(entry)
 
-    _start_update_thread()
-
 
 # These are the public functions for interacting with the database
 def write(key, value):
@@ -400,6 +893,37 @@ def write(key, value):
         entry.value = value
 
 
+# Write several items in one call.  values is a dictionary of keys and
+# values (or value tuples) just like write().  Every key and value is checked
+# before anything is stored so a bad entry leaves the whole batch unapplied.
+# Each item's lock is taken once and the callbacks are only sent after the
+# whole batch has been stored, at most once per item written.
+def write_many(values):
+    items = []
+    auxes = []
+    for key, value in values.items():
+        if "." in key:
+            x = key.split(".")
+            entry = __database[x[0]]
+            auxes.append((entry, x[1], entry._convert_aux(x[1], value)))
+        else:
+            entry = __database[key]
+            items.append((entry, entry._convert(value)))
+    notify = []
+    for entry, state in items:
+        with entry.lock:
+            if entry._store(state):
+                notify.append(entry)
+    for entry, name, value in auxes:
+        with entry.lock:
+            entry.aux[name] = value
+            entry._stamp(name)
+    for entry in notify:
+        entry.send_callbacks()
+    for entry, name, value in auxes:
+        entry.send_aux_callbacks(name)
+
+
 def read(key):
     if "." in key:
         x = key.split(".")
@@ -409,6 +933,99 @@ def read(key):
         return __database[key].value
 
 
+# The state of an item in a snapshot.  The first six fields are the same as
+# the tuple returned by read().  aux is a read only mapping.
+ItemState = namedtuple(
+    "ItemState",
+    ["value", "annunciate", "old", "bad", "fail", "secfail", "timestamp", "seq", "aux"],
+)
+
+
+# A read only mapping of keys to ItemState returned by snapshot().  seq can be
+# given as since to a later snapshot() to only get the items changed after
+# this one was taken.
+class Snapshot(Mapping):
+    def __init__(self, items, seq):
+        self._items = items
+        self.seq = seq
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Returns a Snapshot of the items in keys, the keys that start with prefix
+# (a string or list of strings) or the whole database.  If since is given only
+# the items that have changed after that sequence number are included.  Every
+# lock is held while the snapshot is taken so it is a consistent view of the
+# database at one point in time.
+def snapshot(keys=None, prefix=None, since=None):
+    if keys is not None:
+        items = [__database[key] for key in keys]
+    elif prefix is not None:
+        if isinstance(prefix, str):
+            prefix = [prefix]
+        with __callback_lock:
+            found = dict.fromkeys(k for p in prefix for k in _prefix_keys(p))
+        items = [__database[key] for key in found]
+    else:
+        items = list(__database.values())
+    result = {}
+    for lock in _locks:
+        lock.acquire()
+    try:
+        seq = next(_sequence)
+        now = time.monotonic()
+        for item in items:
+            if since is not None and item.seq <= since:
+                continue
+            if item._tol:
+                old = (now - item.timestamp) * 1000 > item._tol
+            else:
+                old = item._old
+            result[item.key] = ItemState(
+                item._value,
+                item._annunciate,
+                old,
+                item._bad,
+                item._fail,
+                item._secfail,
+                item.timestamp,
+                item.seq,
+                MappingProxyType(dict(item.aux)) if item.aux else _no_aux,
+            )
+    finally:
+        for lock in _locks:
+            lock.release()
+    return Snapshot(result, seq)
+
+
+# Returns a dictionary of the keys that have changed after seq, each with the
+# seq of its last change, in the order of those changes.  seq can be the seq
+# of a snapshot or one returned here before.  None is returned if changes
+# after seq have already been pushed out of the journal, the caller needs to
+# take a new snapshot() to catch up.
+def changes_since(seq):
+    with _journal_lock:
+        if seq < _horizon:
+            return None
+        changes = []
+        for entry in reversed(_journal):
+            if entry[0] <= seq:
+                break
+            changes.append(entry)
+    result = {}
+    for each, key in reversed(changes):
+        result.pop(key, None)
+        result[key] = each
+    return result
+
+
 def get_raw_item(key):
     return __database[key]
 
@@ -417,31 +1034,191 @@ def listkeys():
     return list(__database.keys())
 
 
+def _trie_insert(trie, key):
+    node = trie
+    for ch in key:
+        node = node.setdefault(ch, {})
+    node[""] = key
+
+
+# Returns a list of all the keys that start with prefix
+def _prefix_keys(prefix):
+    global __trie
+    if __trie is None:
+        __trie = {}
+        for key in __database:
+            _trie_insert(__trie, key)
+    node = __trie
+    for ch in prefix:
+        node = node.get(ch)
+        if node is None:
+            return []
+    keys = []
+    nodes = [node]
+    while nodes:
+        for ch, child in nodes.pop().items():
+            if ch:
+                nodes.append(child)
+            else:
+                keys.append(child)
+    return keys
+
+
+# These two must be called with __callback_lock held
+def _attach(name, key, function, udata):
+    item = __database[key]
+    if item.callbacks is _no_callbacks:
+        item.callbacks = {(name, function, udata): None}
+    else:
+        item.callbacks[(name, function, udata)] = None
+    owner = __callbacks.setdefault(name, {})
+    owner.setdefault((function, udata), set()).add(key)
+
+
+def _detach(name, key, function, udata):
+    item = __database[key]
+    if (name, function, udata) not in item.callbacks:
+        return False
+    del item.callbacks[(name, function, udata)]
+    if not item.callbacks:
+        item.callbacks = _no_callbacks
+    owner = __callbacks.get(name, {})
+    keys = owner.get((function, udata), set())
+    keys.discard(key)
+    if not keys:
+        owner.pop((function, udata), None)
+    if not owner:
+        __callbacks.pop(name, None)
+    return True
+
+
 # Adds or redefines the callback function that will be called when
-# the items value is set.
+# the items value is set.  Returns a handle that can be given to
+# callback_remove() to delete the callback again.  Callbacks are kept in
+# dictionaries keyed on (name, function, udata) so udata must be hashable, and
+# adding the same one to a key twice only registers it once.
 def callback_add(name, key, function, udata):
-    item = __database[key]
-    item.callbacks.append((name, function, udata))
+    with __callback_lock:
+        _attach(name, key, function, udata)
+        __explicit.setdefault((name, function, udata), set()).add(key)
     log.debug("Adding callback function for %s on key %s" % (name, key))
+    return (name, key, function, udata)
+
 
+# The match functions of the pattern subscriptions of a callback.  Must be
+# called with __callback_lock held.
+def _owner_patterns(name, function, udata):
+    return [
+        match
+        for handle, match in __patterns.items()
+        if handle[0] == name and handle[2:] == (function, udata)
+    ]
 
+
+# key can be "*" to delete the callback from every key it was added to,
+# including any prefix or regular expression subscriptions.  Otherwise the
+# callback stays on the key if a pattern subscription of it still covers it.
 def callback_del(name, key, function, udata):
     if key == "*":
-        for each in __database:
-            try:
-                __database[each].callbacks.remove((name, function, udata))
+        with __callback_lock:
+            for handle in list(__patterns):
+                if handle[0] == name and handle[2:] == (function, udata):
+                    del __patterns[handle]
+            __explicit.pop((name, function, udata), None)
+            keys = __callbacks.get(name, {}).get((function, udata), set())
+            for each in list(keys):
+                _detach(name, each, function, udata)
                 log.debug("Deleting callback function for %s on key %s" % (name, each))
-            except ValueError:
-                pass
     else:
         log.debug("Deleting callback function for %s on key %s" % (name, key))
-        try:
-            __database[key].callbacks.remove((name, function, udata))
-        except ValueError:
-            log.debug("Callback not deleted because it was not found in the list")
+        with __callback_lock:
+            explicit = __explicit.get((name, function, udata), set())
+            explicit.discard(key)
+            if not explicit:
+                __explicit.pop((name, function, udata), None)
+            if key in __database and any(
+                match(key) for match in _owner_patterns(name, function, udata)
+            ):
+                return
+            if not _detach(name, key, function, udata):
+                log.debug("Callback not deleted because it was not found in the list")
+
+
+def _pattern_add(name, spec, match, keys, function, udata):
+    handle = (name, spec, function, udata)
+    with __callback_lock:
+        __patterns[handle] = match
+        for key in keys():
+            _attach(name, key, function, udata)
+    log.debug("Adding callback function for %s on %s %s" % (name, spec[0], spec[1]))
+    return handle
+
+
+def _pattern_del(name, spec, function, udata):
+    with __callback_lock:
+        match = __patterns.pop((name, spec, function, udata))
+        # Keys that were also added one at a time or that another pattern
+        # subscription of the same callback matches are left alone
+        explicit = __explicit.get((name, function, udata), set())
+        others = _owner_patterns(name, function, udata)
+        keys = __callbacks.get(name, {}).get((function, udata), set())
+        for key in [k for k in keys if match(k) and k not in explicit]:
+            if not any(other(key) for other in others):
+                _detach(name, key, function, udata)
+    log.debug("Deleting callback function for %s on %s %s" % (name, spec[0], spec[1]))
+
+
+# Add the callback function to every key that starts with prefix, now and
+# for keys that are added to the database later.  Returns a handle for
+# callback_remove().
+def callback_add_prefix(name, prefix, function, udata=None):
+    return _pattern_add(
+        name,
+        ("prefix", prefix),
+        lambda key: key.startswith(prefix),
+        lambda: _prefix_keys(prefix),
+        function,
+        udata,
+    )
+
+
+# Raises KeyError if there is no such prefix subscription.  Keys that the
+# callback was also added to one at a time, or that another of its prefix or
+# regular expression subscriptions covers, keep the callback.
+def callback_del_prefix(name, prefix, function, udata=None):
+    _pattern_del(name, ("prefix", prefix), function, udata)
+
+
+# Same as callback_add_prefix() but for every key that regex matches.
+def callback_add_regex(name, regex, function, udata=None):
+    match = re.compile(regex).match
+    return _pattern_add(
+        name,
+        ("regex", regex),
+        lambda key: match(key) is not None,
+        lambda: [key for key in __database if match(key)],
+        function,
+        udata,
+    )
+
+
+def callback_del_regex(name, regex, function, udata=None):
+    _pattern_del(name, ("regex", regex), function, udata)
+
+
+# Delete a callback using the handle returned by one of the callback_add
+# functions
+def callback_remove(handle):
+    if isinstance(handle[1], tuple):
+        _pattern_del(*handle)
+    else:
+        callback_del(*handle)
 
 
 # Maintenance Functions
+
+# Check every item for staleness.  The stale thread normally takes care of
+# this as each item expires, this forces a check of the whole database.
 def update():
     for key, item in list(__database.items()):
         if item.age > item.tol and item.tol != 0:
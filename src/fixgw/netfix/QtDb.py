@@ -19,8 +19,9 @@
 # as they would be expected to act.
 
 import logging
+import threading
 
-from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
 
 import fixgw.netfix
 import fixgw.netfix.db
@@ -28,7 +29,40 @@ import fixgw.netfix.db
 log = logging.getLogger(__name__)
 
 
-# This class represents a single data point in the database.
+# Holds on to the signals that items want to emit and emits them from the
+# GUI thread rate times a second.  If an item changes more than once between
+# frames only the last change is emitted.  This keeps a fast data stream from
+# flooding the GUI thread with a queued signal for every change.  It has to
+# be created in the GUI thread.
+class SignalCoalescer(QObject):
+    def __init__(self, rate=30):
+        super(SignalCoalescer, self).__init__()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(max(1, round(1000 / rate)))
+
+    # Called from any thread.  name tells apart the aux values of an item,
+    # which each keep their own last change.
+    def post(self, item, signal, args, name=None):
+        with self.lock:
+            self.pending[(item, signal, name)] = args
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        for (item, signal, name), args in pending.items():
+            getattr(item, signal).emit(*args)
+
+    def stop(self):
+        self.timer.stop()
+        self.flush()
+
+
+# This class represents a single data point in the database.  If coalescer
+# is given the signals are emitted through it.
 class QtDB_Item(QObject):
     valueChanged = pyqtSignal(object)
     valueWrite = pyqtSignal(object)
@@ -41,12 +75,13 @@ class QtDB_Item(QObject):
     reportReceived = pyqtSignal(bool)
     destroyed = pyqtSignal()
 
-    def __init__(self, key, item):
+    def __init__(self, key, item, coalescer=None):
         super(QtDB_Item, self).__init__()
         if key is None:
             raise ValueError("Trying to create a Null Item")
         self.key = key
         self._item = item
+        self.coalescer = coalescer
 
         log.debug("Creating Qt Item {0}".format(key))
         item.valueChanged = self.valueChangedFunc
@@ -60,35 +95,41 @@ class QtDB_Item(QObject):
         item.reportReceived = self.reportReceivedFunc
         item.destroyed = self.destroyedFunc
 
+    def emit(self, signal, *args, name=None):
+        if self.coalescer is None:
+            getattr(self, signal).emit(*args)
+        else:
+            self.coalescer.post(self, signal, args, name)
+
     def valueChangedFunc(self, value):
-        self.valueChanged.emit(value)
+        self.emit("valueChanged", value)
 
     def valueWriteFunc(self, value):
-        self.valueWrite.emit(value)
+        self.emit("valueWrite", value)
 
     def annunciateChangedFunc(self, value):
-        self.annunciateChanged.emit(value)
+        self.emit("annunciateChanged", value)
 
     def oldChangedFunc(self, value):
-        self.oldChanged.emit(value)
+        self.emit("oldChanged", value)
 
     def badChangedFunc(self, value):
-        self.badChanged.emit(value)
+        self.emit("badChanged", value)
 
     def failChangedFunc(self, value):
-        self.failChanged.emit(value)
+        self.emit("failChanged", value)
 
     def secFailChangedFunc(self, value):
-        self.secFailChanged.emit(value)
+        self.emit("secFailChanged", value)
 
     def auxChangedFunc(self, name, value):
-        self.auxChanged.emit(name, value)
+        self.emit("auxChanged", name, value, name=name)
 
     def reportReceivedFunc(self, value):
-        self.reportReceived.emit(value)
+        self.emit("reportReceived", value)
 
     def destroyedFunc(self):
-        self.destroyed.emit()
+        self.emit("destroyed")
 
     def __str__(self):
         s = "{} = {}".format(self.key, self._value)
@@ -193,11 +234,15 @@ class QtDB_Item(QObject):
         return self._item.get_aux_value(name)
 
 
+# If frame_rate is given the item signals are held and emitted that many
+# times a second with only the latest change of each item.  A display only
+# needs to redraw once a frame however fast the data is coming in.
 class Database(object):
-    def __init__(self, client):
+    def __init__(self, client, frame_rate=None):
         self.__db = fixgw.netfix.db.Database(client)  # main netfix client database
         self.__items = {}
         self.client = client
+        self.coalescer = SignalCoalescer(frame_rate) if frame_rate else None
         global log
         log = logging.getLogger(__name__)
         if self.__db.connected:
@@ -217,7 +262,9 @@ class Database(object):
         try:
             keys = self.__db.get_item_list()
             for key in keys:
-                self.__items[key] = QtDB_Item(key, self.__db.get_item(key))
+                self.__items[key] = QtDB_Item(
+                    key, self.__db.get_item(key), self.coalescer
+                )
 
         except Exception as e:
             log.error(e)
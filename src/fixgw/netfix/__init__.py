@@ -21,9 +21,18 @@ import socket
 import logging
 import time
 import queue
+import re
+import collections
+import contextlib
+import concurrent.futures
+from . import binary
+from . import framing
 
 log = logging.getLogger(__name__)
 
+# The key in a command response ends at the first ; or !
+_response_key = re.compile(r"[;!]")
+
 
 class ResponseError(Exception):
     pass
@@ -75,19 +84,49 @@ class ClientThread(threading.Thread):
         # and False for disconnected
         self.connectCallback = None
         self.dataCallback = None
+        # Set to ask the server for the binary protocol when we connect
+        self.useBinary = False
+        self.negotiating = False
+        self.framer = framing.Framer()
+        self.keys = {}  # Key numbers from the server in binary mode
+        self.key_ids = {}
+        # Commands that are waiting on a response.  The key is the command
+        # letter and the item key and the value is a deque of (number,
+        # future, parse) in the order the commands were sent.
+        self.requests = {}
+        self.requestLock = threading.Lock()
+        self.sendLock = threading.RLock()
+        self.requestNumber = 0
+        self.streamNumber = None  # Set while a multi line response is read
+
+    # True once the server has agreed to the binary protocol
+    @property
+    def binary(self):
+        return self.framer.binary
+
+    @binary.setter
+    def binary(self, on):
+        self.framer.binary = on
 
     def connectedState(self, connected):
         if connected:
             self.connectedEvent.set()
         else:
             self.connectedEvent.clear()
+            self.failRequests()
         if self.connectCallback is not None:
             self.connectCallback(connected)
 
     def handle_request(self, d):
         log.debug("Response - {}".format(d))
+        if self.negotiating and d.startswith("@xbinary"):
+            # Servers that don't know the binary protocol return an error
+            self.binary = d == "@xbinary"
+            self.negotiating = False
+            self.connectedState(True)
+            return
         if d[0] == "@":
-            self.cmdqueue.put([d[1], d[2:]])
+            self.handle_response(d[1], d[2:])
         else:
             x = d.split(";")
             if len(x) != 3 and len(x) != 2:
@@ -109,26 +148,119 @@ class ClientThread(threading.Thread):
             if self.dataCallback:
                 self.dataCallback(x)
 
+    # Give a command response to the oldest command waiting on it.  Responses
+    # that no command is waiting on, like those to @l and @xsync, are put in
+    # cmdqueue for getResponse().  While one of those is being read a
+    # response only goes to a waiting command that was sent before it because
+    # the server answers commands in order.
+    def handle_response(self, c, d):
+        key = _response_key.split(d, 1)[0]
+        request = None
+        with self.requestLock:
+            waiting = self.requests.get((c, key))
+            if waiting and (
+                self.streamNumber is None or waiting[0][0] < self.streamNumber
+            ):
+                request = waiting.popleft()
+                if not waiting:
+                    del self.requests[(c, key)]
+        if request is None:
+            self.cmdqueue.put([c, d])
+            return
+        n, future, parse = request
+        # The future is cancelled if the caller gave up waiting on it.  The
+        # response is used up here so that it isn't given to the next caller.
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = d if parse is None else parse(d)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    # Commands that are still waiting when the connection is lost will never
+    # be answered.
+    def failRequests(self):
+        with self.requestLock:
+            requests = self.requests
+            self.requests = {}
+        for waiting in requests.values():
+            for n, future, parse in waiting:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(NotConnectedError("Connection lost"))
+
+    # Handle a message from the server.  In ASCII mode every line is a TEXT
+    # frame.
+    def handle_frame(self, ftype, payload):
+        if ftype == binary.TEXT:
+            self.handle_request(payload.decode("utf-8"))
+        elif ftype == binary.KEY:
+            n, key = binary.decode_key(payload)
+            self.keys[n] = key
+            self.key_ids[key] = n
+        elif ftype == binary.VALUES:
+            for n, value, flags in binary.decode_values(payload):
+                x = [self.keys[n], value]
+                if flags is not None:
+                    x.append("".join(c for c, on in zip("aobfs", flags) if on))
+                if self.dataCallback:
+                    self.dataCallback(x)
+
+    # Handle every complete message in data.  Anything left over is kept
+    # until the rest of it arrives.
+    def receive(self, data):
+        self.framer.feed(data)
+        for ftype, payload in self.framer:
+            try:
+                self.handle_frame(ftype, payload)
+            except Exception as e:
+                try:
+                    request = payload.decode("utf-8")
+                except UnicodeDecodeError:
+                    request = bytes(payload)
+                # TODO: Print file and line number here.  Use traceback module
+                log.error("Error handling request {} - {}".format(request, e))
+
     def run(self):
         log.debug("ClientThread - Starting")
         while True:
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # A host of unix:<path> connects to the server's Unix domain
+            # socket and the port is not used
+            if self.host.startswith("unix:"):
+                self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                address = self.host[5:]
+            else:
+                self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                address = (self.host, self.port)
             self.s.settimeout(self.timeout)
 
             try:
-                self.s.connect((self.host, self.port))
+                self.s.connect(address)
             except Exception as e:
                 log.debug("Failed to connect {0}".format(e))
             else:
                 log.debug("Connected to {0}:{1}".format(self.host, self.port))
-                self.connectedState(True)
+                self.failRequests()
+                self.framer = framing.Framer()
+                self.keys = {}
+                self.key_ids = {}
+                if self.useBinary:
+                    # We are connected once the server answers
+                    self.negotiating = True
+                    self.s.sendall("@xbinary\n".encode())
+                else:
+                    self.connectedState(True)
 
-                buff = ""
                 while True:
                     try:
                         data = self.s.recv(1024)
                     except socket.timeout:
+                        if self.negotiating:
+                            log.debug("No answer to @xbinary, using ASCII")
+                            self.negotiating = False
+                            self.connectedState(True)
                         if self.getout:
                             self.connectedState(False)
                             self.s.close()
@@ -142,26 +274,7 @@ class ClientThread(threading.Thread):
                             self.connectedState(False)
                             break
                         else:
-                            try:
-                                dstring = data.decode("utf-8")
-                            except UnicodeDecodeError:
-                                self.log.debug(
-                                    "Bad Message from {0}".format(self.addr[0])
-                                )
-                            for d in dstring:
-                                if d == "\n":
-                                    try:
-                                        self.handle_request(buff)
-                                    except Exception as e:
-                                        # TODO: Print file and line number here.  Use traceback module
-                                        log.error(
-                                            "Error handling request {} - {}".format(
-                                                buff, e
-                                            )
-                                        )
-                                    buff = ""
-                                else:
-                                    buff += d
+                            self.receive(data)
             if self.getout:
                 self.connectedState(False)
                 self.s.close()
@@ -183,22 +296,86 @@ class ClientThread(threading.Thread):
     def isConnected(self):
         return self.connectedEvent.is_set()
 
+    # c is the command letter of the response we want.  It can be more than
+    # one letter to wait for any of several commands.  Only responses that no
+    # command is waiting on come here, see handle_response().
     def getResponse(self, c, timeout=1.0):
         # TODO Check for errors and report those as well
         if not self.isConnected():
             raise ResponseError("Not Connected to Server")
         try:
             x = self.cmdqueue.get(timeout=1.0)
-            while x[0] != c:
+            while x[0] not in c:
+                log.warning("Unexpected response @{}{}".format(x[0], x[1]))
                 x = self.cmdqueue.get(timeout=1.0)
             return x
         except queue.Empty:
             raise ResponseError("Timeout waiting on data")
 
+    # Send a command and return a concurrent.futures.Future for the response.
+    # c is the command letter and key is the item key, or the name of the @x
+    # command, that the server puts in the response.  Responses are given to
+    # commands with the same letter and key in the order they were sent so
+    # any number of commands can be sent without waiting for the answers.
+    # parse is called with the response, less the @ and the letter, and the
+    # future gets what it returns or the exception that it raises.
+    def request(self, line, c, key, parse=None):
+        future = concurrent.futures.Future()
+        with self.sendLock:
+            with self.requestLock:
+                self.requestNumber += 1
+                self.requests.setdefault((c, key), collections.deque()).append(
+                    (self.requestNumber, future, parse)
+                )
+            try:
+                self.send(line)
+            except Exception:
+                with self.requestLock:
+                    waiting = self.requests.get((c, key))
+                    if waiting and waiting[-1][1] is future:
+                        waiting.pop()
+                        if not waiting:
+                            del self.requests[(c, key)]
+                raise
+        return future
+
+    # Send a command that is answered with several responses, like @l and
+    # @xsync, and read the responses with getResponse() inside the with
+    # block.  Only one of these can be read at a time.
+    @contextlib.contextmanager
+    def stream(self, line):
+        with self.sendLock:
+            with self.requestLock:
+                self.requestNumber += 1
+                self.streamNumber = self.requestNumber
+            # Anything left in the queue has nobody waiting on it
+            while not self.cmdqueue.empty():
+                x = self.cmdqueue.get_nowait()
+                log.debug("Dropping unexpected response @{}{}".format(x[0], x[1]))
+            try:
+                self.send(line)
+            except Exception:
+                self.streamNumber = None
+                raise
+        try:
+            yield
+        finally:
+            with self.requestLock:
+                self.streamNumber = None
+
     def send(self, s):
         if not self.isConnected():
             raise NotConnectedError("Not Connected to Server")
-        self.s.send(s)
+        if self.binary:
+            s = binary.text_frame(s)
+        with self.sendLock:
+            self.s.sendall(s)
+
+    # Send an already encoded binary frame
+    def sendFrame(self, frame):
+        if not self.isConnected():
+            raise NotConnectedError("Not Connected to Server")
+        self.s.sendall(frame)
 
 
 def decodeDataString(d):
@@ -225,11 +402,30 @@ def decodeDataString(d):
         return (id, v)
 
 
+def _report(d):
+    if "!" in d:
+        e = d.split("!")
+        if e[1] == "001":
+            raise ResponseError("Key Not Found {}".format(e[0]))
+        else:
+            raise ResponseError("Response Error {} for {}".format(e[1], e[0]))
+    return d.split(";")
+
+
+# The methods that end in Future send the command and return a
+# concurrent.futures.Future for the result without waiting for the server.
+# Any number of them can be sent at once from any number of threads and they
+# are completed as the responses come in.  The other methods send the command
+# and wait for the result.
 class Client:
-    def __init__(self, host, port, timeout=1.0):
+    # If binary is True the client asks the server for the binary protocol
+    # and uses ASCII if the server doesn't support it.
+    def __init__(self, host, port, timeout=1.0, binary=False):
         self.cthread = ClientThread(host, port)
         self.cthread.timeout = timeout
+        self.cthread.useBinary = binary
         self.cthread.daemon = True
+        # Only one command with several responses can be read at a time
         self.lock = threading.Lock()
 
     def connect(self):
@@ -255,70 +451,123 @@ class Client:
     def clearConnectCallback(self):
         self.cthread.connectCallback = None
 
+    # Wait for the result of one of the Future methods.  If the server
+    # doesn't answer in time the future is cancelled, the response is thrown
+    # away when it does come.
+    def wait(self, future):
+        try:
+            return future.result(self.cthread.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ResponseError("Timeout waiting on data")
+
     def getList(self):
-        with self.lock:
-            self.cthread.send("@l{}\n".format(id).encode())
-            total = []
-            # Need to loop over multiple responses
-            done = False
-            while not done:
-                try:
-                    res = self.cthread.getResponse("l")
-                    a = res[1].split(";")
-                    # print(f"###############\n{a[2].split(',')}")
+        total = []
+        with self.lock, self.cthread.stream("@l\n".encode()):
+            # Each response is the number of keys, the number sent before
+            # this one and the keys
+            while True:
+                res = self.cthread.getResponse("l")
+                a = res[1].split(";")
+                if a[2]:
                     total = total + a[2].split(",")
-                except:
-                    done = True
+                if int(a[1]) + len(a[2].split(",")) >= int(a[0]):
+                    break
         return total
 
+    def getReportFuture(self, id):
+        return self.cthread.request("@q{}\n".format(id).encode(), "q", id, _report)
+
     def getReport(self, id):
-        with self.lock:
-            self.cthread.send("@q{}\n".format(id).encode())
-            res = self.cthread.getResponse("q")
-            if "!" in res[1]:
-                e = res[1].split("!")
-                if e[1] == "001":
-                    raise ResponseError("Key Not Found {}".format(e[0]))
+        return self.wait(self.getReportFuture(id))
+
+    # Get the report, value and aux values of many keys with one command.
+    # spec is "*" for every key, a prefix ending in "*" or a list of keys.  If
+    # subscribe is True the server subscribes us to the keys as well.  Returns
+    # a list of (key, Report, value, aux) tuples where value is the same as
+    # read() returns and aux is a dictionary of the aux values.  Raises
+    # ResponseError if the server doesn't have the @xsync command.
+    def sync(self, spec="*", subscribe=False):
+        if not isinstance(spec, str):
+            spec = ",".join(spec)
+        line = "@xsync;{}{}\n".format(spec, ";s" if subscribe else "")
+        with self.lock, self.cthread.stream(line.encode()):
+            result = []
+            while True:
+                res = self.cthread.getResponse("qrx")
+                if res[0] == "x":
+                    if not res[1].startswith("sync"):
+                        continue
+                    if "!" in res[1]:
+                        raise ResponseError("Server does not support sync")
+                    return result
+                if "!" in res[1]:
+                    continue  # A key that the server doesn't have
+                if res[0] == "q":
+                    a = res[1].split(";")
+                    result.append((a[0], Report(a), None, {}))
                 else:
-                    raise ResponseError("Response Error {} for {}".format(e[1], e[0]))
-            a = res[1].split(";")
-            return a
+                    x = decodeDataString(res[1])
+                    key, _, aux = x[0].partition(".")
+                    last = result[-1]
+                    if aux:
+                        last[3][aux] = x[1]
+                    else:
+                        result[-1] = (last[0], last[1], x, last[3])
+
+    def readFuture(self, id):
+        return self.cthread.request(
+            "@r{}\n".format(id).encode(), "r", id, decodeDataString
+        )
 
     def read(self, id):
-        with self.lock:
-            self.cthread.send("@r{}\n".format(id).encode())
-            res = self.cthread.getResponse("r")
-            return decodeDataString(res[1])
+        return self.wait(self.readFuture(id))
+
+    def isBinary(self):
+        return self.cthread.binary
 
+    # The server doesn't answer value writes so there is nothing to wait for
     def write(self, id, value, flags=""):
-        with self.lock:
-            a = "1" if "a" in flags else "0"
-            b = "1" if "b" in flags else "0"
-            f = "1" if "f" in flags else "0"
-            s = "1" if "s" in flags else "0"
-            sendStr = "{0};{1};{2}{3}{4}{5}\n".format(id, value, a, b, f, s)
-            self.cthread.send(sendStr.encode())
+        if getattr(self.cthread, "binary", False) and id in self.cthread.key_ids:
+            n = self.cthread.key_ids[id]
+            f = tuple(c in flags for c in "aobfs")
+            self.cthread.sendFrame(binary.values_frame([(n, (value,) + f)]))
+            return
+        a = "1" if "a" in flags else "0"
+        b = "1" if "b" in flags else "0"
+        f = "1" if "f" in flags else "0"
+        s = "1" if "s" in flags else "0"
+        sendStr = "{0};{1};{2}{3}{4}{5}\n".format(id, value, a, b, f, s)
+        self.cthread.send(sendStr.encode())
+
+    # Write a value and its flags in one value sentence and read the item
+    # back.  The server handles commands in order so the read answers after
+    # the write has been done and gives what the server ended up with.  The
+    # result is the same as read() returns.
+    def writeStateFuture(self, id, value, flags=""):
+        with self.cthread.sendLock:
+            self.write(id, value, flags)
+            return self.readFuture(id)
+
+    def writeState(self, id, value, flags=""):
+        return self.wait(self.writeStateFuture(id, value, flags))
+
+    def subscribeFuture(self, id):
+        return self.cthread.request("@s{}\n".format(id).encode(), "s", id)
 
     def subscribe(self, id):
-        with self.lock:
-            self.cthread.send("@s{}\n".format(id).encode())
-            res = self.cthread.getResponse("s")
+        self.wait(self.subscribeFuture(id))
+
+    def unsubscribeFuture(self, id):
+        return self.cthread.request("@u{}\n".format(id).encode(), "u", id)
 
     def unsubscribe(self, id):
-        with self.lock:
-            self.cthread.send("@u{}\n".format(id).encode())
-            res = self.cthread.getResponse("u")
+        self.wait(self.unsubscribeFuture(id))
 
-    def flag(self, id, flag, setting):
-        with self.lock:
-            if setting:
-                s = "1"
-            else:
-                s = "0"
-            self.cthread.send("@f{};{};{}\n".format(id, flag.lower(), s).encode())
-            res = self.cthread.getResponse("f")
-            if "!" in res[1]:
-                e = res[1].split("!")
+    def flagFuture(self, id, flag, setting):
+        def parse(d):
+            if "!" in d:
+                e = d.split("!")
                 if e[1] == "001":
                     raise ResponseError("Key Not Found {}".format(e[0]))
                 elif e[1] == "002":
@@ -326,19 +575,24 @@ class Client:
                 else:
                     raise ResponseError("Response Error {} for {}".format(e[1], e[0]))
 
+        s = "1" if setting else "0"
+        line = "@f{};{};{}\n".format(id, flag.lower(), s)
+        return self.cthread.request(line.encode(), "f", id, parse)
+
+    def flag(self, id, flag, setting):
+        self.wait(self.flagFuture(id, flag, setting))
+
+    def writeValueFuture(self, id, value):
+        return self.cthread.request("@w{};{}\n".format(id, value).encode(), "w", id)
+
     def writeValue(self, id, value):
-        with self.lock:
-            self.cthread.send("@w{};{}\n".format(id, value).encode())
-            res = self.cthread.getResponse("w")
-            return res[1]
+        return self.wait(self.writeValueFuture(id, value))
 
     def getStatus(self):
-        with self.lock:
-            self.cthread.send("@xstatus\n".encode())
-            res = self.cthread.getResponse("x")
-        return res[1][7:]
+        future = self.cthread.request(
+            "@xstatus\n".encode(), "x", "status", lambda d: d[7:]
+        )
+        return self.wait(future)
 
     def stop(self):
-        with self.lock:
-            self.cthread.send("@xkill\n".encode())
-            res = self.cthread.getResponse("x")
+        self.wait(self.cthread.request("@xkill\n".encode(), "x", "kill"))
@@ -0,0 +1,609 @@
+#  Copyright (c) 2026 The FIX-Gateway Contributors
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# An asyncio version of the Net-FIX client library.  Client and Database do
+# the same jobs as fixgw.netfix.Client and fixgw.netfix.db.Database but run
+# in an event loop instead of a thread for each connection, so one program
+# can talk to many gateways.
+#
+#   client = Client("127.0.0.1", 3490)
+#   await client.connect()
+#   print(await client.read("ALT"))
+#   await client.subscribe("ALT")
+#   async for update in client.updates():
+#       print(update)
+#
+# Commands can be sent from as many tasks as you like without waiting for
+# each other, the responses are matched up the same way as in Client.  If the
+# connection is lost the client keeps trying to connect again, waiting twice
+# as long after each failure up to max_backoff seconds, and subscribes to the
+# same keys again once it is back.  Everything has to be used from the event
+# loop that connect() was called from.
+
+import asyncio
+import collections
+import logging
+
+from . import binary
+from . import framing
+from .db import DB_Item as _DB_Item
+from . import (
+    NotConnectedError,
+    Report,
+    ResponseError,
+    _report,
+    _response_key,
+    decodeDataString,
+)
+
+log = logging.getLogger(__name__)
+
+# The names of the DB_Item properties for each of the flag letters
+FLAGS = {"a": "annunciate", "o": "old", "b": "bad", "f": "fail", "s": "secFail"}
+
+
+class Client:
+    # If binary is True the client asks the server for the binary protocol
+    # and uses ASCII if the server doesn't support it.  A host of unix:<path>
+    # connects to the server's Unix domain socket.
+    def __init__(
+        self, host, port=3490, timeout=1.0, binary=False, backoff=0.5, max_backoff=30.0
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.useBinary = binary
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Called with True when we connect and False when the connection is
+        # lost.  dataCallback is called with every value update like the
+        # ones updates() gives.
+        self.connectCallback = None
+        self.dataCallback = None
+        self.subscriptions = set()  # Subscribed to again when we reconnect
+        self.listeners = set()
+        self.writer = None
+        self.task = None
+        self.connected = None
+        self.framer = framing.Framer()
+        self.negotiating = False
+        self.keys = {}  # Key numbers from the server in binary mode
+        self.key_ids = {}
+        # Commands that are waiting on a response by command letter and key,
+        # see fixgw.netfix.ClientThread.request()
+        self.requests = {}
+        self.requestNumber = 0
+        self.streamNumber = None
+
+    # Start connecting.  Returns True if we are connected within the timeout,
+    # otherwise the client keeps trying in the background.
+    async def connect(self):
+        if self.task is None:
+            self.connected = asyncio.Event()
+            self.streamLock = asyncio.Lock()
+            self.streamQueue = asyncio.Queue()
+            self.closing = False
+            self.task = asyncio.ensure_future(self.__run())
+        return await self.connectWait(self.timeout)
+
+    async def connectWait(self, timeout=1.0):
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def close(self):
+        self.closing = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def isConnected(self):
+        return self.writer is not None and self.connected.is_set()
+
+    def isBinary(self):
+        return self.framer.binary
+
+    async def __run(self):
+        delay = self.backoff
+        while not self.closing:
+            try:
+                if self.host.startswith("unix:"):
+                    reader, writer = await asyncio.open_unix_connection(self.host[5:])
+                else:
+                    reader, writer = await asyncio.open_connection(
+                        self.host, self.port
+                    )
+            except OSError as e:
+                log.debug("Failed to connect {0}".format(e))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            log.debug("Connected to {0}:{1}".format(self.host, self.port))
+            delay = self.backoff
+            try:
+                await self.__serve(reader, writer)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                log.error("Receive Failure {0}".format(e))
+            finally:
+                self.__disconnected()
+                writer.close()
+            if not self.closing:
+                log.debug(
+                    "Attempting to Reconnect to {0}:{1}".format(self.host, self.port)
+                )
+                await asyncio.sleep(delay)
+
+    async def __serve(self, reader, writer):
+        self.writer = writer
+        self.framer = framing.Framer()
+        self.keys = {}
+        self.key_ids = {}
+        reading = asyncio.ensure_future(self.__read(reader))
+        try:
+            if self.useBinary:
+                self.negotiating = True
+                try:
+                    await self.__wait(self.request("@xbinary\n", "x", "binary"))
+                except ResponseError:
+                    log.debug("No answer to @xbinary, using ASCII")
+                finally:
+                    self.negotiating = False
+            subscribing = [
+                self.request("@s{}\n".format(key), "s", key)
+                for key in self.subscriptions
+            ]
+            await writer.drain()
+            await asyncio.gather(*subscribing, return_exceptions=True)
+            self.connected.set()
+            if self.connectCallback is not None:
+                self.connectCallback(True)
+            await reading
+        finally:
+            reading.cancel()
+
+    async def __read(self, reader):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                log.error("No Data, Bailing Out")
+                return
+            self.framer.feed(data)
+            for ftype, payload in self.framer:
+                try:
+                    self.__frame(ftype, payload)
+                except Exception as e:
+                    try:
+                        request = payload.decode("utf-8")
+                    except UnicodeDecodeError:
+                        request = bytes(payload)
+                    log.error("Error handling request {} - {}".format(request, e))
+
+    def __disconnected(self):
+        if self.writer is None:
+            return
+        self.writer = None
+        was_connected = self.connected.is_set()
+        self.connected.clear()
+        requests = self.requests
+        self.requests = {}
+        for waiting in requests.values():
+            for n, future, parse in waiting:
+                if not future.done():
+                    future.set_exception(NotConnectedError("Connection lost"))
+        if self.streamNumber is not None:
+            self.streamQueue.put_nowait(None)
+        if was_connected and self.connectCallback is not None:
+            self.connectCallback(False)
+
+    def __frame(self, ftype, payload):
+        if ftype == binary.TEXT:
+            d = payload.decode("utf-8")
+            if d[0] == "@":
+                if self.negotiating and d == "@xbinary":
+                    # Everything after this is in binary frames
+                    self.framer.binary = True
+                self.__response(d[1], d[2:])
+            else:
+                self.__update(decodeDataString(d))
+        elif ftype == binary.KEY:
+            n, key = binary.decode_key(payload)
+            self.keys[n] = key
+            self.key_ids[key] = n
+        elif ftype == binary.VALUES:
+            for n, value, flags in binary.decode_values(payload):
+                if flags is None:
+                    self.__update((self.keys[n], value))
+                else:
+                    f = "".join(c for c, on in zip("aobfs", flags) if on)
+                    self.__update((self.keys[n], value, f))
+
+    def __update(self, x):
+        if self.dataCallback is not None:
+            self.dataCallback(x)
+        for queue in self.listeners:
+            queue.put_nowait(x)
+
+    # Give a response to the oldest command waiting on it, the same as
+    # fixgw.netfix.ClientThread.handle_response()
+    def __response(self, c, d):
+        key = _response_key.split(d, 1)[0]
+        waiting = self.requests.get((c, key))
+        if not waiting or (
+            self.streamNumber is not None and waiting[0][0] > self.streamNumber
+        ):
+            if self.streamNumber is not None:
+                self.streamQueue.put_nowait([c, d])
+            else:
+                log.debug("Unexpected response @{}{}".format(c, d))
+            return
+        n, future, parse = waiting.popleft()
+        if not waiting:
+            del self.requests[(c, key)]
+        # A cancelled future is a caller that gave up waiting on it
+        if future.cancelled():
+            return
+        try:
+            future.set_result(d if parse is None else parse(d))
+        except Exception as e:
+            future.set_exception(e)
+
+    def send(self, line):
+        if self.writer is None:
+            raise NotConnectedError("Not Connected to Server")
+        data = line.encode()
+        if self.framer.binary:
+            data = binary.text_frame(data)
+        self.writer.write(data)
+
+    # Send a command and return a future for the response without waiting.
+    # See fixgw.netfix.ClientThread.request() for the arguments.
+    def request(self, line, c, key, parse=None):
+        self.send(line)
+        future = asyncio.get_event_loop().create_future()
+        self.requestNumber += 1
+        self.requests.setdefault((c, key), collections.deque()).append(
+            (self.requestNumber, future, parse)
+        )
+        return future
+
+    async def __wait(self, future):
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ResponseError("Timeout waiting on data")
+
+    async def __command(self, line, c, key, parse=None):
+        future = self.request(line, c, key, parse)
+        await self.writer.drain()
+        return await self.__wait(future)
+
+    # Send a command that is answered with several responses and call
+    # function with each one until it returns True
+    async def __stream(self, line, letters, function):
+        async with self.streamLock:
+            self.send(line)
+            self.requestNumber += 1
+            self.streamNumber = self.requestNumber
+            try:
+                await self.writer.drain()
+                while True:
+                    try:
+                        res = await asyncio.wait_for(
+                            self.streamQueue.get(), self.timeout
+                        )
+                    except asyncio.TimeoutError:
+                        raise ResponseError("Timeout waiting on data")
+                    if res is None:
+                        raise NotConnectedError("Connection lost")
+                    if res[0] not in letters:
+                        log.warning("Unexpected response @{}{}".format(res[0], res[1]))
+                    elif function(res):
+                        return
+            finally:
+                self.streamNumber = None
+                while not self.streamQueue.empty():
+                    self.streamQueue.get_nowait()
+
+    async def getList(self):
+        total = []
+
+        def add(res):
+            a = res[1].split(";")
+            if a[2]:
+                total.extend(a[2].split(","))
+            return int(a[1]) + len(a[2].split(",")) >= int(a[0])
+
+        await self.__stream("@l\n", "l", add)
+        return total
+
+    async def report(self, key):
+        return Report(await self.__command("@q{}\n".format(key), "q", key, _report))
+
+    # The same as fixgw.netfix.Client.sync().  Keys that we are subscribed
+    # to this way are not subscribed to again when we reconnect.
+    async def sync(self, spec="*", subscribe=False):
+        if not isinstance(spec, str):
+            spec = ",".join(spec)
+        result = []
+
+        def add(res):
+            if res[0] == "x":
+                if not res[1].startswith("sync"):
+                    return False
+                if "!" in res[1]:
+                    raise ResponseError("Server does not support sync")
+                return True
+            if "!" in res[1]:
+                return False  # A key that the server doesn't have
+            if res[0] == "q":
+                a = res[1].split(";")
+                result.append((a[0], Report(a), None, {}))
+            else:
+                x = decodeDataString(res[1])
+                key, _, aux = x[0].partition(".")
+                last = result[-1]
+                if aux:
+                    last[3][aux] = x[1]
+                else:
+                    result[-1] = (last[0], last[1], x, last[3])
+            return False
+
+        line = "@xsync;{}{}\n".format(spec, ";s" if subscribe else "")
+        await self.__stream(line, "qrx", add)
+        return result
+
+    async def read(self, key):
+        return await self.__command("@r{}\n".format(key), "r", key, decodeDataString)
+
+    # The server doesn't answer value writes so this only waits until the
+    # sentence has been handed to the socket
+    async def write(self, key, value, flags=""):
+        if self.framer.binary and key in self.key_ids:
+            f = tuple(c in flags for c in "aobfs")
+            frame = binary.values_frame([(self.key_ids[key], (value,) + f)])
+            if self.writer is None:
+                raise NotConnectedError("Not Connected to Server")
+            self.writer.write(frame)
+        else:
+            a = "1" if "a" in flags else "0"
+            b = "1" if "b" in flags else "0"
+            f = "1" if "f" in flags else "0"
+            s = "1" if "s" in flags else "0"
+            self.send("{0};{1};{2}{3}{4}{5}\n".format(key, value, a, b, f, s))
+        await self.writer.drain()
+
+    # The same as fixgw.netfix.Client.writeState()
+    async def writeState(self, key, value, flags=""):
+        await self.write(key, value, flags)
+        return await self.read(key)
+
+    async def writeValue(self, key, value):
+        return await self.__command("@w{};{}\n".format(key, value), "w", key)
+
+    async def flag(self, key, flag, setting):
+        def parse(d):
+            if "!" in d:
+                e = d.split("!")
+                if e[1] == "001":
+                    raise ResponseError("Key Not Found {}".format(e[0]))
+                elif e[1] == "002":
+                    raise ResponseError("Unknown Flag {}".format(flag))
+                else:
+                    raise ResponseError("Response Error {} for {}".format(e[1], e[0]))
+
+        s = "1" if setting else "0"
+        line = "@f{};{};{}\n".format(key, flag.lower(), s)
+        await self.__command(line, "f", key, parse)
+
+    async def subscribe(self, key):
+        res = await self.__command("@s{}\n".format(key), "s", key)
+        if not res.endswith("!001"):
+            self.subscriptions.add(key)
+
+    async def unsubscribe(self, key):
+        self.subscriptions.discard(key)
+        await self.__command("@u{}\n".format(key), "u", key)
+
+    async def getStatus(self):
+        return await self.__command("@xstatus\n", "x", "status", lambda d: d[7:])
+
+    # An async iterator of the value updates for the keys that we are
+    # subscribed to.  Each update is a tuple like read() returns.  Every
+    # iterator gets every update so each one should be read promptly.
+    async def updates(self):
+        queue = asyncio.Queue()
+        self.listeners.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.listeners.discard(queue)
+
+
+# Setting the properties of one of these items only changes our copy.  Use
+# Database.set_value(), set_state() and set_flag() to change the server.
+class DB_Item(_DB_Item):
+    @property
+    def supressWrite(self):
+        return True
+
+    @supressWrite.setter
+    def supressWrite(self, x):
+        pass
+
+
+# A copy of the gateway database that is kept up to date the same way as
+# fixgw.netfix.db.Database.  It is filled in each time the client connects
+# and emptied when the connection is lost.  It has to be created in the
+# event loop that the client is used in.
+class Database(object):
+    def __init__(self, client):
+        self.__items = {}
+        # Updates for keys that we don't have yet while we are initializing
+        self.__pending = None
+        self.client = client
+        self.init_event = asyncio.Event()
+        self.task = None
+        client.connectCallback = self.connectFunction
+        client.dataCallback = self.dataFunction
+
+        # Callback functions
+        self.connectCallback = None
+
+        if client.isConnected():
+            self.connectFunction(True)
+
+    def connectFunction(self, x):
+        log.debug("Database Connection State - {}".format(x))
+        if x:
+            self.task = asyncio.ensure_future(self.initialize())
+        else:
+            if self.task is not None:
+                self.task.cancel()
+                self.task = None
+            self.init_event.clear()
+            log.debug("Deleting Database")
+            for item in self.__items.values():
+                if item.destroyed is not None:
+                    item.destroyed()
+            self.__items = {}
+        if self.connectCallback is not None:
+            self.connectCallback(x)
+
+    def dataFunction(self, x):
+        key = x[0].split(".")[0]
+        if self.__pending is not None and key not in self.__items:
+            self.__pending.setdefault(key, []).append(x)
+            return
+        if key in self.__items:
+            self.__update(x)
+
+    def __update(self, x):
+        if "." in x[0]:
+            tokens = x[0].split(".")
+            self.__items[tokens[0]].set_aux_value(tokens[1], x[1])
+        else:
+            self.__items[x[0]].updateNoWrite(x)
+
+    async def initialize(self):
+        log.debug("Initializing Database")
+        self.__pending = {}
+        try:
+            try:
+                result = await self.client.sync(subscribe=True)
+            except ResponseError as e:
+                log.debug("Sync failed, reading items one at a time - {}".format(e))
+                result = await self.__read_all()
+            for key, rep, value, aux in result:
+                item = self.__define(key, rep)
+                if value is not None:
+                    item.updateNoWrite(value)
+                for name, v in aux.items():
+                    item.set_aux_value(name, v)
+                if item.reportReceived is not None:
+                    item.reportReceived()
+                self.__items[key] = item
+                for x in self.__pending.pop(key, []):
+                    self.__update(x)
+            self.init_event.set()
+        except (ResponseError, NotConnectedError) as e:
+            log.error(e)
+        finally:
+            self.__pending = None
+
+    # For servers that don't have the @xsync command.  The commands for every
+    # key are sent at once and then the answers are collected.
+    async def __read_all(self):
+        keys = await self.client.getList()
+        reports = await asyncio.gather(*[self.client.report(key) for key in keys])
+        reads = []
+        for key, rep in zip(keys, reports):
+            reads.append(self.client.read(key))
+            reads.extend(self.client.read("{}.{}".format(key, a)) for a in rep.aux)
+        values = iter(await asyncio.gather(*reads))
+        result = []
+        for key, rep in zip(keys, reports):
+            value = next(values)
+            aux = {a: next(values)[1] for a in rep.aux}
+            result.append((key, rep, value, aux))
+        await asyncio.gather(*[self.client.subscribe(key) for key in keys])
+        return result
+
+    def __define(self, key, rep):
+        if key in self.__items:
+            log.debug("Redefining Item {0}".format(key))
+            item = self.__items[key]
+        else:
+            item = DB_Item(self.client, key, rep.dtype)
+        item.dtype = rep.dtype
+        item.description = rep.desc
+        item.min = rep.min
+        item.max = rep.max
+        item.units = rep.units
+        item.tol = rep.tol
+        item.init_aux(rep.aux)
+        return item
+
+    def get_item(self, key, create=False):
+        try:
+            return self.__items[key]
+        except KeyError:
+            if create:
+                newitem = DB_Item(self.client, key)
+                self.__items[key] = newitem
+                return newitem
+            else:
+                raise  # Send the exception up otherwise
+
+    def get_item_list(self):
+        return list(self.__items.keys())
+
+    def get_value(self, key):
+        return self.__items[key].value
+
+    # Write a value, or an aux value if key is KEY.aux, to the server.  Our
+    # copy gets the value and flags that the server sends back, which can be
+    # different if the value was out of range.
+    async def set_value(self, key, value):
+        res = await self.client.writeValue(key, value)
+        if "!" in res:
+            raise ResponseError("Unable to write {} - {}".format(key, res))
+        self.__update(decodeDataString(res))
+
+    # Write the value and flags of an item together, see DB_Item.set_state()
+    async def set_state(self, key, value=None, flags=None):
+        value, flags = self.__items[key].new_state(value, flags)
+        res = await self.client.writeState(key, value, flags)
+        if not isinstance(res, tuple):
+            raise ResponseError("Unable to write {} error {}".format(key, res))
+        self.__update(res)
+
+    async def set_flag(self, key, flag, setting):
+        await self.client.flag(key, flag, setting)
+        setattr(self.__items[key], FLAGS[flag.lower()], setting)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.client.connectCallback = None
+        self.client.dataCallback = None
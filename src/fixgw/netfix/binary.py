@@ -0,0 +1,170 @@
+#  Copyright (c) 2026 The FIX-Gateway Contributors
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Binary framing for Net-FIX.  This is used by both the server plugin and the
+# client library once a connection has switched over with the @xbinary
+# command.  Every message is a frame with a one byte type and a four byte
+# little endian payload length followed by the payload.
+#
+#   TEXT    An ordinary Net-FIX/ASCII message without the newline.  Commands
+#           and their responses are sent this way.
+#   KEY     Tells the client the number that the server uses for a key.
+#           The payload is the two byte number and the key in UTF-8.
+#   VALUES  A batch of value updates.  Each one is the two byte key number,
+#           a flags byte, a type byte and then the value.
+#
+# Key numbers are two bytes so only the first 65536 keys get one.  Values for
+# any others are sent as ASCII messages in TEXT frames.
+
+import struct
+
+TEXT = 0
+KEY = 1
+VALUES = 2
+
+HEADER = struct.Struct("<BI")
+RECORD = struct.Struct("<HBB")
+KEY_ID = struct.Struct("<H")
+MAX_KEY_ID = 0xFFFF
+
+# Bits in the flags byte
+ANNUNCIATE = 0x01
+OLD = 0x02
+BAD = 0x04
+FAIL = 0x08
+SECFAIL = 0x10
+NOFLAGS = 0x80  # The value has no quality flags, like an auxiliary value
+FLAG_BITS = (ANNUNCIATE, OLD, BAD, FAIL, SECFAIL)
+
+# Value types
+NONE = 0
+BOOL = 1
+INT = 2
+FLOAT = 3
+STRING = 4
+LONG = 5
+
+_bool = struct.Struct("<?")
+_int = struct.Struct("<i")
+_long = struct.Struct("<q")
+_float = struct.Struct("<d")
+_strlen = struct.Struct("<I")
+
+
+def frame(ftype, payload):
+    return HEADER.pack(ftype, len(payload)) + payload
+
+
+def text_frame(line):
+    if isinstance(line, str):
+        line = line.encode()
+    return frame(TEXT, line.rstrip(b"\n"))
+
+
+def key_frame(id, key):
+    return frame(KEY, KEY_ID.pack(id) + key.encode())
+
+
+def decode_key(payload):
+    return KEY_ID.unpack_from(payload)[0], bytes(payload[KEY_ID.size :]).decode()
+
+
+def _encode_value(v):
+    t = type(v)
+    if v is None:
+        return NONE, b""
+    if t is bool:
+        return BOOL, _bool.pack(v)
+    if t is int:
+        if -0x80000000 <= v <= 0x7FFFFFFF:
+            return INT, _int.pack(v)
+        return LONG, _long.pack(v)
+    if t is float:
+        return FLOAT, _float.pack(v)
+    s = str(v).encode()
+    return STRING, _strlen.pack(len(s)) + s
+
+
+# records is a list of (key number, value) where value is either the
+# (value, annunciate, old, bad, fail, secfail) tuple from the database or a
+# plain value with no flags.
+def values_frame(records):
+    parts = []
+    for id, value in records:
+        if type(value) is tuple:
+            flags = 0
+            for bit, on in zip(FLAG_BITS, value[1:6]):
+                if on:
+                    flags |= bit
+            value = value[0]
+        else:
+            flags = NOFLAGS
+        vtype, data = _encode_value(value)
+        parts.append(RECORD.pack(id, flags, vtype))
+        parts.append(data)
+    return frame(VALUES, b"".join(parts))
+
+
+# Returns a list of (key number, value, flags) where flags is a tuple of
+# (annunciate, old, bad, fail, secfail) or None if the value has no flags.
+def decode_values(payload):
+    result = []
+    offset = 0
+    end = len(payload)
+    while offset < end:
+        id, flags, vtype = RECORD.unpack_from(payload, offset)
+        offset += RECORD.size
+        if vtype == NONE:
+            v = None
+        elif vtype == BOOL:
+            v = _bool.unpack_from(payload, offset)[0]
+            offset += _bool.size
+        elif vtype == INT:
+            v = _int.unpack_from(payload, offset)[0]
+            offset += _int.size
+        elif vtype == LONG:
+            v = _long.unpack_from(payload, offset)[0]
+            offset += _long.size
+        elif vtype == FLOAT:
+            v = _float.unpack_from(payload, offset)[0]
+            offset += _float.size
+        elif vtype == STRING:
+            n = _strlen.unpack_from(payload, offset)[0]
+            offset += _strlen.size
+            v = bytes(payload[offset : offset + n]).decode()
+            offset += n
+        else:
+            raise ValueError("Unknown value type {}".format(vtype))
+        if flags & NOFLAGS:
+            f = None
+        else:
+            f = tuple(bool(flags & bit) for bit in FLAG_BITS)
+        result.append((id, v, f))
+    return result
+
+
+# Remove the first complete frame from buf, which should be a bytearray, and
+# return it as (type, payload).  Returns None if there isn't a whole frame.
+def next_frame(buf):
+    if len(buf) < HEADER.size:
+        return None
+    ftype, n = HEADER.unpack_from(buf)
+    end = HEADER.size + n
+    if len(buf) < end:
+        return None
+    payload = bytes(buf[HEADER.size : end])
+    del buf[:end]
+    return ftype, payload
@@ -402,6 +402,38 @@ class DB_Item(object):
             except Exception as e:
                 log.error(e)
 
+    # Change the value and the flags together with one write to the server.
+    # flags is a string of the flags that should be set, out of "abfs", and
+    # either can be left as None to keep what we have.  Our copy and the
+    # change callbacks only see the new state once the server has answered
+    # with it, which may be different if the value was out of range.  The
+    # old flag is looked after by the server and can't be set this way.
+    def set_state(self, value=None, flags=None):
+        value, flags = self.new_state(value, flags)
+        if self.supressWrite:
+            self.updateNoWrite((self.key, value, flags))
+            return
+        res = self.client.writeState(self.key, value, flags)
+        if not isinstance(res, tuple):
+            log.error("Unable to write {0} error {1}".format(self.key, res))
+            return
+        self.updateNoWrite(res)
+
+    # The value and flags to write for set_state()
+    def new_state(self, value=None, flags=None):
+        with self.lock:
+            if value is None:
+                value = self._value
+            else:
+                value = self.valueConvert(value)
+            if flags is None:
+                flags = ""
+                flags += "a" if self._annunciate else ""
+                flags += "b" if self._bad else ""
+                flags += "f" if self._fail else ""
+                flags += "s" if self._secFail else ""
+            return value, flags
+
     def updateNoWrite(self, report):
         with self.lock:
             try:
@@ -441,6 +473,9 @@ class UpdateThread(threading.Thread):
 class Database(object):
     def __init__(self, client):
         self.__items = {}
+        # Updates for keys that we don't have yet while we are initializing
+        self.__pending = None
+        self.lock = threading.RLock()
         self.client = client
         self.init_event = threading.Event()
         self.connected = False
@@ -483,6 +518,16 @@ class Database(object):
 
     # This callback gets a data update sentence from the server
     def dataFunction(self, x):
+        with self.lock:
+            # The server only sends these after the sync response for the key
+            # but we may not have got to that part of the response yet.
+            key = x[0].split(".")[0]
+            if self.__pending is not None and key not in self.__items:
+                self.__pending.setdefault(key, []).append(x)
+                return
+            self.__update(x)
+
+    def __update(self, x):
         if "." in x[0]:
             tokens = x[0].split(".")
             i = self.__items[tokens[0]]
@@ -499,44 +544,66 @@ class Database(object):
             log.warning("Trying to initialize an already initialized database")
             return
         try:
-            keys = self.client.getList()
-            for key in keys:
-                res = self.client.getReport(key)
-                rep = fixgw.netfix.Report(res)
-                item = self.define_item(key, rep)
-                res = self.client.read(key)
-                item.value = res[1]
-                item.annunciate = "a" in res[2]
-                item.old = "o" in res[2]
-                item.bad = "b" in res[2]
-                item.fail = "f" in res[2]
-                item.secFail = "s" in res[2]
-                auxlist = item.get_aux_list()
-                for aux in auxlist:
-                    val = self.client.read("{}.{}".format(key, aux))
-                    item.set_aux_value(aux, val[1])
-
+            try:
+                self.__sync()
+            except fixgw.netfix.ResponseError as e:
+                log.debug("Sync failed, reading items one at a time - {}".format(e))
+                self.__read_all()
             self.init_event.set()
         except Exception as e:
             log.error(e)
             raise
 
+    # Get everything with one @xsync command that subscribes us at the same
+    # time.
+    def __sync(self):
+        with self.lock:
+            self.__pending = {}
+        try:
+            for key, rep, value, aux in self.client.sync(subscribe=True):
+                with self.lock:
+                    item = self.__define(key, rep)
+                    if value is not None:
+                        item.updateNoWrite(value)
+                    item.supressWrite = True
+                    try:
+                        for name, v in aux.items():
+                            item.set_aux_value(name, v)
+                    finally:
+                        item.supressWrite = False
+                    if item.reportReceived is not None:
+                        item.reportReceived()
+                    self.__items[key] = item
+                    for x in self.__pending.pop(key, []):
+                        self.__update(x)
+        finally:
+            with self.lock:
+                self.__pending = None
+
+    # For servers that don't have the @xsync command
+    def __read_all(self):
+        keys = self.client.getList()
+        for key in keys:
+            res = self.client.getReport(key)
+            rep = fixgw.netfix.Report(res)
+            item = self.define_item(key, rep)
+            res = self.client.read(key)
+            item.value = res[1]
+            item.annunciate = "a" in res[2]
+            item.old = "o" in res[2]
+            item.bad = "b" in res[2]
+            item.fail = "f" in res[2]
+            item.secFail = "s" in res[2]
+            auxlist = item.get_aux_list()
+            for aux in auxlist:
+                val = self.client.read("{}.{}".format(key, aux))
+                item.set_aux_value(aux, val[1])
+
     # Either add an item or redefine the item if it already exists.
     #  This is mostly useful when the FIXGW client reconnects.  The
     #  server may have different information.
     def define_item(self, key, rep):
-        if key in self.__items:
-            log.debug("Redefining Item {0}".format(key))
-            item = self.__items[key]
-        else:
-            item = DB_Item(self.client, key, rep.dtype)
-        item.dtype = rep.dtype
-        item.description = rep.desc
-        item.min = rep.min
-        item.max = rep.max
-        item.units = rep.units
-        item.tol = rep.tol
-        item.init_aux(rep.aux)
+        item = self.__define(key, rep)
 
         # Send a read command to the server to get initial data
         res = self.client.read(key)
@@ -551,6 +618,21 @@ class Database(object):
         self.__items[key] = item
         return item
 
+    def __define(self, key, rep):
+        if key in self.__items:
+            log.debug("Redefining Item {0}".format(key))
+            item = self.__items[key]
+        else:
+            item = DB_Item(self.client, key, rep.dtype)
+        item.dtype = rep.dtype
+        item.description = rep.desc
+        item.min = rep.min
+        item.max = rep.max
+        item.units = rep.units
+        item.tol = rep.tol
+        item.init_aux(rep.aux)
+        return item
+
     # If the create flag is set to True this function will create an
     # item with the given key if it does not exist.  Otherwise just
     # return the item if found.
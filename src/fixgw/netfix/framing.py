@@ -0,0 +1,71 @@
+#  Copyright (c) 2026 The FIX-Gateway Contributors
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Splits the bytes received on a Net-FIX connection into messages.  This is
+# shared by the server plugin and the client library.  Received data is added
+# with feed() and the complete messages are taken out by iterating over the
+# framer:
+#
+#   framer.feed(data)
+#   for ftype, payload in framer:
+#       ...
+#
+# In ASCII mode every message is a line and comes out as a TEXT frame with
+# the newline removed.  Once binary is set the rest of the data is read as
+# binary frames.  binary can be changed while iterating, as it is when the
+# @xbinary command is handled, and the bytes that follow are read the new
+# way.  Lines are found with bytearray.find() and the bytes that have been
+# used up are only removed from the buffer once at the end, so the cost does
+# not depend on how the data was split up by recv().
+
+from .binary import HEADER, TEXT
+
+
+class Framer(object):
+    def __init__(self):
+        self.buf = bytearray()
+        self.binary = False
+
+    def feed(self, data):
+        self.buf += data
+
+    # Yields (type, payload) for each complete message in the buffer.  The
+    # payload is a bytearray.  A partial message at the end stays in the
+    # buffer until the rest of it is fed.
+    def __iter__(self):
+        buf = self.buf
+        start = 0
+        try:
+            while True:
+                if self.binary:
+                    if len(buf) - start < HEADER.size:
+                        break
+                    ftype, n = HEADER.unpack_from(buf, start)
+                    end = start + HEADER.size + n
+                    if len(buf) < end:
+                        break
+                    payload = buf[start + HEADER.size : end]
+                    start = end
+                    yield ftype, payload
+                else:
+                    i = buf.find(b"\n", start)
+                    if i < 0:
+                        break
+                    line = buf[start:i]
+                    start = i + 1
+                    yield TEXT, line
+        finally:
+            del buf[:start]
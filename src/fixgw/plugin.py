@@ -70,6 +70,9 @@ class PluginBase(object):
     def db_write(self, key, value):
         database.write(key, value)
 
+    def db_write_many(self, values):
+        database.write_many(values)
+
     def db_list(self):
         return database.listkeys()
 
@@ -78,11 +81,32 @@ class PluginBase(object):
         return database.get_raw_item(key)
 
     def db_callback_add(self, key, function, udata=None):
-        database.callback_add(self.name, key, function, udata)
+        return database.callback_add(self.name, key, function, udata)
 
     def db_callback_del(self, key, function, udata=None):
         database.callback_del(self.name, key, function, udata)
 
+    def db_callback_add_prefix(self, prefix, function, udata=None):
+        return database.callback_add_prefix(self.name, prefix, function, udata)
+
+    def db_callback_del_prefix(self, prefix, function, udata=None):
+        database.callback_del_prefix(self.name, prefix, function, udata)
+
+    def db_callback_add_regex(self, regex, function, udata=None):
+        return database.callback_add_regex(self.name, regex, function, udata)
+
+    def db_callback_del_regex(self, regex, function, udata=None):
+        database.callback_del_regex(self.name, regex, function, udata)
+
+    def db_callback_remove(self, handle):
+        database.callback_remove(handle)
+
+    def db_origin(self, tag):
+        return database.origin(tag)
+
+    def db_get_origin(self):
+        return database.get_origin()
+
     # This method should be reimplemented in the child class
     # It should return a dictionary of status information
     def get_status(self):
@@ -180,11 +180,11 @@ class Mapping(object):
                     and cfpar.quality is not None
                     and cfpar.failure is not None
                 ):
-                    dbItem.value = (
+                    dbItem.update(
                         cfpar.value,
-                        cfpar.annunciate,
-                        cfpar.quality,
-                        cfpar.failure,
+                        annunciate=cfpar.annunciate,
+                        bad=cfpar.quality,
+                        fail=cfpar.failure,
                     )
                 else:
                     self.recvinvalidcount += 1
@@ -52,7 +52,12 @@ class MainThread(threading.Thread):
                                 self.log.debug(f"{file_time}  --  {start_time}")
                                 continue
                         for key in j:
-                            database.get_raw_item(key).value = tuple(j[key])
+                            # Recorded as [value, annunciate, old, bad, fail, secfail]
+                            # old is left for the database to work out
+                            v = j[key]
+                            database.get_raw_item(key).update(
+                                v[0], annunciate=v[1], bad=v[3], fail=v[4], secfail=v[5]
+                            )
                         # Wait for remainder of frequency interval
                         time.sleep(
                             (freq / 1000)
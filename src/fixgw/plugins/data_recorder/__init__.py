@@ -39,45 +39,31 @@ class MainThread(threading.Thread):
                 self.data[key] = data
 
     def get_all_data(self, callbacks=False):
-        # Create callbacks for defined keys
-        for key in database.listkeys():
-            if self.config["key_prefixes"] == "all":
-                if callbacks:
-                    self.parent.db_callback_add(key, self.persist)
-                else:
-                    # Get and save data as of now
-                    key_data = self.parent.db_read(key)
-                    data = [
-                        key_data[0],
-                        int(key_data[1]),
-                        int(key_data[2]),
-                        int(key_data[3]),
-                        int(key_data[4]),
-                        int(key_data[5]),
-                    ]
-                    with self.data_lock:
-                        self.data[key] = data
-            elif isinstance(self.config["key_prefixes"], list):
-                for sw in self.config["key_prefixes"]:
-                    if key.startswith(sw):
-                        if callbacks:
-                            self.parent.db_callback_add(key, self.persist)
-                        else:
-                            # Get and save data as of now
-                            key_data = self.parent.db_read(key)
-                            data = [
-                                key_data[0],
-                                int(key_data[1]),
-                                int(key_data[2]),
-                                int(key_data[3]),
-                                int(key_data[4]),
-                                int(key_data[5]),
-                            ]
-                            with self.data_lock:
-                                self.data[key] = data
-                        break
+        prefixes = self.config["key_prefixes"]
+        if prefixes == "all":
+            prefixes = [""]
+        elif not isinstance(prefixes, list):
+            prefixes = []
         if callbacks:
+            # Create callbacks for defined keys, this also covers keys
+            # that are added to the database later
+            for sw in prefixes:
+                self.parent.db_callback_add_prefix(sw, self.persist)
             self.starttime = time.monotonic()
+            return
+        # Get and save data as of now
+        data = dict()
+        for key, state in database.snapshot(prefix=prefixes).items():
+            data[key] = [
+                state.value,
+                int(state.annunciate),
+                int(state.old),
+                int(state.bad),
+                int(state.fail),
+                int(state.secfail),
+            ]
+        with self.data_lock:
+            self.data.update(data)
 
     def run(self):
         hour = -1
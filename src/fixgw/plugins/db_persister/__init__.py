@@ -48,7 +48,11 @@ class MainThread(threading.Thread):
         def persist(key, value, udata=None):
             # print(key, (value))
             # print(key, value, (value[0], time.time()))
-            tbl = self.h5f.get_node("/", key)
+            try:
+                tbl = self.h5f.get_node("/", key)
+            except tables.NoSuchNodeError:
+                # Matched the regex but is not in the schema
+                return
             tbl.row["value"] = value[0]
             tbl.row["timestamp"] = time.time()
             # print(tbl.row)
@@ -60,8 +64,6 @@ class MainThread(threading.Thread):
 
         for entry in persisted_entries:
             key = entry["key"]
-            self.parent.db_callback_add(key, persist)
-
             try:
                 self.h5f.get_node("/", key)
             except:
@@ -84,6 +86,9 @@ class MainThread(threading.Thread):
                 self.h5f.create_table("/", key, description)
                 self.log.debug(f"create table {key}")
 
+        # The tables need to exist before the callbacks start coming
+        self.parent.db_callback_add_regex(parent.config["entries_regex"], persist)
+
     def run(self):
         while not self.getout:
             time.sleep(0.5)
@@ -62,6 +62,8 @@ class Get(threading.Thread):
                     )
                     # self.log.debug(f"host:{hex(mgl.host)} msg_id:{hex(mgl.msg_id)}")
                     # self.log.debug(f"{tables.rdac}")
+                    # Everything decoded from this frame is written together
+                    writes = dict()
                     if mgl.host in self.rdac_get_items:
                         # We want stuff from this host
                         # print(self.rdac_get_items[mgl.host])
@@ -128,7 +130,9 @@ class Get(threading.Thread):
                                 self.log.debug(
                                     f"host:{mgl.host} msig_id:{mgl.msg_id} mgl_key:{k} fix_key:{d['key']} value:{data_value}"
                                 )
-                                self.parent.db_write(d["key"], data_value)
+                                writes[d["key"]] = data_value
+                    if writes:
+                        self.parent.db_write_many(writes)
 
             finally:
                 if self.getout:
@@ -22,19 +22,222 @@
 
 import threading
 import socket
+import selectors
+import concurrent.futures
 import queue
 from collections import OrderedDict
 from collections import defaultdict
 from collections import deque
 import json
+import os
+import stat
+import struct
 import fixgw.plugin as plugin
 import fixgw.status as status
 import fixgw.netfix as netfix
+import fixgw.netfix.binary as fixbinary
+import fixgw.netfix.framing as framing
 import time
 
 # Track where data came from to prevent loops
 client_block = defaultdict(set)
 
+# The number of keys that the @xsync command reads with the queue locked
+SYNC_BATCH = 64
+
+# How long a client mode peer waits before trying again after a failed write
+PEER_RETRY = 0.5
+
+
+# Build the Net-FIX value update message for a database value
+def encode_value(id, value):
+    if type(value) is tuple:
+        a = "1" if value[1] else "0"
+        o = "1" if value[2] else "0"
+        b = "1" if value[3] else "0"
+        f = "1" if value[4] else "0"
+        s = "1" if value[5] else "0"
+        st = "{0};{1};{2}{3}{4}{5}{6}\n".format(id, value[0], a, o, b, f, s)
+    else:
+        st = "{0};{1}\n".format(id, value)
+    return st.encode()
+
+
+# The last message that was built for each key.  The database hands the same
+# value object to every callback for a change, so the message is only built
+# once per change and the same bytes are queued for every subscribed client.
+_frames = {}
+
+
+def value_frame(id, value):
+    last = _frames.get(id)
+    if last is not None and last[0] is value:
+        return last[1]
+    frame = encode_value(id, value)
+    _frames[id] = (value, frame)
+    return frame
+
+
+# Numbers for the keys in the binary protocol.  They are the same for every
+# connection so that the binary messages can be shared too.
+_key_ids = {}
+_key_names = []
+_key_lock = threading.Lock()
+
+
+def key_id(key):
+    try:
+        return _key_ids[key]
+    except KeyError:
+        with _key_lock:
+            if key not in _key_ids:
+                _key_ids[key] = len(_key_names)
+                _key_names.append(key)
+            return _key_ids[key]
+
+
+_binary_frames = {}
+
+
+# The same as value_frame() but for connections using the binary protocol
+def binary_frame(id, value):
+    last = _binary_frames.get(id)
+    if last is not None and last[0] is value:
+        return last[1]
+    n = key_id(id)
+    if n > fixbinary.MAX_KEY_ID:
+        # Too many keys to number them all, send it as ASCII in a text frame
+        frame = fixbinary.text_frame(encode_value(id, value))
+    else:
+        frame = fixbinary.values_frame([(n, value)])
+    _binary_frames[id] = (value, frame)
+    return frame
+
+
+# Outbound messages for one connection.  Command responses are sent in the
+# order they were put in the queue.  Value updates are kept by key so a key
+# that changes several times before the client catches up is only sent once
+# with its latest value.  It has the parts of the queue.Queue interface that
+# the connection code uses.  If wake is given it is called whenever something
+# is put in the queue.  Value updates can be held back until a given time for
+# subscriptions that have a maximum rate.
+class OutputQueue(object):
+    def __init__(self, wake=None, high_water=0, limit=0):
+        self.cond = threading.Condition()
+        self.fifo = deque()
+        self.values = {}  # Keys in the order they became dirty
+        self.delayed = {}  # key: [due time, item]
+        self.wake = wake
+        self.high_water = high_water  # Zero means never flag the client
+        self.limit = limit  # Zero means never give up on the client
+        self.lagging = False
+        self.overflow = False
+        self.on_overflow = None  # Called once when limit is passed
+        self.conflated = 0
+        self.lag_count = 0
+
+    def __len__(self):
+        return len(self.fifo) + len(self.values) + len(self.delayed)
+
+    def put(self, item):
+        with self.cond:
+            self.fifo.append(item)
+            self.added()
+
+    # Queue a value update for key, replacing one that hasn't been sent yet.
+    # If due is given the update isn't sent before that time.
+    def put_value(self, key, item, due=None):
+        with self.cond:
+            if self.overflow:
+                return  # The client is being disconnected
+            if key in self.values:
+                self.conflated += 1
+                self.values[key] = item
+            elif key in self.delayed:
+                self.conflated += 1
+                self.delayed[key][1] = item
+            elif due is not None:
+                self.delayed[key] = [due, item]
+            else:
+                self.values[key] = item
+            self.added()
+
+    # Move delayed updates that are due to the ready values.  Returns the
+    # time that the next delayed update is due or None if there are none.
+    def release(self):
+        if not self.delayed:
+            return None
+        now = time.monotonic()
+        due = None
+        for key, d in list(self.delayed.items()):
+            if d[0] <= now:
+                self.values[key] = d[1]
+                del self.delayed[key]
+            elif due is None or d[0] < due:
+                due = d[0]
+        return due
+
+    # The time that the next delayed update is due or None
+    def next_due(self):
+        with self.cond:
+            return self.release()
+
+    # Called with the lock held after something is added
+    def added(self):
+        self.cond.notify()
+        n = len(self)
+        if self.high_water and n > self.high_water and not self.lagging:
+            self.lagging = True
+            self.lag_count += 1
+        if self.limit and n > self.limit and not self.overflow:
+            self.overflow = True
+            if self.on_overflow:
+                self.on_overflow()
+        if self.wake:
+            self.wake()
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            if timeout is not None:
+                end = time.monotonic() + timeout
+            while True:
+                due = self.release()
+                if self.fifo or self.values or not block:
+                    break
+                wait = None if due is None else due - time.monotonic()
+                if timeout is not None:
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        break
+                    wait = left if wait is None else min(wait, left)
+                self.cond.wait(wait)
+            if self.fifo:
+                item = self.fifo.popleft()
+            elif self.values:
+                item = self.values.pop(next(iter(self.values)))
+            else:
+                raise queue.Empty
+            if not len(self):
+                self.lagging = False
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    # Throw away every value update that hasn't been sent and return the keys
+    def discard_values(self):
+        with self.cond:
+            keys = list(self.values) + list(self.delayed)
+            self.values.clear()
+            self.delayed.clear()
+            return keys
+
+    # True if there is nothing that can be sent right now
+    def empty(self):
+        with self.cond:
+            self.release()
+            return not self.fifo and not self.values
+
 
 # This holds the data and functions that are needed by both connection threads.
 class Connection(object):
@@ -44,44 +247,209 @@ class Connection(object):
         self.conn = conn
         self.addr = addr
         self.log = parent.log
-        self.queue = queue.Queue()
+        self.queue = OutputQueue(
+            high_water=int(parent.config.get("queue_high_water") or 0),
+            limit=int(parent.config.get("queue_limit") or 0),
+        )
+        self.queue.on_overflow = self.overflow
         self.buffer_size = (
             int(parent.config["buffer_size"])
             if ("buffer_size" in parent.config) and parent.config["buffer_size"]
             else 1024
         )
         self.subscriptions = set()
-        self.output_inhibit = False
+        self.filters = {}  # Subscription ID: (minimum interval, deadband)
+        self.key_filters = {}  # The filter that applies to each key
+        self.last_sent = {}  # key: (value, flags, time) for filtered keys
+        self.filtered = 0
+        self.framer = framing.Framer()
+        self.announced = set()
+        self.peer = None  # (pid, uid, gid) of a Unix domain socket client  # Key numbers the binary client knows about
+
+    # Switched on by the @xbinary command.  The framer reads what the client
+    # sends after that as binary frames.
+    @property
+    def binary(self):
+        return self.framer.binary
+
+    @binary.setter
+    def binary(self, on):
+        self.framer.binary = on
+
+    # Queue a command response.  msg is a Net-FIX/ASCII message
+    def reply(self, msg):
+        if self.binary:
+            msg = fixbinary.text_frame(msg)
+        self.queue.put(msg)
+
+    # Queue a list of Net-FIX/ASCII messages as a single item
+    def reply_lines(self, lines):
+        if self.binary:
+            msg = b"".join(fixbinary.text_frame(line) for line in lines)
+        else:
+            msg = "".join(lines).encode()
+        if msg:
+            self.queue.put(msg)
 
     # This sends a standard Net-FIX value update message to the queue.
     def __send_value(self, id, value):
+        due = None
+        if self.filters:
+            f = self.__filter(id)
+            if f is not None:
+                due = self.__limit(id, value, f)
+                if due is None:
+                    self.filtered += 1
+                    return
+                if due <= time.monotonic():
+                    due = None
+        # The queue lock keeps the protocol from changing under us
+        with self.queue.cond:
+            if self.binary:
+                n = key_id(id)
+                if n <= fixbinary.MAX_KEY_ID and n not in self.announced:
+                    self.announced.add(n)
+                    self.queue.put(fixbinary.key_frame(n, id))
+                frame = binary_frame(id, value)
+            else:
+                frame = value_frame(id, value)
+            self.queue.put_value(id, frame, due)
+
+    # Parse the options that can follow the ID in a subscribe command.  rate
+    # is the most updates per second and dead is the smallest change in value
+    # that will be sent.  Returns None if there are no options.
+    def __subscription_options(self, options):
+        if not options:
+            return None
+        interval = 0.0
+        dead = 0.0
+        for each in options.split(";"):
+            name, _, v = each.partition("=")
+            v = float(v)
+            if not v >= 0:  # Also catches nan
+                raise ValueError(each)
+            if name == "rate" and v > 0:
+                interval = 1.0 / v
+            elif name == "dead":
+                dead = v
+            else:
+                raise ValueError(each)
+        return (interval, dead)
+
+    # Find the filter for key from a subscription to it or to a prefix of it
+    def __filter(self, key):
+        try:
+            return self.key_filters[key]
+        except KeyError:
+            pass
+        f = self.filters.get(key)
+        if f is None:
+            for sub, each in list(self.filters.items()):
+                if sub.endswith("*") and key.startswith(sub[:-1]):
+                    f = each
+                    break
+        self.key_filters[key] = f
+        return f
+
+    # Apply a subscription's rate and deadband limits to a value update.
+    # Returns None if the update should be dropped, otherwise the time that
+    # it can be sent.
+    def __limit(self, id, value, f):
+        interval, dead = f
+        now = time.monotonic()
         if type(value) is tuple:
-            a = "1" if value[1] else "0"
-            o = "1" if value[2] else "0"
-            b = "1" if value[3] else "0"
-            f = "1" if value[4] else "0"
-            s = "1" if value[5] else "0"
-            st = "{0};{1};{2}{3}{4}{5}{6}\n".format(id, value[0], a, o, b, f, s)
+            v, flags = value[0], value[1:]
         else:
-            st = "{0};{1}\n".format(id, value)
-        self.queue.put(st.encode())
+            v, flags = value, None
+        last = self.last_sent.get(id)
+        if last is None:
+            due = now
+        else:
+            if (
+                dead
+                and flags == last[1]
+                and type(v) in (int, float)
+                and abs(v - last[0]) < dead
+            ):
+                return None
+            if last[2] > now:
+                due = last[2]  # Replaces the update that is waiting
+            else:
+                due = max(now, last[2] + interval)
+        self.last_sent[id] = (v, flags, due)
+        return due
+
+    # The response to a report command.  Raises KeyError if there is no such
+    # item.
+    def __report(self, id):
+        x = self.parent.db_get_item(id)
+        if not x:
+            raise KeyError(id)
+        a = ""
+        for each in x.aux:
+            if len(a) > 0:
+                a = a + ","
+            a = a + each
+        return "@q{0};{1};{2};{3};{4};{5};{6};{7}\n".format(
+            id, x.description, x.typestring, x.min, x.max, x.units, x.tol, a
+        )
 
     def __send_report(self, id):
         try:
-            x = self.parent.db_get_item(id)
-            if not x:
-                raise KeyError
-            a = ""
-            for each in x.aux:
-                if len(a) > 0:
-                    a = a + ","
-                a = a + each
-            s = "@q{0};{1};{2};{3};{4};{5};{6};{7}\n".format(
-                id, x.description, x.typestring, x.min, x.max, x.units, x.tol, a
-            )
-            self.queue.put(s.encode())
+            self.reply(self.__report(id).encode())
         except KeyError:
-            self.queue.put("@q{0}!001\n".format(id).encode())
+            self.reply("@q{0}!001\n".format(id).encode())
+
+    # The response to a read command.  Raises KeyError if there is no such
+    # item.
+    def __read(self, id):
+        val = self.parent.db_read(id)
+        if type(val) is tuple:
+            a = "1" if val[1] else "0"
+            o = "1" if val[2] else "0"
+            b = "1" if val[3] else "0"
+            f = "1" if val[4] else "0"
+            s = "1" if val[5] else "0"
+            return "@r{0};{1};{2}{3}{4}{5}{6}\n".format(id, val[0], a, o, b, f, s)
+        return "@r{0};{1}\n".format(id, val)
+
+    # Send the report, value and aux values of many keys in one go.  args is
+    # the part of the @xsync command after "sync;".  It is either a comma
+    # separated list of keys or a prefix ending in "*" and can be followed by
+    # ";s" to subscribe to the keys as well.  The responses are the same as
+    # for the @q and @r commands and the end is marked with @xsync and the
+    # number of keys that were sent.
+    def __sync(self, args):
+        spec, _, options = args.partition(";")
+        if options not in ("", "s"):
+            self.reply("@xsync!003\n".encode())
+            return
+        spec = spec or "*"
+        if spec.endswith("*"):
+            keys = [k for k in self.parent.db_list() if k.startswith(spec[:-1])]
+        else:
+            keys = spec.split(",")
+        count = 0
+        for i in range(0, len(keys), SYNC_BATCH):
+            lines = []
+            # Holding the queue lock keeps updates for keys that we subscribe
+            # to from being sent before their current values.
+            with self.queue.cond:
+                for key in keys[i : i + SYNC_BATCH]:
+                    try:
+                        lines.append(self.__report(key))
+                    except KeyError:
+                        lines.append("@q{0}!001\n".format(key))
+                        continue
+                    if options and key not in self.subscriptions:
+                        self.parent.db_callback_add(key, self.subscription_handler)
+                        self.subscriptions.add(key)
+                    lines.append(self.__read(key))
+                    for aux in self.parent.db_get_item(key).aux:
+                        lines.append(self.__read("{0}.{1}".format(key, aux)))
+                    count += 1
+                self.reply_lines(lines)
+        self.reply("@xsync;{0}\n".format(count).encode())
 
     def __send_list(self):
         keys = self.parent.db_list()
@@ -102,31 +470,49 @@ class Connection(object):
         count = len(keys)
         current = 0
         for message in msgs:
-            self.queue.put("@l{0};{1};{2}\n".format(count, current, message).encode())
+            self.reply("@l{0};{1};{2}\n".format(count, current, message).encode())
             current += len(message.split(","))
 
     def __server_specific(self, d):
         if d == "status":
             s = json.dumps(status.get_dict())
-            self.queue.put("@xstatus;{}\n".format(s).encode())
+            self.reply("@xstatus;{}\n".format(s).encode())
         elif d == "kill":
-            self.queue.put("@xkill\n".encode())
+            self.reply("@xkill\n".encode())
             self.parent.quit()
+        elif d == "sync" or d.startswith("sync;"):
+            self.__sync(d[5:])
+        elif d == "binary":
+            if self.binary:
+                self.reply("@xbinary\n".encode())
+                return
+            # The response is the last ASCII message we send.  Value updates
+            # that are still waiting were encoded as ASCII so they are thrown
+            # away and sent again with the current values.
+            with self.queue.cond:
+                pending = self.queue.discard_values()
+                self.reply("@xbinary\n".encode())
+                self.binary = True
+            for key in pending:
+                try:
+                    self.__send_value(key, self.parent.db_read(key))
+                except KeyError:
+                    pass
         else:
-            self.queue.put("@x{}!001".format(d).encode())
+            self.reply("@x{}!001\n".format(d).encode())
 
     def __flag(self, d):
         a = d.split(";")
         try:
             item = self.parent.db_get_item(a[0])
         except KeyError:
-            self.queue.put("@f{0}!001\n".format(d[0]).encode())
+            self.reply("@f{0}!001\n".format(a[0]).encode())
             return
         if a[1] not in ["a", "f", "b", "s", "o"]:
-            self.queue.put("@f{0}!002\n".format(d[0]).encode())
+            self.reply("@f{0}!002\n".format(a[0]).encode())
             return
         if a[2] not in ["1", "0"]:
-            self.queue.put("@f{0}!003\n".format(d[0]).encode())
+            self.reply("@f{0}!003\n".format(a[0]).encode())
             return
         bit = a[2] == "1"
         if a[1] == "a":
@@ -139,7 +525,7 @@ class Connection(object):
             item.fail = bit
         elif a[1] == "s":
             item.secfail = bit
-        self.queue.put("@f{0}\n".format(d).encode())
+        self.reply("@f{0}\n".format(d).encode())
 
     # This is a command that simply writes the value.  It does not change the
     # flags like the normal data write sentence would.  It also has a return
@@ -147,23 +533,23 @@ class Connection(object):
     def __writeValue(self, d):
         a = d.split(";")
         if len(a) < 2:
-            self.queue.put("@w{0}!003\n".format(a[0]).encode())
+            self.reply("@w{0}!003\n".format(a[0]).encode())
             return
         try:
-            self.output_inhibit = True
             # Track inputs so we do not send back to same client
             client_block[self.addr[0]].add(a[0])
-            self.parent.db_write(a[0], a[1])
+            with self.parent.db_origin(self):
+                self.parent.db_write(a[0], a[1])
         except KeyError:
-            self.queue.put("@w{0}!001\n".format(a[0]).encode())
+            self.reply("@w{0}!001\n".format(a[0]).encode())
             return
         except ValueError:
-            self.queue.put("@w{0}!003\n".format(a[0]).encode())
+            self.reply("@w{0}!003\n".format(a[0]).encode())
             return
 
         val = self.parent.db_read(a[0])
         if "." in a[0]:  # This is an aux write
-            self.queue.put("@w{};{}\n".format(a[0], val).encode())
+            self.reply("@w{};{}\n".format(a[0], val).encode())
         else:
             flags = ""
             flags += "1" if val[1] else "0"
@@ -171,7 +557,7 @@ class Connection(object):
             flags += "1" if val[3] else "0"
             flags += "1" if val[4] else "0"
             flags += "1" if val[5] else "0"
-            self.queue.put("@w{};{};{}\n".format(a[0], val[0], flags).encode())
+            self.reply("@w{};{};{}\n".format(a[0], val[0], flags).encode())
 
     def handle_request(self, d):
         if d[0] == "@":  # It's a command frame
@@ -182,39 +568,54 @@ class Connection(object):
                 id = d[2:].strip()
             if d[1] == "r":
                 try:
-                    val = self.parent.db_read(id)
-                    if type(val) is tuple:
-                        a = "1" if val[1] else "0"
-                        o = "1" if val[2] else "0"
-                        b = "1" if val[3] else "0"
-                        f = "1" if val[4] else "0"
-                        s = "1" if val[5] else "0"
-                        st = "@r{0};{1};{2}{3}{4}{5}{6}\n".format(
-                            id, val[0], a, o, b, f, s
-                        )
-                    else:
-                        st = "@r{0};{1}\n".format(id, val)
-                    self.queue.put(st.encode())
+                    self.reply(self.__read(id).encode())
                 except KeyError:
-                    self.queue.put("@r{0}!001\n".format(id).encode())
+                    self.reply("@r{0}!001\n".format(id).encode())
             elif d[1] == "s":
+                request = id
+                id, _, options = id.partition(";")
+                try:
+                    f = self.__subscription_options(options)
+                except ValueError:
+                    self.reply("@s{0}!003\n".format(id).encode())
+                    return
                 if id not in self.subscriptions:
                     try:
-                        self.parent.db_callback_add(id, self.subscription_handler)
-                        self.queue.put("@s{0}\n".format(id).encode())
+                        # The filter has to be there before the first update
+                        if f:
+                            self.filters[id] = f
+                            self.key_filters.clear()
+                        if id.endswith("*"):  # Subscribe to every key with a prefix
+                            self.parent.db_callback_add_prefix(
+                                id[:-1], self.subscription_handler
+                            )
+                        else:
+                            self.parent.db_callback_add(id, self.subscription_handler)
+                        self.reply("@s{0}\n".format(request).encode())
                         self.subscriptions.add(id)
                     except KeyError:
-                        self.queue.put("@s{0}!001\n".format(id).encode())
+                        self.filters.pop(id, None)
+                        self.reply("@s{0}!001\n".format(id).encode())
                 else:  # Duplicate subscription
-                    self.queue.put("@s{0}!002\n".format(id).encode())
+                    self.reply("@s{0}!002\n".format(id).encode())
 
             elif d[1] == "u":
                 try:
-                    self.parent.db_callback_del(id, self.subscription_handler)
-                    self.queue.put("@u{0}\n".format(id).encode())
+                    if id not in self.subscriptions:
+                        raise KeyError(id)
+                    if id.endswith("*"):
+                        self.parent.db_callback_del_prefix(
+                            id[:-1], self.subscription_handler
+                        )
+                    else:
+                        self.parent.db_callback_del(id, self.subscription_handler)
+                    self.reply("@u{0}\n".format(id).encode())
                     self.subscriptions.remove(id)
+                    if self.filters.pop(id, None):
+                        self.key_filters.clear()
+                        self.last_sent.clear()
                 except KeyError:
-                    self.queue.put("@u{0}!001\n".format(id).encode())
+                    self.reply("@u{0}!001\n".format(id).encode())
             elif d[1] == "q":
                 self.__send_report(id)
             elif d[1] == "x":
@@ -224,7 +625,7 @@ class Connection(object):
             elif d[1] == "w":
                 self.__writeValue(d[2:])
             else:  # Unknown command given
-                self.queue.put("{}!004\n".format(d).encode())
+                self.reply("{}!004\n".format(d).encode())
 
         else:  # If no '@' then it must be a value update
             try:
@@ -233,52 +634,82 @@ class Connection(object):
                     self.log.debug(
                         "Bad Frame {0} from {1}".format(d.strip(), self.addr[0])
                     )
-                if x[2] != "0000" or x[2] != "000":
-                    item = self.parent.db_get_item(x[0])
-                    a = x[2][0]
-                    b = x[2][1]
-                    f = x[2][2]
-                    if len(x[2]) == 4:
-                        s = x[2][3]
-                    else:
-                        s = "0"
-                    if a and a == "1":
-                        # self.output_inhibit = True
-                        item.annunciate = True
-                    elif a and a == "0":
-                        # self.output_inhibit = True
-                        item.annunciate = False
-                    if b and b == "1":
-                        # self.output_inhibit = True
-                        item.bad = True
-                    elif b and b == "0":
-                        # self.output_inhibit = True
-                        item.bad = False
-                    if f and f == "1":
-                        # self.output_inhibit = True
-                        item.fail = True
-                    elif f and f == "0":
-                        # self.output_inhibit = True
-                        item.fail = False
-                    if s and s == "1":
-                        # self.output_inhibit = True
-                        item.secfail = True
-                    elif s and s == "0":
-                        # self.output_inhibit = True
-                        item.secfail = False
-                self.output_inhibit = True
-                # Track inputs so we do not send back to same client
-                client_block[self.addr[0]].add(x[0])
-                self.parent.db_write(x[0], x[1])
+                # The flags are abfs, the secondary fail flag is optional
+                a = x[2][0]
+                b = x[2][1]
+                f = x[2][2]
+                if len(x[2]) == 4:
+                    s = x[2][3]
+                else:
+                    s = "0"
+                self.__update(x[0], x[1], a == "1", b == "1", f == "1", s == "1")
             except Exception as e:
                 # We pretty much ignore this stuff for now
                 self.log.debug("Problem with input {0}: {1}".format(d.strip(), e))
 
+    # Write a value and its quality flags that came from the client
+    def __update(self, key, value, a, b, f, s):
+        item = self.parent.db_get_item(key)
+        # Track inputs so we do not send back to same client
+        client_block[self.addr[0]].add(key)
+        # Value and flags are set together so subscribers only see
+        # a single update for the whole sentence.  The change is tagged with
+        # this connection so that it isn't echoed back.
+        with self.parent.db_origin(self):
+            item.update(value, annunciate=a, bad=b, fail=f, secfail=s)
+
+    # Handle a message from the client.  In ASCII mode every line is a TEXT
+    # frame.
+    def handle_frame(self, ftype, payload):
+        if ftype == fixbinary.TEXT:
+            self.handle_request(payload.decode("utf-8"))
+        elif ftype == fixbinary.VALUES:
+            for n, value, flags in fixbinary.decode_values(payload):
+                try:
+                    key = _key_names[n]
+                    if flags is None:
+                        client_block[self.addr[0]].add(key)
+                        with self.parent.db_origin(self):
+                            self.parent.db_write(key, value)
+                    else:
+                        a, o, b, f, s = flags
+                        self.__update(key, value, a, b, f, s)
+                except Exception as e:
+                    self.log.debug("Problem with input {0}: {1}".format(n, e))
+        else:
+            self.log.debug("Unknown frame type {0}".format(ftype))
+
+    # Handle every complete message in data from the client.  Anything left
+    # over is kept until the rest of it arrives.  Returns the number handled.
+    def receive(self, data):
+        count = 0
+        self.framer.feed(data)
+        for ftype, payload in self.framer:
+            count += 1
+            try:
+                self.handle_frame(ftype, payload)
+            except Exception as e:
+                self.log.debug("Bad Message from {0}: {1}".format(self.addr[0], e))
+        return count
+
+    # Called by the queue when the client has fallen too far behind.  Shutting
+    # the socket down makes the server clean the connection up like any other
+    # disconnect.
+    def overflow(self):
+        self.log.warning(
+            "Client {0} port {1} is too far behind, disconnecting".format(
+                str(self.addr[0]), str(self.addr[1])
+            )
+        )
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError as e:
+            self.log.debug("Problem shutting down connection - {0}".format(e))
+
     # Callback function used for subscriptions
     def subscription_handler(self, id, value, udata):
-        if self.output_inhibit:
-            self.output_inhibit = False
-        else:
+        # Don't send the client back what it just wrote
+        if self.parent.db_get_origin() is not self:
             self.__send_value(id, value)
 
 
@@ -304,7 +735,6 @@ class ReceiveThread(threading.Thread):
                     str(self.addr[0]), str(self.addr[1])
                 )
             )
-            buff = ""
             while True:
                 try:
                     data = self.conn.recv(self.bsize)
@@ -312,17 +742,7 @@ class ReceiveThread(threading.Thread):
                     break  # Major error we'll just bail
                 if not data:
                     break
-                try:
-                    dstring = data.decode("utf-8")
-                except UnicodeDecodeError:
-                    self.log.debug("Bad Message from {0}".format(self.addr[0]))
-                for d in dstring:
-                    if d == "\n":
-                        self.co.handle_request(buff)
-                        self.msg_recv += 1
-                        buff = ""
-                    else:
-                        buff += d
+                self.msg_recv += self.co.receive(data)
 
             self.co.queue.put("exit")  # Signals the send thread to exit.
             self.parent.db_callback_del("*", self.co.subscription_handler, None)
@@ -352,18 +772,54 @@ class SendThread(threading.Thread):
         self.parent = co.parent  # This should point up to the Plugin Object
         self.running = True
         self.log = self.parent.log
+        config = self.parent.config
+        # Messages are sent in batches of up to this many bytes.  The first
+        # message of a batch waits up to batch_delay seconds for more.
+        self.batch_bytes = int(config.get("send_batch_bytes") or 1400)
+        self.batch_delay = float(config.get("send_batch_ms") or 0) / 1000
+        self.corked = False
         self.msg_sent = 0
+        self.bytes_sent = 0
+        self.send_calls = 0
+
+    # Hold back partial TCP segments while there is more to send
+    def cork(self, on):
+        if on != self.corked and hasattr(socket, "TCP_CORK"):
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(on))
+            self.corked = on
 
     # All this does is watch the queue in the connection object and
-    # send anything that it finds there to the socket connection
+    # send anything that it finds there to the socket connection.  Whatever
+    # is waiting in the queue is gathered up and sent with one call.
     def run(self):
         try:
-            while True:
+            stop = False
+            while not stop:
                 data = self.co.queue.get()
                 if data == "exit":
                     break
-                self.conn.sendall(data)
-                self.msg_sent += 1
+                batch = bytearray(data)
+                count = 1
+                deadline = time.monotonic() + self.batch_delay
+                while len(batch) < self.batch_bytes:
+                    try:
+                        wait = deadline - time.monotonic()
+                        if wait > 0:
+                            data = self.co.queue.get(timeout=wait)
+                        else:
+                            data = self.co.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if data == "exit":
+                        stop = True
+                        break
+                    batch += data
+                    count += 1
+                self.cork(not stop and not self.co.queue.empty())
+                self.conn.sendall(batch)
+                self.msg_sent += count
+                self.bytes_sent += len(batch)
+                self.send_calls += 1
             self.running = False
         finally:
             self.conn.close()
@@ -372,14 +828,36 @@ class SendThread(threading.Thread):
         self.co.queue.put("exit")
 
 
+# The process, user and group of a client on a Unix domain socket
+def peer_status(co):
+    d = OrderedDict()
+    if co.peer is not None:
+        d["Peer PID"], d["Peer UID"], d["Peer GID"] = co.peer
+    return d
+
+
+def queue_status(co):
+    q = co.queue
+    d = OrderedDict()
+    d["Queued"] = len(q)
+    d["Conflated Updates"] = q.conflated
+    d["Filtered Updates"] = co.filtered
+    d["Lagging"] = q.lagging
+    d["Times Lagging"] = q.lag_count
+    return d
+
+
 # This thread is responsible for starting and stopping the thread pairs that
 #  represent connections.
+# If path is given the thread listens on a Unix domain socket at that path
+# instead of on the TCP port.
 class ServerThread(threading.Thread):
-    def __init__(self, parent):
+    def __init__(self, parent, path=None):
         super(ServerThread, self).__init__()
         self.getout = False  # indicator for when to stop
         self.parent = parent  # parent plugin object
         self.log = parent.log  # simplifies logging
+        self.path = path
         self.host = (
             parent.config["host"]
             if ("host" in parent.config) and parent.config["host"]
@@ -401,114 +879,534 @@ class ServerThread(threading.Thread):
             else 1024
         )
 
+        self.backlog = int(parent.config.get("backlog") or 5)
+        # Zero means no limit.  The limit covers all of the plugin's workers
+        self.max_connections = int(parent.config.get("max_connections") or 0)
+        self.reuseport = False  # Set by the plugin when there are several workers
+        self.refused = 0
+
         self.threads = []
         self.getout = False
 
-    def run(self):
-        while True:
-            if self.getout:
-                break
+    # Create the listening socket.  It is kept for as long as the thread runs
+    # so clients are never refused while it is being recreated.
+    def listen(self):
+        if self.path:
+            self.remove_stale_socket()
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            if self.reuseport:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            s.bind(self.path or (self.host, self.port))
+            s.listen(self.backlog)
+        except OSError:
+            s.close()
+            raise
+        return s
+
+    # A socket file that is left over from a gateway that didn't shut down
+    # cleanly has to be removed before we can bind to the path.  One that
+    # something is still listening on is left alone and the bind fails.
+    def remove_stale_socket(self):
+        try:
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                return
+        except FileNotFoundError:
+            return
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        finally:
+            s.close()
+
+    # Remove our socket file when we stop listening
+    def unlisten(self, s):
+        s.close()
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    # Set up a socket that was just accepted.  Returns the address to use for
+    # the client and the peer credentials, which are only known for Unix
+    # domain sockets on systems that have SO_PEERCRED.
+    def accepted(self, conn, addr):
+        if not self.path:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return addr, None
+        peer = None
+        if hasattr(socket, "SO_PEERCRED"):
+            creds = struct.Struct("3i")
+            peer = creds.unpack(
+                conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size)
+            )
+        # Unix domain clients don't have an address so use the path and the
+        # process ID of the client in its place
+        return (self.path, peer[0] if peer else ""), peer
+
+    # Keep trying to create the listening socket until it works or we are
+    # told to stop.  The port may still be held by something else for a while,
+    # like an old copy of the gateway that is shutting down.  Returns None if
+    # we were stopped first.
+    def bind(self):
+        while not self.getout:
             try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.settimeout(self.timeout)
-                s.bind((self.host, self.port))
-                s.listen(5)
+                return self.listen()
+            except OSError as e:
+                self.log.error(
+                    "Unable to listen on {0}: {1}".format(
+                        self.path or "port {0}".format(self.port), e
+                    )
+                )
+                time.sleep(self.timeout)
+        return None
+
+    def connections(self):
+        return len(self.threads)
+
+    # Returns True and closes the new connection if we are at max_connections
+    def refuse(self, conn, addr):
+        if not self.max_connections:
+            return False
+        if self.parent.connection_count() < self.max_connections:
+            return False
+        self.log.info(
+            "Too many connections, refusing {0} port {1}".format(
+                str(addr[0]), str(addr[1])
+            )
+        )
+        self.refused += 1
+        conn.close()
+        return True
+
+    # Clean up after connections that the client has closed
+    def reap(self):
+        for each in list(self.threads):
+            # The receive thread will stop running when the client closes
+            # This shoudl stop the send thread and clean it all up.
+            if not each[0].running:
+                each[0].join()
+                each[1].stop()
+                each[1].join()
+                self.threads.remove(each)
+
+    def run(self):
+        s = self.bind()
+        if s is None:
+            return
+        s.settimeout(self.timeout)
+        try:
+            while not self.getout:
                 try:
                     conn, addr = s.accept()
                 except socket.timeout:
-                    # if the getout flag is set let's bail.
-                    if self.getout:
-                        try:
-                            s.shutdown(socket.SHUT_RDWR)
-                        except Exception as e:
-                            # For now just log the exception
-                            self.log.debug(e)
-                        for each in self.threads:
-                            each[0].stop()
-                            each[0].join()
-                            each[1].stop()
-                            each[1].join()
-                        break
                     # General thread maintainance
-                    for each in self.threads:
-                        # The receive thread will stop running when the client closes
-                        # This shoudl stop the send thread and clean it all up.
-                        if not each[0].running:
-                            each[0].join()
-                            each[1].stop()
-                            each[1].join()
-                            self.threads.remove(each)
+                    self.reap()
+                    continue
+                self.reap()
+                addr, peer = self.accepted(conn, addr)
+                if self.refuse(conn, addr):
+                    continue
+                co = Connection(self.parent, conn, addr)
+                co.peer = peer
+                receivethread = ReceiveThread(co)
+                sendthread = SendThread(co)
 
-                else:
-                    co = Connection(self.parent, conn, addr)
-                    receivethread = ReceiveThread(co)
-                    sendthread = SendThread(co)
-
-                    self.threads.append((receivethread, sendthread))
-                    receivethread.start()
-                    sendthread.start()
-            finally:
-                s.close()
+                self.threads.append((receivethread, sendthread))
+                receivethread.start()
+                sendthread.start()
+        finally:
+            self.unlisten(s)
+            for each in self.threads:
+                each[0].stop()
+                each[0].join()
+                each[1].stop()
+                each[1].join()
 
     def stop(self):
         self.getout = True
 
-    def get_status(self):
-        d = OrderedDict({"Current Connections": len(self.threads)})
-        for i, t in enumerate(self.threads):
+    # Returns a list of status dictionaries, one for each connection
+    def connection_status(self):
+        result = []
+        for t in list(self.threads):
             c = OrderedDict()
             c["Client"] = t[0].addr
+            c.update(peer_status(t[0].co))
             c["Messages Received"] = t[0].msg_recv
             c["Messages Sent"] = t[1].msg_sent
+            c["Bytes Sent"] = t[1].bytes_sent
+            c["Send Calls"] = t[1].send_calls
+            c["Messages Per Send"] = round(t[1].msg_sent / (t[1].send_calls or 1), 1)
             # "Subscriptions":','.join(t[0].co.subscriptions)}
             c["Subscriptions"] = len(t[0].co.subscriptions)
+            c.update(queue_status(t[0].co))
+            result.append(c)
+        return result
+
+    def status_dict(self, connections, refused):
+        d = OrderedDict({"Current Connections": len(connections)})
+        if self.max_connections:
+            d["Refused Connections"] = refused
+        for i, c in enumerate(connections):
             d["Connection {0}".format(i)] = c
         return d
 
+    def get_status(self):
+        return self.status_dict(self.connection_status(), self.refused)
 
-class ClientThread(threading.Thread):
 
+# The state of one connection in the SelectServerThread
+class LoopClient(object):
+    def __init__(self, co):
+        self.co = co
+        self.conn = co.conn
+        self.addr = co.addr
+        self.outbuf = bytearray()
+        self.writing = False  # True when we are waiting for the socket to drain
+        self.msg_recv = 0
+        self.msg_sent = 0
+        self.bytes_sent = 0
+        self.send_calls = 0
+
+
+# This handles every connection from a single thread with non-blocking
+# sockets instead of starting two threads for each connection.  It is used
+# when the mode is set to "select" in the configuration.  Database callbacks
+# run in the thread that wrote the data so they only put the message in the
+# connection's queue and wake the loop up through a socket pair.
+class SelectServerThread(ServerThread):
+    def __init__(self, parent, path=None):
+        super(SelectServerThread, self).__init__(parent, path)
+        self.clients = {}
+        self.selector = None
+        # Only this much is taken out of a client's queue ahead of the socket
+        # so updates for a slow client stay in the queue where they conflate
+        self.batch_bytes = int(parent.config.get("send_batch_bytes") or 1400)
+        self.woken = False
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+
+    # This may be called from any thread
+    def wake(self):
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wake_w.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # Already plenty to wake up for or we are shutting down
+
+    # Empty the wake up socket.  The flag is only cleared afterwards so a
+    # wake() that happens while draining can never leave it set with nothing
+    # in the socket, which would stop every later wake() from sending.  Any
+    # message queued before the flag is cleared is picked up by the loop's
+    # pass over the queues that follows.
+    def drain_wake(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.woken = False
+
+    def run(self):
+        s = self.bind()
+        if s is None:
+            self.wake_r.close()
+            self.wake_w.close()
+            return
+        self.selector = selectors.DefaultSelector()
+        s.setblocking(False)
+        self.selector.register(s, selectors.EVENT_READ, "listen")
+        self.selector.register(self.wake_r, selectors.EVENT_READ, "wake")
+        try:
+            while not self.getout:
+                # Wake up in time to send updates that are being held back
+                timeout = self.timeout
+                for client in list(self.clients.values()):
+                    due = client.co.queue.next_due()
+                    if due is not None:
+                        timeout = min(timeout, max(0, due - time.monotonic()))
+                for key, mask in self.selector.select(timeout):
+                    if key.data == "listen":
+                        self.accept(s)
+                    elif key.data == "wake":
+                        self.drain_wake()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self.read(key.data)
+                        if mask & selectors.EVENT_WRITE:
+                            self.flush(key.data)
+                for client in list(self.clients.values()):
+                    if not client.writing and not client.co.queue.empty():
+                        self.flush(client)
+        finally:
+            for client in list(self.clients.values()):
+                self.close(client)
+            self.selector.close()
+            self.unlisten(s)
+            self.wake_r.close()
+            self.wake_w.close()
+
+    def accept(self, s):
+        try:
+            conn, addr = s.accept()
+        except BlockingIOError:
+            return
+        addr, peer = self.accepted(conn, addr)
+        if self.refuse(conn, addr):
+            return
+        conn.setblocking(False)
+        co = Connection(self.parent, conn, addr)
+        co.peer = peer
+        co.queue.wake = self.wake
+        client = LoopClient(co)
+        self.clients[conn] = client
+        self.selector.register(conn, selectors.EVENT_READ, client)
+        self.log.info(
+            "Client connection from {0} port {1}".format(str(addr[0]), str(addr[1]))
+        )
+
+    def read(self, client):
+        try:
+            data = client.conn.recv(self.buffer_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.log.info(
+                "Disconnected by {0} port {1}".format(
+                    str(client.addr[0]), str(client.addr[1])
+                )
+            )
+            self.close(client)
+            return
+        client.msg_recv += client.co.receive(data)
+
+    # Move messages from the connection's queue to the output buffer in
+    # batches and send them until the queue is empty or the socket is full.
+    def flush(self, client):
+        q = client.co.queue
+        while True:
+            while len(client.outbuf) < self.batch_bytes and not q.empty():
+                client.outbuf += q.get_nowait()
+                client.msg_sent += 1
+            if not client.outbuf:
+                break
+            try:
+                sent = client.conn.send(client.outbuf)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.close(client)
+                return
+            client.send_calls += 1
+            client.bytes_sent += sent
+            del client.outbuf[:sent]
+            if client.outbuf:
+                break  # The socket is full
+        writing = len(client.outbuf) > 0
+        if writing != client.writing:
+            client.writing = writing
+            events = selectors.EVENT_READ
+            if writing:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(client.conn, events, client)
+
+    def close(self, client):
+        if self.clients.pop(client.conn, None) is None:
+            return
+        self.parent.db_callback_del("*", client.co.subscription_handler, None)
+        try:
+            self.selector.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
+        client.conn.close()
+
+    def stop(self):
+        self.getout = True
+        self.wake()
+
+    def connections(self):
+        return len(self.clients)
+
+    def connection_status(self):
+        result = []
+        for t in list(self.clients.values()):
+            c = OrderedDict()
+            c["Client"] = t.addr
+            c.update(peer_status(t.co))
+            c["Messages Received"] = t.msg_recv
+            c["Messages Sent"] = t.msg_sent
+            c["Bytes Sent"] = t.bytes_sent
+            c["Send Calls"] = t.send_calls
+            c["Messages Per Send"] = round(t.msg_sent / (t.send_calls or 1), 1)
+            c["Subscriptions"] = len(t.co.subscriptions)
+            c.update(queue_status(t.co))
+            result.append(c)
+        return result
+
+
+# Sends the outputs to one of the gateways that we are a client of.  Changed
+# keys are kept in a set so a key that changes several times before it is
+# sent only goes once with its latest value.  All of the writes in a batch
+# are sent before waiting for any of the answers, and each peer has its own
+# thread so a slow or missing peer doesn't hold up the others.
+class PeerWorker(threading.Thread):
+    def __init__(self, parent, client, batch_size=64, interval=0.2):
+        super(PeerWorker, self).__init__()
+        self.daemon = True
+        self.parent = parent
+        self.log = parent.log
+        self.client = client
+        self.batch_size = batch_size
+        self.interval = interval  # The least time between batches
+        self.stopped = threading.Event()
+        self.cond = threading.Condition()
+        self.dirty = set()
+        self.since = None  # When the oldest change in dirty was made
+        self.sent = 0
+        self.retries = 0
+        self.rejected = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def mark(self, key):
+        with self.cond:
+            if not self.dirty:
+                self.since = time.monotonic()
+                self.cond.notify()
+            self.dirty.add(key)
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.cond:
+                while not self.dirty and not self.stopped.is_set():
+                    self.cond.wait(1.0)
+            self.stopped.wait(self.cycle())
+
+    # Send everything that has changed.  Returns how long to wait before
+    # the next batch.
+    def cycle(self):
+        start = time.monotonic()
+        with self.cond:
+            keys = self.dirty
+            since = self.since
+            self.dirty = set()
+            self.since = None
+        if not keys:
+            return 0
+        failed = self.send(keys)
+        now = time.monotonic()
+        if failed:
+            # Try these again with the next batch
+            with self.cond:
+                self.dirty |= failed
+                if self.since is None or since < self.since:
+                    self.since = since
+            return max(self.interval, PEER_RETRY)
+        self.lag = now - since
+        self.max_lag = max(self.max_lag, self.lag)
+        return self.interval - (now - start)
+
+    # Returns the keys that could not be sent
+    def send(self, keys):
+        host = self.client.cthread.host
+        keys = list(keys)
+        failed = set()
+        for i in range(0, len(keys), self.batch_size):
+            writes = {}
+            for key in keys[i : i + self.batch_size]:
+                # Don't send a value back to the gateway that it came from
+                if key in client_block[host]:
+                    client_block[host].discard(key)
+                    continue
+                try:
+                    value = self.parent.db_read(key)[0]
+                    writes[self.client.writeValueFuture(key, value)] = key
+                except Exception as e:
+                    self.log.debug(
+                        "Unable to send {0} to {1}: {2}".format(key, host, e)
+                    )
+                    failed.add(key)
+            done, waiting = concurrent.futures.wait(
+                writes, timeout=self.client.cthread.timeout
+            )
+            for future in waiting:
+                future.cancel()
+                failed.add(writes[future])
+            for future in done:
+                try:
+                    res = future.result()
+                except Exception:
+                    failed.add(writes[future])
+                    continue
+                if "!" in res:
+                    # The peer won't take it so there's no point in retrying
+                    self.log.debug("{0} refused {1}".format(host, res))
+                    self.rejected += 1
+                else:
+                    self.sent += 1
+        self.retries += len(failed)
+        return failed
+
+    def stop(self):
+        self.stopped.set()
+        with self.cond:
+            self.cond.notify()
+
+    def get_status(self):
+        d = OrderedDict()
+        cthread = self.client.cthread
+        d["Host"] = "{0}:{1}".format(cthread.host, cthread.port)
+        d["Connected"] = self.client.isConnected()
+        d["Pending"] = len(self.dirty)
+        d["Sent"] = self.sent
+        d["Retries"] = self.retries
+        d["Rejected"] = self.rejected
+        d["Lag ms"] = round(self.lag * 1000, 1)
+        d["Max Lag ms"] = round(self.max_lag * 1000, 1)
+        return d
+
+
+class ClientThread(threading.Thread):
     def __init__(self, parent):
         super(ClientThread, self).__init__()
         self.getout = False  # indicator for when to stop
         self.parent = parent  # parent plugin object
         self.log = parent.log  # simplifies logging
         self.config = parent.config
-        self.queue = deque()
+        batch_size = int(self.config.get("batch_size", 64))
+        interval = float(self.config.get("send_interval", 0.2))
 
         # Connect to each client here
         self.clients = []
+        self.peers = []
 
         for c in self.config["clients"]:
-            self.clients.append(netfix.Client(c["host"], c.get("port", 3490)))
-            self.clients[-1].connect()
+            client = netfix.Client(c["host"], c.get("port", 3490))
+            client.connect()
+            self.clients.append(client)
+            self.peers.append(PeerWorker(parent, client, batch_size, interval))
 
         for o in self.config["outputs"]:
             self.parent.db_callback_add(o.upper(), self.getOutputFunction(o.upper()))
 
     def run(self):
-        while True:
-            if self.getout:
-                break
-            # Do stuff here
-            while len(self.queue) > 0:
-                # Maybe a pause when exception?
-                key = self.queue.popleft()
-                for c in self.clients:
-                    try:
-                        # Block sending back to self
-                        if key not in client_block[c.cthread.host]:
-                            c.writeValue(key, self.parent.db_read(key)[0])
-                        else:
-                            # Remove the block since we just blocked it
-                            client_block[c.cthread.host].discard(key)
-                    except Exception as e:
-                        if key not in self.queue:
-                            self.queue.append(key)
-                time.sleep(0.0001)
-            # Limit how often we send data to other nodes
-            time.sleep(0.2)
+        for each in self.peers:
+            each.start()
+        for each in self.peers:
+            each.join()
 
     def getOutputFunction(self, key):
         def outputCallback(fixkey, value, udata):
@@ -518,13 +1416,15 @@ class ClientThread(threading.Thread):
                 # But currently the goal is just sending the value and
                 # preventing loops
                 return
-            if key not in self.queue:
-                self.queue.append(key)
+            for each in self.peers:
+                each.mark(key)
 
         return outputCallback
 
     def stop(self):
         self.getout = True
+        for each in self.peers:
+            each.stop()
         for c in self.clients:
             c.disconnect()
 
@@ -532,13 +1432,15 @@ class ClientThread(threading.Thread):
         connected = 0
         disconnected = 0
         for c in self.clients:
-            if c.isConnected:
+            if c.isConnected():
                 connected += 1
             else:
                 disconnected += 1
         d = OrderedDict({"Current Clients": connected + disconnected})
         d["Connected"] = connected
         d["Disonnected"] = disconnected
+        for i, each in enumerate(self.peers):
+            d["Peer {0}".format(i)] = each.get_status()
 
         return d
 
@@ -547,7 +1449,30 @@ class Plugin(plugin.PluginBase):
     def __init__(self, name, config, config_meta):
         super(Plugin, self).__init__(name, config, config_meta)
         if config["type"] in ["server", "both"]:
-            self.thread = ServerThread(self)
+            # Several workers can share the port, the kernel spreads the
+            # clients between them
+            workers = int(config.get("workers") or 1)
+            if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+                self.log.warning("SO_REUSEPORT is not supported, using one worker")
+                workers = 1
+            if config.get("mode", "threads") == "select":
+                worker = SelectServerThread
+            else:
+                worker = ServerThread
+            self.workers = []
+            if config.get("tcp", True):
+                self.workers = [worker(self) for i in range(workers)]
+                for each in self.workers:
+                    each.reuseport = workers > 1
+            # Local clients can connect through a Unix domain socket instead
+            # of TCP.  This can be as well as or instead of the TCP port.
+            if config.get("unix_socket"):
+                if not hasattr(socket, "AF_UNIX"):
+                    raise ValueError("Unix domain sockets are not supported")
+                self.workers.append(worker(self, config["unix_socket"]))
+            if not self.workers:
+                raise ValueError("The server needs tcp or unix_socket")
+            self.thread = self.workers[0]
         if config["type"] in ["client", "both"]:
             self.client = ClientThread(self)
         if config["type"] not in ["server", "client", "both"]:
@@ -555,24 +1480,27 @@ class Plugin(plugin.PluginBase):
 
     def run(self):
         if self.config["type"] in ["server", "both"]:
-            self.thread.start()
+            for each in self.workers:
+                each.start()
         if self.config["type"] in ["client", "both"]:
             self.client.start()
 
     def stop(self):
         if self.config["type"] in ["server", "both"]:
-            self.thread.stop()
-            if self.thread.is_alive():
-                self.thread.join(2.0)
+            for each in self.workers:
+                each.stop()
+            for each in self.workers:
+                if each.is_alive():
+                    each.join(2.0)
         if self.config["type"] in ["client", "both"]:
             self.client.stop()
             if self.client.is_alive():
                 self.client.join(2.0)
         if self.config["type"] == "both":
-            if self.thread.is_alive() or self.client.is_alive():
+            if self.server_alive() or self.client.is_alive():
                 raise plugin.PluginFail
         elif self.config["type"] == "server":
-            if self.thread.is_alive():
+            if self.server_alive():
                 raise plugin.PluginFail
         elif self.config["type"] == "client":
             if self.client.is_alive():
@@ -581,5 +1509,26 @@ class Plugin(plugin.PluginBase):
             # if self.thread.is_alive():
             #    raise plugin.PluginFail
 
+    def server_alive(self):
+        return any(each.is_alive() for each in self.workers)
+
+    # The number of clients connected to all of the workers
+    def connection_count(self):
+        return sum(each.connections() for each in self.workers)
+
     def get_status(self):
-        return self.thread.get_status()
+        if self.config["type"] == "client":
+            return self.client.get_status()
+        if len(self.workers) == 1:
+            d = self.thread.get_status()
+        else:
+            connections = []
+            for each in self.workers:
+                connections.extend(each.connection_status())
+            d = self.thread.status_dict(
+                connections, sum(each.refused for each in self.workers)
+            )
+            d["Workers"] = len(self.workers)
+        if self.config["type"] == "both":
+            d["Client"] = self.client.get_status()
+        return d
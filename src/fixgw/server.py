@@ -247,6 +247,15 @@ def main_setup():
         log.error("Database failure, Exiting:" + str(e))
         raise
 
+    # Optionally send database callbacks through per plugin queues
+    dispatch = config.get("callback dispatch", None)
+    if dispatch and dispatch.get("enabled", True):
+        database.start_dispatcher(
+            dispatch.get("queue size", 256),
+            dispatch.get("overflow", "conflate"),
+            dispatch.get("plugins", None),
+        )
+
     database.write("GATEWAY_VERSION", __version__)
     if "initialization files" in config and config["initialization files"]:
         ifiles = config["initialization files"]
@@ -39,6 +39,9 @@ class Status:
         result.update(get_system_status())
         # Database information
         db = {"Item Count": self.db_item_count}
+        dispatch = database.dispatch_status()
+        if dispatch is not None:
+            db["Callback Dispatch"] = dispatch
         result["Database Statistics"] = db
         # Add plugin status
         for name in self.plugins:
@@ -52,7 +52,7 @@ def test_run_replays_snapshot_values_from_config_relative_file(tmp_path):
         frequency=250,
         snapshots=[
             {"ENG1": [100.0, 0, 0, 0, 0, 0]},
-            {"ENG1": [101.5, 1, 0, 0, 0, 0], "ALT": [2500, 0, 0, 0, 0, 0]},
+            {"ENG1": [101.5, 1, 1, 0, 1, 0], "ALT": [2500, 0, 0, 1, 0, 1]},
         ],
     )
     parent = _parent(tmp_path, ["{CONFIG}/playback.json"])
@@ -70,8 +70,13 @@ def test_run_replays_snapshot_values_from_config_relative_file(tmp_path):
     ):
         thread.run()
 
-    assert items["ENG1"].value == (101.5, 1, 0, 0, 0, 0)
-    assert items["ALT"].value == (2500, 0, 0, 0, 0, 0)
+    # The recorded old flag is not played back, the database works that out
+    items["ENG1"].update.assert_called_with(
+        101.5, annunciate=1, bad=0, fail=1, secfail=0
+    )
+    items["ALT"].update.assert_called_once_with(
+        2500, annunciate=0, bad=1, fail=0, secfail=1
+    )
     assert len(sleeps) == 2
     parent.quit.assert_not_called()
 
@@ -106,7 +111,7 @@ def test_run_skips_snapshots_until_start_time(tmp_path):
     ):
         thread.run()
 
-    assert item.value == (300.0, 0, 0, 0, 0, 0)
+    item.update.assert_called_with(300.0, annunciate=0, bad=0, fail=0, secfail=0)
     parent.quit.assert_called_once()
     assert sleeps[-1] == 5
 
@@ -19,8 +19,8 @@ def _parent(config=None, values=None):
     if config:
         parent.config.update(config)
     parent.log = MagicMock()
-    parent.db_callback_add = MagicMock()
-    parent.db_read = MagicMock(side_effect=lambda key: values[key])
+    parent.db_callback_add_prefix = MagicMock()
+    parent.values = values
     return parent
 
 
@@ -28,49 +28,58 @@ def _value(value, old=False, bad=False, fail=False, secfail=False):
     return (value, old, bad, fail, secfail, 0)
 
 
-def _make_thread(parent, keys):
-    with patch.object(data_recorder.database, "listkeys", return_value=keys):
-        return data_recorder.MainThread(parent)
+def _make_thread(parent):
+    return data_recorder.MainThread(parent)
 
 
-def test_init_registers_callbacks_for_matching_prefixes_only():
+def _snapshot(parent, keys):
+    def snapshot(prefix):
+        return {
+            key: data_recorder.database.ItemState(*parent.values[key], 0.0, 0, {})
+            for key in keys
+            if key.startswith(tuple(prefix))
+        }
+
+    return snapshot
+
+
+def test_init_registers_prefix_callbacks_for_key_prefixes():
     parent = _parent()
 
-    _make_thread(parent, ["ENG1", "FUELQTY", "ALT", "ENGINE2"])
+    _make_thread(parent)
 
-    assert [call.args[0] for call in parent.db_callback_add.call_args_list] == [
-        "ENG1",
-        "FUELQTY",
-        "ENGINE2",
+    assert [call.args[0] for call in parent.db_callback_add_prefix.call_args_list] == [
+        "ENG",
+        "FUEL",
     ]
     assert all(
-        call.args[1].__self__ is parent.db_callback_add.call_args_list[0].args[1].__self__
-        for call in parent.db_callback_add.call_args_list
+        call.args[1].__self__
+        is parent.db_callback_add_prefix.call_args_list[0].args[1].__self__
+        for call in parent.db_callback_add_prefix.call_args_list
     )
 
 
-def test_init_registers_all_callbacks_when_key_prefixes_is_all():
+def test_init_registers_empty_prefix_when_key_prefixes_is_all():
     parent = _parent({"key_prefixes": "all"})
 
-    _make_thread(parent, ["ENG1", "ALT"])
+    _make_thread(parent)
 
-    assert [call.args[0] for call in parent.db_callback_add.call_args_list] == [
-        "ENG1",
-        "ALT",
+    assert [call.args[0] for call in parent.db_callback_add_prefix.call_args_list] == [
+        "",
     ]
 
 
 def test_non_all_string_prefix_registers_no_callbacks():
     parent = _parent({"key_prefixes": "ENG"})
 
-    _make_thread(parent, ["ENG1", "ALT"])
+    _make_thread(parent)
 
-    parent.db_callback_add.assert_not_called()
+    parent.db_callback_add_prefix.assert_not_called()
 
 
 def test_persist_stores_only_tuple_database_values():
     parent = _parent()
-    thread = _make_thread(parent, [])
+    thread = _make_thread(parent)
 
     thread.persist("ENG1", _value(123.4, old=True, bad=False, fail=True, secfail=False))
     thread.persist("ENG1.Aux", 22.0)
@@ -80,16 +89,15 @@ def test_persist_stores_only_tuple_database_values():
 
 def test_get_all_data_snapshots_matching_keys_without_callbacks():
     parent = _parent(values={"ENG1": _value(10.0), "FUELQTY": _value(25.5)})
-    thread = _make_thread(parent, ["ENG1", "FUELQTY", "ALT"])
+    thread = _make_thread(parent)
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1", "FUELQTY", "ALT"]):
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1", "FUELQTY", "ALT"])):
         thread.get_all_data(callbacks=False)
 
     assert thread.data == {
         "ENG1": [10.0, 0, 0, 0, 0, 0],
         "FUELQTY": [25.5, 0, 0, 0, 0, 0],
     }
-    assert parent.db_read.call_count == 2
 
 
 def test_get_all_data_snapshots_all_keys_without_callbacks():
@@ -97,9 +105,9 @@ def test_get_all_data_snapshots_all_keys_without_callbacks():
         {"key_prefixes": "all"},
         values={"ENG1": _value(10.0), "ALT": _value(2500.0, bad=True)},
     )
-    thread = _make_thread(parent, ["ENG1", "ALT"])
+    thread = _make_thread(parent)
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1", "ALT"]):
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1", "ALT"])):
         thread.get_all_data(callbacks=False)
 
     assert thread.data == {
@@ -118,12 +126,12 @@ def test_run_writes_header_and_data_snapshot(tmp_path):
         },
         values={"ENG1": _value(123.4, old=True)},
     )
-    thread = _make_thread(parent, ["ENG1"])
+    thread = _make_thread(parent)
 
     def stop_after_first_interval(_duration):
         thread.getout = True
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1"]), patch.object(
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1"])), patch.object(
         data_recorder.time, "sleep", side_effect=stop_after_first_interval
     ):
         thread.run()
@@ -147,7 +155,7 @@ def test_run_reuses_current_file_within_same_hour(tmp_path):
         },
         values={"ENG1": _value(123.4)},
     )
-    thread = _make_thread(parent, ["ENG1"])
+    thread = _make_thread(parent)
     sleep_calls = 0
 
     def stop_after_second_interval(_duration):
@@ -158,7 +166,7 @@ def test_run_reuses_current_file_within_same_hour(tmp_path):
         else:
             thread.getout = True
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1"]), patch.object(
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1"])), patch.object(
         data_recorder.time, "sleep", side_effect=stop_after_second_interval
     ):
         thread.run()
@@ -181,7 +189,7 @@ def test_run_swaps_buffers_before_writing_interval_data(tmp_path):
         },
         values={"ENG1": _value(123.4)},
     )
-    thread = _make_thread(parent, ["ENG1"])
+    thread = _make_thread(parent)
     captured = {}
     real_json_dumps = json.dumps
 
@@ -194,7 +202,7 @@ def test_run_swaps_buffers_before_writing_interval_data(tmp_path):
     def stop_after_first_interval(_duration):
         thread.getout = True
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1"]), patch.object(
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1"])), patch.object(
         data_recorder.json, "dumps", side_effect=update_next_interval_before_json_dump
     ), patch.object(data_recorder.time, "sleep", side_effect=stop_after_first_interval):
         thread.run()
@@ -213,12 +221,12 @@ def test_run_logs_exceptions_when_file_cannot_be_opened(tmp_path):
         },
         values={"ENG1": _value(123.4)},
     )
-    thread = _make_thread(parent, ["ENG1"])
+    thread = _make_thread(parent)
 
     def stop_after_first_interval(_duration):
         thread.getout = True
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1"]), patch(
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1"])), patch(
         "builtins.open", side_effect=OSError("disk full")
     ), patch.object(data_recorder.time, "sleep", side_effect=stop_after_first_interval):
         thread.run()
@@ -239,7 +247,7 @@ def test_run_throttles_repeated_file_open_errors(tmp_path):
         },
         values={"ENG1": _value(123.4)},
     )
-    thread = _make_thread(parent, ["ENG1"])
+    thread = _make_thread(parent)
     sleep_calls = 0
 
     def stop_after_second_interval(_duration):
@@ -248,7 +256,7 @@ def test_run_throttles_repeated_file_open_errors(tmp_path):
         if sleep_calls == 2:
             thread.getout = True
 
-    with patch.object(data_recorder.database, "listkeys", return_value=["ENG1"]), patch(
+    with patch.object(data_recorder.database, "snapshot", side_effect=_snapshot(parent, ["ENG1"])), patch(
         "builtins.open", side_effect=OSError("disk full")
     ), patch.object(data_recorder.time, "sleep", side_effect=stop_after_second_interval):
         thread.run()
@@ -257,7 +265,7 @@ def test_run_throttles_repeated_file_open_errors(tmp_path):
 
 
 def test_stop_sets_getout_flag():
-    thread = _make_thread(_parent(), [])
+    thread = _make_thread(_parent())
 
     thread.stop()
 
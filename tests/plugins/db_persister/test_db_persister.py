@@ -22,8 +22,8 @@ class FakeParent:
         self.log = FakeLog()
         self.callbacks = []
 
-    def db_callback_add(self, key, function):
-        self.callbacks.append((key, function))
+    def db_callback_add_regex(self, regex, function):
+        self.callbacks.append((regex, function))
 
 
 def test_main_thread_creates_tables_persists_rows_and_flushes(tmp_path, monkeypatch):
@@ -57,19 +57,17 @@ entries:
 
     thread = db_persister.MainThread(parent)
     try:
-        assert [key for key, _callback in parent.callbacks] == [
-            "ALT",
-            "COUNT",
-            "ACTIVE",
-            "NAME",
-        ]
+        [(regex, persist)] = parent.callbacks
+        assert regex == "^(ALT|COUNT|ACTIVE|NAME)$"
         assert "create table ALT" in parent.log.debugs
-
-        callbacks = dict(parent.callbacks)
-        callbacks["ALT"]("ALT", (12.5, False, False, False, False, False))
-        callbacks["COUNT"]("COUNT", (3, False, False, False, False, False))
-        callbacks["ACTIVE"]("ACTIVE", (True, False, False, False, False, False))
-        callbacks["NAME"]("NAME", ("OK", False, False, False, False, False))
+        assert "create table SKIP" not in parent.log.debugs
+
+        persist("ALT", (12.5, False, False, False, False, False))
+        persist("COUNT", (3, False, False, False, False, False))
+        persist("ACTIVE", (True, False, False, False, False, False))
+        persist("NAME", ("OK", False, False, False, False, False))
+        # Matched by the regex but not in the schema
+        persist("NAMES", ("NO", False, False, False, False, False))
 
         sleeps = 0
 
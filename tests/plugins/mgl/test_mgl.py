@@ -112,8 +112,9 @@ def test_get_run_filters_unwanted_frames_and_decodes_core_values():
 
     assert parent.recvcount == 3
     assert parent.wantcount == 2
-    parent.db_write.assert_any_call("oil_temp", 123)
-    parent.db_write.assert_any_call("oil_pressure", 50.0)
+    parent.db_write_many.assert_called_once_with(
+        {"oil_temp": 123, "oil_pressure": 50.0}
+    )
 
 
 def test_get_run_decodes_temperature_compensation_voltage_and_rpm_scaling():
@@ -136,10 +137,9 @@ def test_get_run_decodes_temperature_compensation_voltage_and_rpm_scaling():
 
     getter.run()
 
-    parent.db_write.assert_any_call("rdac_temp", 10)
-    parent.db_write.assert_any_call("rdac_volt", 17.43)
-    parent.db_write.assert_any_call("tc1", 5)
-    parent.db_write.assert_any_call("rpm1", 60000)
+    parent.db_write_many.assert_any_call({"rdac_temp": 10, "rdac_volt": 17.43})
+    parent.db_write_many.assert_any_call({"tc1": 5})
+    parent.db_write_many.assert_any_call({"rpm1": 60000})
 
 
 def test_get_run_covers_error_marker_low_rpm_and_initial_getout(monkeypatch):
@@ -164,8 +164,8 @@ def test_get_run_covers_error_marker_low_rpm_and_initial_getout(monkeypatch):
 
     getter.run()
 
-    parent.db_write.assert_any_call("rpm1", 2400)
-    parent.db_write.assert_any_call("oil_temp", 123)
+    parent.db_write_many.assert_any_call({"rpm1": 2400})
+    parent.db_write_many.assert_any_call({"oil_temp": 123})
 
     idle_getter = rdac.Get(parent, {"get": {}})
     idle_getter.getout = True
@@ -126,15 +126,18 @@ entries:
   initial: "Loaded"
 """
 
-@pytest.fixture
-def netfix_config():
+# Every server test is run against the thread per connection server and the
+# single threaded select server
+@pytest.fixture(params=["threads", "select"])
+def netfix_config(request):
     return """
 type: server
+mode: {}
 host: 0.0.0.0
 port: 34901
 buffer_size: 1024
 timeout: 1.0
-"""
+""".format(request.param)
 
 
 Objects = namedtuple(
@@ -15,10 +15,14 @@
 #  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 import io
+import os
 import time
 import yaml
 import socket
 import logging
+import pytest
+import fixgw.plugins.netfix
+import fixgw.netfix.binary
 
 
 
@@ -98,6 +102,143 @@ def test_unsubscribe(plugin,database):
     res = plugin.sock.recv(1024).decode()
     assert res == "ALT;3200.0;00000\n"
 
+def test_prefix_subscription(plugin,database):
+    plugin.sock.sendall("@sANLG*\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@sANLG*\n"
+
+    database.write("ANLG3", 0.5)
+    database.write("ALT", 3100)
+    database.write("ANLG8", 0.25)
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ANLG3;0.5;00000\nANLG8;0.25;00000\n"
+
+    plugin.sock.sendall("@uANLG*\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@uANLG*\n"
+    plugin.sock.sendall("@uANLG*\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@uANLG*!001\n"
+
+def test_prefix_and_key_subscriptions_overlap(plugin,database):
+    for sub in ["ANLG*", "ANLG3"]:
+        plugin.sock.sendall("@s{}\n".format(sub).encode())
+        res = plugin.sock.recv(1024).decode()
+        assert res == "@s{}\n".format(sub)
+
+    # The prefix still covers ANLG3 after it is unsubscribed on its own
+    plugin.sock.sendall("@uANLG3\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@uANLG3\n"
+    database.write("ANLG3", 0.5)
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ANLG3;0.5;00000\n"
+
+    # And the key subscription keeps ANLG3 after the prefix is removed
+    plugin.sock.sendall("@sANLG3\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@sANLG3\n"
+    plugin.sock.sendall("@uANLG*\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@uANLG*\n"
+    database.write("ANLG8", 0.25)
+    database.write("ANLG3", 0.75)
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ANLG3;0.75;00000\n"
+
+def test_sync_sends_reports_values_and_subscribes(plugin,database):
+    plugin.sock.sendall("@xsync;IAS,NOPE,ALT;s\n".encode())
+    res = b""
+    while not res.endswith(b"@xsync;2\n"):
+        res += plugin.sock.recv(4096)
+    lines = res.decode().splitlines()
+    assert lines[0].startswith("@qIAS;")
+    assert lines[1] == "@rIAS;0.0;00000"
+    aux = [x for x in lines if x.startswith("@rIAS.")]
+    assert len(aux) == len(database.get_raw_item("IAS").aux)
+    assert "@qNOPE!001" in lines
+    assert "@rALT;0.0;00000" in lines
+
+    database.write("ALT", 3100)
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ALT;3100.0;00000\n"
+
+    plugin.sock.sendall("@xsync;*;x\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@xsync!003\n"
+
+def test_rate_limited_subscription(plugin,database):
+    plugin.sock.sendall("@sALT;rate=5\n".encode())
+    res = plugin.sock.recv(1024).decode()
+    assert res == "@sALT;rate=5\n"
+
+    database.write("ALT", 1000)
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ALT;1000.0;00000\n"
+    start = time.monotonic()
+    for alt in range(1001, 1020):
+        database.write("ALT", alt)
+    # Only the last value comes once the interval has passed
+    res = plugin.sock.recv(1024).decode()
+    assert res == "ALT;1019.0;00000\n"
+    assert time.monotonic() - start > 0.1
+    status = plugin.pl.get_status()
+    assert status['Connection 0']['Conflated Updates'] == 18
+
+def test_binary_protocol(plugin,database):
+    binary = fixgw.netfix.binary
+    plugin.sock.sendall("@xbinary\n".encode())
+    buf = bytearray()
+    while not buf.startswith(b"@xbinary\n"):
+        buf += plugin.sock.recv(1024)
+    del buf[:9]
+
+    def next_frame():
+        while True:
+            frame = binary.next_frame(buf)
+            if frame is not None:
+                return frame
+            buf.extend(plugin.sock.recv(1024))
+
+    plugin.sock.sendall(binary.text_frame("@sALT"))
+    assert next_frame() == (binary.TEXT, b"@sALT")
+    database.write("ALT", 3000)
+    ftype, payload = next_frame()
+    assert ftype == binary.KEY
+    n, key = binary.decode_key(payload)
+    assert key == "ALT"
+    ftype, payload = next_frame()
+    assert binary.decode_values(payload) == [
+        (n, 3000.0, (False, False, False, False, False))
+    ]
+
+    # Writes from a binary client use the same key numbers
+    plugin.sock.sendall(binary.values_frame([(n, (3100.0, False, False, True, False, False))]))
+    time.sleep(0.05)
+    assert database.read("ALT") == (3100.0, False, False, True, False, False)
+
+def test_writes_are_not_echoed_with_dispatcher(plugin,database):
+    database.start_dispatcher()
+    try:
+        plugin.sock.sendall("@sALT\n@sIAS\n".encode())
+        res = b""
+        while res.count(b"\n") < 2:
+            res += plugin.sock.recv(1024)
+        assert res == b"@sALT\n@sIAS\n"
+
+        # Our own write of a subscribed key and of one that isn't subscribed
+        plugin.sock.sendall("ALT;1500;0000\nPITCH;2.0;0000\n".encode())
+        time.sleep(0.1)
+        assert database.read("ALT")[0] == 1500.0
+        database.write("IAS", 101)
+        database.write("ALT", 1600)
+        res = b""
+        while res.count(b"\n") < 2:
+            res += plugin.sock.recv(1024)
+        assert res == b"IAS;101.0;00000\nALT;1600.0;00000\n"
+    finally:
+        database.stop_dispatcher()
+
 def test_normal_write(plugin,database):
     plugin.sock.sendall("IAS;121.2;0000\n".encode())
     time.sleep(0.1)
@@ -480,22 +621,22 @@ def test_kill_command(plugin):
 def test_bad_command(plugin):
     plugin.sock.sendall("@xbad\n".encode())
     res = plugin.sock.recv(1024).decode()
-    assert res == '@xbad!001'
+    assert res == '@xbad!001\n'
 
 def test_set_flag_for_bad_id(plugin):
     plugin.sock.sendall("@fNOPE;a;1\n".encode())
     res = plugin.sock.recv(1024).decode()
-    assert res == '@fN!001\n'
+    assert res == '@fNOPE!001\n'
 
 def test_flag_with_invalid_flag(plugin):
     plugin.sock.sendall("@fALT;n;1\n".encode())
     res = plugin.sock.recv(1024).decode()
-    assert res == "@fA!002\n"
+    assert res == "@fALT!002\n"
 
 def test_flag_with_invalid_setting(plugin):
     plugin.sock.sendall("@fALT;a;2\n".encode())
     res = plugin.sock.recv(1024).decode()
-    assert res == "@fA!003\n"
+    assert res == "@fALT!003\n"
 
     # def test_decimal_places(self):
     #     pass
@@ -522,3 +663,94 @@ def test_send_invalid_value_update2(plugin,caplog):
         assert 'Problem with input IAS;10;10;10;10;10: string index out of range' in caplog.text        
 
 
+
+
+def _connect(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(1.0)
+    sock.connect(("127.0.0.1", port))
+    return sock
+
+
+@pytest.mark.parametrize("mode", ["threads", "select"])
+def test_max_connections_and_workers(database, mode):
+    pl = fixgw.plugins.netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": mode,
+            "host": "127.0.0.1",
+            "port": 34902,
+            "timeout": 0.2,
+            "max_connections": 2,
+            "workers": 2,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.1)
+    socks = []
+    try:
+        # Clients connecting together are all served by the one listener
+        socks = [_connect(34902) for i in range(3)]
+        answers = []
+        for sock in socks:
+            try:
+                sock.sendall(b"@rALT\n")
+                answers.append(sock.recv(1024))
+            except OSError:
+                answers.append(b"")
+        assert sorted(answers) == [b"", b"@rALT;0.0;00000\n", b"@rALT;0.0;00000\n"]
+        status = pl.get_status()
+        assert status["Current Connections"] == 2
+        assert status["Refused Connections"] == 1
+        assert status["Workers"] == 2
+    finally:
+        for sock in socks:
+            sock.close()
+        pl.stop()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="No Unix domain sockets")
+@pytest.mark.parametrize("mode", ["threads", "select"])
+def test_unix_socket_only(database, mode, tmp_path):
+    path = str(tmp_path / "netfix.sock")
+    # Leave a socket file behind like a gateway that crashed
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    pl = fixgw.plugins.netfix.Plugin(
+        "netfix",
+        {
+            "type": "server",
+            "mode": mode,
+            "host": "127.0.0.1",
+            "port": 34903,
+            "timeout": 0.2,
+            "tcp": False,
+            "unix_socket": path,
+        },
+        None,
+    )
+    pl.start()
+    time.sleep(0.1)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1.0)
+        sock.connect(path)
+        sock.sendall(b"@rALT\n")
+        assert sock.recv(1024) == b"@rALT;0.0;00000\n"
+        # Nothing is listening on the TCP port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp:
+            assert tcp.connect_ex(("127.0.0.1", 34903)) != 0
+        status = pl.get_status()
+        assert status["Current Connections"] == 1
+        if hasattr(socket, "SO_PEERCRED"):
+            c = status["Connection 0"]
+            assert c["Peer PID"] == os.getpid()
+            assert c["Peer UID"] == os.getuid()
+            assert c["Peer GID"] == os.getgid()
+    finally:
+        sock.close()
+        pl.stop()
+    assert not os.path.exists(path)
@@ -1,8 +1,12 @@
+import concurrent.futures
+import struct
+import time
 from collections import deque
 from types import SimpleNamespace
 
 import pytest
 
+import fixgw.database as database
 import fixgw.plugin as plugin_base
 import fixgw.plugins.netfix as netfix_plugin
 
@@ -11,6 +15,8 @@ class FakeLog:
     def __init__(self):
         self.debug_messages = []
         self.info_messages = []
+        self.warning_messages = []
+        self.error_messages = []
 
     def debug(self, message):
         self.debug_messages.append(message)
@@ -18,6 +24,12 @@ class FakeLog:
     def info(self, message):
         self.info_messages.append(message)
 
+    def warning(self, message):
+        self.warning_messages.append(message)
+
+    def error(self, message):
+        self.error_messages.append(message)
+
 
 class FakeItem:
     description = "Altitude"
@@ -34,6 +46,14 @@ class FakeItem:
         self.bad = False
         self.fail = False
         self.secfail = False
+        self.updates = []
+
+    def update(self, value, annunciate=None, bad=None, fail=None, secfail=None):
+        self.updates.append(value)
+        self.annunciate = annunciate
+        self.bad = bad
+        self.fail = fail
+        self.secfail = secfail
 
 
 class FakeParent:
@@ -75,6 +95,9 @@ class FakeParent:
             raise KeyError(key)
         self.callbacks_added.append((key, function, udata))
 
+    def db_callback_add_prefix(self, prefix, function, udata=None):
+        self.callbacks_added.append((prefix + "*", function, udata))
+
     def db_callback_del(self, key, function, udata=None):
         if key == "MISSING":
             raise KeyError(key)
@@ -83,6 +106,12 @@ class FakeParent:
     def quit(self):
         self.quit_called = True
 
+    def db_origin(self, tag):
+        return database.origin(tag)
+
+    def db_get_origin(self):
+        return database.get_origin()
+
 
 class FakeSocket:
     def __init__(self, recv_values=None):
@@ -145,7 +174,7 @@ def test_server_specific_commands_return_status_kill_and_errors(monkeypatch):
     assert drain_queue(connection) == [
         b'@xstatus;{"ok": true}\n',
         b"@xkill\n",
-        b"@xwat!001",
+        b"@xwat!001\n",
     ]
     assert parent.quit_called is True
 
@@ -181,7 +210,11 @@ def test_flag_command_reports_bad_key_flag_and_value():
     connection.handle_request("@fALT;x;1")
     connection.handle_request("@fALT;a;2")
 
-    assert drain_queue(connection) == [b"@fM!001\n", b"@fA!002\n", b"@fA!003\n"]
+    assert drain_queue(connection) == [
+        b"@fMISSING!001\n",
+        b"@fALT!002\n",
+        b"@fALT!003\n",
+    ]
 
 
 def test_list_command_splits_responses_when_buffer_is_small():
@@ -218,7 +251,7 @@ def test_value_update_sets_false_flags_and_logs_bad_frames():
     connection.handle_request("ALT;321;000")
     connection.handle_request("bad-frame")
 
-    assert parent.writes == [("ALT", "321")]
+    assert parent.item.updates == ["321"]
     assert parent.item.annunciate is False
     assert parent.item.bad is False
     assert parent.item.fail is False
@@ -227,16 +260,214 @@ def test_value_update_sets_false_flags_and_logs_bad_frames():
     assert parent.log.debug_messages
 
 
-def test_subscription_handler_suppresses_one_inhibited_update_then_sends_values():
+def test_value_update_sets_value_and_flags_in_one_update():
+    parent = FakeParent()
+    connection = make_connection(parent)
+
+    connection.handle_request("ALT;500;1011")
+    connection.handle_request("ALT;600;010")
+
+    assert parent.item.updates == ["500", "600"]
+    assert parent.item.annunciate is False
+    assert parent.item.bad is True
+    assert parent.item.fail is False
+    assert parent.item.secfail is False
+
+
+def test_subscription_handler_does_not_echo_the_clients_own_writes():
     connection = make_connection()
-    connection.output_inhibit = True
+    other = make_connection()
 
-    connection.subscription_handler("ALT", (1.0, True, False, True, False, True), None)
-    connection.subscription_handler("IAS", 99.0, None)
+    with database.origin(connection):
+        connection.subscription_handler("ALT", (1.0, True, False, True, False, True), None)
+    with database.origin(other):
+        connection.subscription_handler("IAS", 99.0, None)
 
     assert drain_queue(connection) == [b"IAS;99.0\n"]
 
 
+def test_output_queue_sends_latest_value_once_and_keeps_responses_in_order():
+    connection = make_connection()
+
+    connection.subscription_handler("ALT", 1.0, None)
+    connection.subscription_handler("IAS", 2.0, None)
+    connection.queue.put(b"@rALT;1.0\n")
+    connection.subscription_handler("ALT", 3.0, None)
+    connection.queue.put(b"@sBARO\n")
+
+    assert drain_queue(connection) == [
+        b"@rALT;1.0\n",
+        b"@sBARO\n",
+        b"ALT;3.0\n",
+        b"IAS;2.0\n",
+    ]
+    assert connection.queue.conflated == 1
+    with pytest.raises(netfix_plugin.queue.Empty):
+        connection.queue.get(timeout=0.01)
+
+
+def test_output_queue_flags_and_disconnects_slow_clients():
+    parent = FakeParent()
+    parent.config["queue_high_water"] = 2
+    parent.config["queue_limit"] = 4
+    connection = make_connection(parent)
+
+    for key in ["A", "B", "C"]:
+        connection.subscription_handler(key, 1.0, None)
+    assert connection.queue.lagging is True
+    assert connection.queue.lag_count == 1
+    assert connection.conn.shutdown_calls == []
+
+    for key in ["D", "E", "F"]:
+        connection.subscription_handler(key, 1.0, None)
+    assert connection.conn.shutdown_calls == [netfix_plugin.socket.SHUT_RDWR]
+    assert len(connection.queue) == 5  # Updates stop once we give up
+    assert "too far behind" in parent.log.warning_messages[0]
+
+    drain_queue(connection)
+    assert connection.queue.lagging is False
+
+
+def test_value_message_is_built_once_for_every_connection():
+    first = make_connection()
+    second = make_connection()
+    value = (1.0, False, False, True, False, False)
+
+    first.subscription_handler("ALT", value, None)
+    second.subscription_handler("ALT", value, None)
+    # A new value object is a new change even if it looks the same
+    first.subscription_handler("IAS", 2.0, None)
+    second.subscription_handler("IAS", 2.5, None)
+
+    [a1, i1] = drain_queue(first)
+    [a2, i2] = drain_queue(second)
+    assert a1 == b"ALT;1.0;00100\n"
+    assert a1 is a2
+    assert (i1, i2) == (b"IAS;2.0\n", b"IAS;2.5\n")
+
+
+def test_binary_switch_resends_pending_values_as_binary():
+    parent = FakeParent()
+    connection = make_connection(parent)
+    connection.subscription_handler("ALT", 1.0, None)
+
+    connection.handle_request("@xbinary")
+    connection.subscription_handler("ALT", (2.0, False, False, False, False, False), None)
+    connection.handle_request("@qMISSING")
+
+    buf = bytearray(b"".join(drain_queue(connection)))
+    assert buf.startswith(b"@xbinary\n")
+    del buf[: len(b"@xbinary\n")]
+    frames = []
+    while True:
+        frame = netfix_plugin.fixbinary.next_frame(buf)
+        if frame is None:
+            break
+        frames.append(frame)
+    assert buf == b""
+    n = netfix_plugin.key_id("ALT")
+    assert frames[0] == (netfix_plugin.fixbinary.KEY, struct.pack("<H", n) + b"ALT")
+    assert frames[1] == (netfix_plugin.fixbinary.TEXT, b"@qMISSING!001")
+    # The ASCII update that was waiting is replaced with the current value
+    ftype, payload = frames[2]
+    assert netfix_plugin.fixbinary.decode_values(payload) == [
+        (n, 2.0, (False, False, False, False, False))
+    ]
+    assert len(frames) == 3
+
+
+def test_receive_handles_binary_frames_after_switch():
+    parent = FakeParent()
+    connection = make_connection(parent)
+    n = netfix_plugin.key_id("ALT")
+    buf = bytearray(b"@xbinary\n")
+    buf += netfix_plugin.fixbinary.text_frame("@rALT")
+    buf += netfix_plugin.fixbinary.values_frame(
+        [(n, (500.0, False, False, True, False, False)), (n, 600.0)]
+    )
+    tail = netfix_plugin.fixbinary.text_frame("@rALT")
+    buf += tail[:3]
+
+    assert connection.receive(buf) == 3
+    assert connection.framer.buf == tail[:3]
+    assert parent.item.updates == [500.0]
+    assert parent.item.bad is True
+    assert parent.writes == [("ALT", 600.0)]
+    assert drain_queue(connection)[1] == netfix_plugin.fixbinary.text_frame(
+        "@rALT;123.0;00000"
+    )
+
+
+def test_subscribe_options_are_checked_and_echoed():
+    parent = FakeParent()
+    connection = make_connection(parent)
+
+    connection.handle_request("@sALT;rate=4;dead=0.1")
+    connection.handle_request("@sIAS;rate=x")
+    connection.handle_request("@sAOA;speed=4")
+    connection.handle_request("@sBARO;dead=-1")
+
+    assert drain_queue(connection) == [
+        b"@sALT;rate=4;dead=0.1\n",
+        b"@sIAS!003\n",
+        b"@sAOA!003\n",
+        b"@sBARO!003\n",
+    ]
+    assert [c[0] for c in parent.callbacks_added] == ["ALT"]
+    assert connection.filters == {"ALT": (0.25, 0.1)}
+
+    connection.handle_request("@uALT")
+    assert connection.filters == {}
+
+
+def test_subscription_rate_sends_latest_value_when_interval_passes(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(
+        netfix_plugin, "time", SimpleNamespace(monotonic=lambda: clock[0])
+    )
+    connection = make_connection()
+    connection.handle_request("@sALT;rate=4")
+    drain_queue(connection)
+
+    connection.subscription_handler("ALT", 1.0, None)
+    assert drain_queue(connection) == [b"ALT;1.0\n"]
+    for value in [2.0, 3.0]:
+        clock[0] += 0.05
+        connection.subscription_handler("ALT", value, None)
+    assert drain_queue(connection) == []
+    assert connection.queue.next_due() == 100.25
+
+    clock[0] = 100.25
+    assert drain_queue(connection) == [b"ALT;3.0\n"]
+    clock[0] = 100.3
+    connection.subscription_handler("ALT", 4.0, None)
+    assert drain_queue(connection) == []
+    clock[0] = 100.5
+    assert drain_queue(connection) == [b"ALT;4.0\n"]
+    # Other keys are not held back
+    connection.subscription_handler("IAS", 5.0, None)
+    assert drain_queue(connection) == [b"IAS;5.0\n"]
+
+
+def test_subscription_deadband_drops_small_changes_on_prefix():
+    connection = make_connection()
+    connection.handle_request("@sEGT*;dead=5")
+    drain_queue(connection)
+
+    def update(key, value, fail=False):
+        connection.subscription_handler(key, (value, False, False, False, fail, False), None)
+        return drain_queue(connection)
+
+    assert update("EGT1", 1200.0) == [b"EGT1;1200.0;00000\n"]
+    assert update("EGT1", 1203.0) == []
+    # A flag change is always sent
+    assert update("EGT1", 1203.0, fail=True) == [b"EGT1;1203.0;00010\n"]
+    assert update("EGT1", 1207.0, fail=True) == []
+    assert update("EGT1", 1209.0, fail=True) == [b"EGT1;1209.0;00010\n"]
+    assert update("EGT2", 1204.0) == [b"EGT2;1204.0;00000\n"]
+    assert connection.filtered == 2
+
+
 def test_receive_thread_handles_recv_exception_and_cleans_up():
     parent = FakeParent()
     parent.thread = SimpleNamespace(buffer_size=32)
@@ -279,31 +510,63 @@ def test_send_thread_sends_until_exit_and_closes_socket():
 
     thread.run()
 
-    assert connection.conn.sent == [b"one", b"two"]
+    # Everything that was waiting goes out in one call
+    assert connection.conn.sent == [b"onetwo"]
     assert thread.msg_sent == 2
+    assert thread.send_calls == 1
+    assert thread.bytes_sent == 6
     assert thread.running is False
     assert connection.conn.closed is True
 
 
+def test_send_thread_limits_batch_size():
+    parent = FakeParent()
+    parent.config["send_batch_bytes"] = 8
+    connection = make_connection(parent)
+    for each in [b"aaaa", b"bbbb", b"cccc", b"dd", "exit"]:
+        connection.queue.put(each)
+    thread = netfix_plugin.SendThread(connection)
+    thread.cork = lambda on: corks.append(on)
+    corks = []
+
+    thread.run()
+
+    assert connection.conn.sent == [b"aaaabbbb", b"ccccdd"]
+    assert corks == [True, False]
+    assert thread.msg_sent == 4
+    assert thread.send_calls == 2
+
+
 class FakeNetfixClient:
     instances = []
 
     def __init__(self, host, port):
-        self.cthread = SimpleNamespace(host=host)
+        self.cthread = SimpleNamespace(host=host, port=port, timeout=0.1)
         self.host = host
         self.port = port
-        self.isConnected = True
+        self.connected = True
         self.writes = []
+        self.responses = {}
         self.disconnect_called = False
         FakeNetfixClient.instances.append(self)
 
     def connect(self):
         self.connected = True
 
-    def writeValue(self, key, value):
-        if value == "retry":
-            raise RuntimeError("retry")
+    def isConnected(self):
+        return self.connected
+
+    # The future is only finished once the whole batch has been sent
+    def writeValueFuture(self, key, value):
+        if not self.connected:
+            raise netfix_plugin.netfix.NotConnectedError("Not Connected to Server")
         self.writes.append((key, value))
+        future = concurrent.futures.Future()
+        if key in self.responses:
+            future.set_result(self.responses[key])
+        elif value != "lost":
+            future.set_result("{};{};00000".format(key, value))
+        return future
 
     def disconnect(self):
         self.disconnect_called = True
@@ -314,10 +577,16 @@ class FakeClientParent:
         self.log = FakeLog()
         self.config = {
             "clients": [{"host": "peer-a", "port": 4000}, {"host": "peer-b"}],
-            "outputs": ["alt"],
+            "outputs": ["alt", "ias"],
+            "batch_size": 2,
+            "send_interval": 0.05,
         }
         self.callbacks_added = []
-        self.reads = {"ALT": (55.0, False, False, False, False, False)}
+        self.reads = {
+            "ALT": (55.0, False, False, False, False, False),
+            "IAS": (120.0, False, False, False, False, False),
+            "OAT": (15.0, False, False, False, False, False),
+        }
 
     def db_callback_add(self, key, function):
         self.callbacks_added.append((key, function))
@@ -332,23 +601,38 @@ def test_client_thread_initializes_clients_callbacks_status_and_stop(monkeypatch
     parent = FakeClientParent()
 
     thread = netfix_plugin.ClientThread(parent)
-    FakeNetfixClient.instances[1].isConnected = False
+    FakeNetfixClient.instances[1].connected = False
     thread.stop()
 
     assert [(c.host, c.port) for c in thread.clients] == [
         ("peer-a", 4000),
         ("peer-b", 3490),
     ]
-    assert parent.callbacks_added[0][0] == "ALT"
-    assert thread.get_status() == {
-        "Current Clients": 2,
-        "Connected": 1,
-        "Disonnected": 1,
+    assert [p.client for p in thread.peers] == thread.clients
+    assert thread.peers[0].batch_size == 2
+    assert thread.peers[0].interval == 0.05
+    assert [x[0] for x in parent.callbacks_added] == ["ALT", "IAS"]
+    status = thread.get_status()
+    assert list(status.items())[:3] == [
+        ("Current Clients", 2),
+        ("Connected", 1),
+        ("Disonnected", 1),
+    ]
+    assert status["Peer 1"] == {
+        "Host": "peer-b:3490",
+        "Connected": False,
+        "Pending": 0,
+        "Sent": 0,
+        "Retries": 0,
+        "Rejected": 0,
+        "Lag ms": 0.0,
+        "Max Lag ms": 0.0,
     }
     assert [c.disconnect_called for c in thread.clients] == [True, True]
+    assert all(p.stopped.is_set() for p in thread.peers)
 
 
-def test_client_output_callback_queues_unique_value_only_updates(monkeypatch):
+def test_client_output_callback_marks_each_peer_once(monkeypatch):
     monkeypatch.setattr(netfix_plugin.netfix, "Client", FakeNetfixClient)
     thread = netfix_plugin.ClientThread(FakeClientParent())
     callback = thread.getOutputFunction("ALT")
@@ -356,53 +640,81 @@ def test_client_output_callback_queues_unique_value_only_updates(monkeypatch):
     callback("ALT", (1.0, False, False, False, False, False), None)
     callback("ALT", (2.0, False, False, False, False, False), None)
     callback("ALT", (3.0, True, False, False, False, False), None)
+    thread.getOutputFunction("IAS")("IAS", (4.0,) + (False,) * 5, None)
 
-    assert list(thread.queue) == ["ALT"]
+    assert [p.dirty for p in thread.peers] == [{"ALT", "IAS"}, {"ALT", "IAS"}]
 
 
-def test_client_thread_run_writes_unblocked_keys_and_requeues_failures(monkeypatch):
+def test_peer_worker_sends_batches_of_the_latest_values(monkeypatch):
     monkeypatch.setattr(netfix_plugin.netfix, "Client", FakeNetfixClient)
     parent = FakeClientParent()
-    parent.reads["ALT"] = (55.0, False, False, False, False, False)
     thread = netfix_plugin.ClientThread(parent)
-    thread.queue.append("ALT")
     netfix_plugin.client_block["peer-b"].add("ALT")
-
-    sleeps = []
-
-    def fake_sleep(duration):
-        sleeps.append(duration)
-        thread.getout = True
-
-    monkeypatch.setattr(netfix_plugin.time, "sleep", fake_sleep)
-
-    thread.run()
-
-    assert thread.clients[0].writes == [("ALT", 55.0)]
-    assert thread.clients[1].writes == []
+    for key in ["ALT", "IAS", "OAT", "ALT"]:
+        for peer in thread.peers:
+            peer.mark(key)
+    parent.reads["ALT"] = (60.0, False, False, False, False, False)
+
+    pause = thread.peers[0].cycle()
+    thread.peers[1].cycle()
+
+    assert 0 < pause <= 0.05
+    assert sorted(thread.clients[0].writes) == [
+        ("ALT", 60.0),
+        ("IAS", 120.0),
+        ("OAT", 15.0),
+    ]
+    assert sorted(thread.clients[1].writes) == [("IAS", 120.0), ("OAT", 15.0)]
     assert "ALT" not in netfix_plugin.client_block["peer-b"]
+    status = thread.peers[0].get_status()
+    assert status["Sent"] == 3
+    assert status["Pending"] == 0
+    assert status["Lag ms"] > 0
+    assert status["Max Lag ms"] == status["Lag ms"]
+    assert thread.peers[0].cycle() == 0
 
 
-def test_client_thread_run_requeues_failed_writes_once(monkeypatch):
+def test_peer_worker_retries_failed_writes_without_holding_up_other_peers(monkeypatch):
     monkeypatch.setattr(netfix_plugin.netfix, "Client", FakeNetfixClient)
     parent = FakeClientParent()
-    parent.reads["ALT"] = ("retry", False, False, False, False, False)
     thread = netfix_plugin.ClientThread(parent)
-    thread.queue.append("ALT")
-    sleep_calls = 0
-
-    def fake_sleep(_duration):
-        nonlocal sleep_calls
-        sleep_calls += 1
-        if sleep_calls > 1:
-            thread.queue.clear()
-            thread.getout = True
-
-    monkeypatch.setattr(netfix_plugin.time, "sleep", fake_sleep)
-
-    thread.run()
-
-    assert sleep_calls >= 2
+    down, up = thread.peers
+    down.client.connected = False
+    parent.reads["OAT"] = ("lost", False, False, False, False, False)
+    up.client.responses["IAS"] = "IAS!001"
+    for peer in thread.peers:
+        for key in ["ALT", "IAS", "OAT"]:
+            peer.mark(key)
+
+    assert down.cycle() == netfix_plugin.PEER_RETRY
+    assert up.cycle() == netfix_plugin.PEER_RETRY
+
+    assert down.dirty == {"ALT", "IAS", "OAT"}
+    assert down.client.writes == []
+    # The write that was never answered is tried again, the one that was
+    # refused isn't
+    assert up.dirty == {"OAT"}
+    assert (up.sent, up.rejected, up.retries) == (1, 1, 1)
+    assert down.get_status()["Retries"] == 3
+
+
+def test_peer_worker_thread_sends_changes_until_stopped(monkeypatch):
+    monkeypatch.setattr(netfix_plugin.netfix, "Client", FakeNetfixClient)
+    parent = FakeClientParent()
+    parent.config["clients"] = [{"host": "peer-c"}]
+    thread = netfix_plugin.ClientThread(parent)
+    thread.start()
+    try:
+        thread.peers[0].mark("ALT")
+        for i in range(100):
+            if thread.clients[0].writes:
+                break
+            time.sleep(0.01)
+        assert thread.clients[0].writes == [("ALT", 55.0)]
+    finally:
+        thread.stop()
+        thread.join(1.0)
+    assert not thread.is_alive()
 
 
 def test_plugin_lifecycle_for_client_server_both_and_invalid_types(monkeypatch):
@@ -459,3 +771,101 @@ def test_plugin_lifecycle_for_client_server_both_and_invalid_types(monkeypatch):
         failing.stop()
 
     assert ("start", "FakeThread") in events
+
+
+def test_select_wake_is_not_lost_when_woken_while_draining():
+    thread = netfix_plugin.SelectServerThread(FakeParent())
+    try:
+        thread.wake()
+        thread.wake()
+        real = thread.wake_r
+
+        class WakingSocket:
+            # Another thread calls wake() while the loop is draining
+            def recv(self, n):
+                data = real.recv(n)
+                thread.wake()
+                return data
+
+        thread.wake_r = WakingSocket()
+        thread.drain_wake()
+        thread.wake_r = real
+        assert thread.woken is False
+
+        # The next wake() sends again so the loop cannot sleep through it
+        thread.wake()
+        assert real.recv(4096) == b"\0"
+    finally:
+        thread.wake_r.close()
+        thread.wake_w.close()
+
+
+def test_server_keeps_trying_to_listen_until_the_port_is_free(monkeypatch):
+    parent = FakeParent()
+    thread = netfix_plugin.ServerThread(parent)
+    attempts = []
+
+    def listen():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise OSError("Address already in use")
+        return "socket"
+
+    monkeypatch.setattr(thread, "listen", listen)
+    monkeypatch.setattr(netfix_plugin.time, "sleep", lambda t: None)
+    assert thread.bind() == "socket"
+    assert len(parent.log.error_messages) == 2
+
+    # Stopping gives up instead of waiting for the port forever
+    attempts.clear()
+    monkeypatch.setattr(netfix_plugin.time, "sleep", lambda t: thread.stop())
+    assert thread.bind() is None
+    assert len(attempts) == 1
+
+
+def test_select_flush_leaves_updates_queued_while_the_socket_is_full():
+    parent = FakeParent()
+    parent.config["send_batch_bytes"] = 20
+    thread = netfix_plugin.SelectServerThread(parent)
+
+    class FullSocket:
+        def __init__(self):
+            self.room = 30
+            self.sent = bytearray()
+
+        def send(self, data):
+            if not self.room:
+                raise BlockingIOError
+            n = min(self.room, len(data))
+            self.room -= n
+            self.sent += data[:n]
+            return n
+
+    class FakeSelector:
+        def modify(self, conn, events, data):
+            pass
+
+    try:
+        thread.selector = FakeSelector()
+        connection = make_connection(parent)
+        client = netfix_plugin.LoopClient(connection)
+        client.conn = FullSocket()
+        for key in ["A", "B", "C", "D", "E", "F"]:
+            connection.queue.put_value(key, "{}.........\n".format(key).encode())
+        thread.flush(client)
+
+        # Only a batch is pulled ahead of the full socket, the rest can conflate
+        assert client.writing is True
+        assert len(client.outbuf) < 20
+        assert len(connection.queue) == 2
+        connection.queue.put_value("F", b"F-newest..\n")
+        assert connection.queue.conflated == 1
+
+        client.conn.room = 1000
+        thread.flush(client)
+        assert client.writing is False
+        assert bytes(client.conn.sent).endswith(b"F-newest..\n")
+        assert client.msg_sent == 6
+    finally:
+        thread.wake_r.close()
+        thread.wake_w.close()
@@ -17,6 +17,7 @@
 import unittest
 import io
 import time
+import threading
 import fixgw.database as database
 from unittest.mock import MagicMock, patch
 
@@ -1040,7 +1041,7 @@ def test_set_aux_value_handles_none_and_invalid_values():
     item.min = 0
     item.max = 10
     callback = MagicMock()
-    item.callbacks.append(("cb", callback, "udata"))
+    item.callbacks = {("cb", callback, "udata"): None}
     database.log = MagicMock()
 
     item.set_aux_value("Min", "None")
@@ -1061,7 +1062,7 @@ def test_send_callbacks_logs_callback_exceptions():
     def bad_callback(*_args):
         raise RuntimeError("boom")
 
-    item.callbacks.append(("bad", bad_callback, "udata"))
+    item.callbacks = {("bad", bad_callback, "udata"): None}
 
     item.send_callbacks()
 
@@ -1143,14 +1144,12 @@ entries:
 
     with patch("fixgw.database.cfg.from_yaml", return_value={"entries": [{"key": "EGTx", "description": "Exhaust Gas Temp %x", "type": "float", "initial": 0}, {"key": "ZZLOADER", "description": "Loader", "type": "str", "initial": "Loaded"}]}), patch(
         "fixgw.database.logging.getLogger", return_value=MagicMock()
-    ) as get_logger, patch("fixgw.database.UpdateThread", fake_thread):
+    ) as get_logger, patch("fixgw.database.StaleThread", fake_thread):
         database.init(io.StringIO(cfg_text))
 
     log = get_logger.return_value
     log.error.assert_called_once_with("Variable x not set for EGTx")
-    fake_thread.assert_called_once()
-    assert fake_thread.call_args[0][0:2] == (database.update, 1.0)
-    assert fake_thread_instance.daemon is True
+    fake_thread.assert_called_once_with()
     fake_thread_instance.start.assert_called_once()
 
 
@@ -1193,7 +1192,7 @@ def test_value_tuple_with_secfail_and_invalid_value_logging():
 def test_flag_setters_only_callback_on_change():
     item = database.db_item("TEST", "float")
     cb = MagicMock()
-    item.callbacks.append(("cb", cb, None))
+    item.callbacks = {("cb", cb, None): None}
     assert item.annunciate is False
     item.annunciate = False
     item.old = False
@@ -1217,8 +1216,8 @@ def test_callback_delete_wildcard_removes_registered_callbacks(database):
 
     database.callback_del("cb", "*", callback, None)
 
-    assert database.get_raw_item("PITCH").callbacks == []
-    assert database.get_raw_item("ROLL").callbacks == []
+    assert database.get_raw_item("PITCH").callbacks == {}
+    assert database.get_raw_item("ROLL").callbacks == {}
 
 
 def test_init_adds_entries_without_variables_section_and_starts_thread():
@@ -1242,21 +1241,19 @@ def test_init_adds_entries_without_variables_section_and_starts_thread():
 
     with patch("fixgw.database.cfg.from_yaml", return_value=cfg_data), patch(
         "fixgw.database.logging.getLogger", return_value=MagicMock()
-    ), patch("fixgw.database.UpdateThread", fake_thread):
+    ), patch("fixgw.database.StaleThread", fake_thread):
         database.init(io.StringIO("entries: []"))
 
     assert "ITEM" in database.listkeys()
-    fake_thread.assert_called_once()
-    assert fake_thread.call_args[0][0:2] == (database.update, 1.0)
+    fake_thread.assert_called_once_with()
+    # The initial write arms the item with its time to live
+    fake_thread_instance.arm.assert_called_once_with(database.get_raw_item("ITEM"))
 
 
-def test_init_stops_existing_update_thread_before_reinit():
-    old_stop = MagicMock()
+def test_init_stops_existing_stale_thread_before_reinit():
     old_thread = MagicMock()
     old_thread.is_alive.return_value = True
-    old_thread.delay = 1.0
-    database._update_thread = old_thread
-    database._update_thread_stop = old_stop
+    database._stale_thread = old_thread
 
     fake_thread = MagicMock()
     fake_thread_instance = MagicMock()
@@ -1278,11 +1275,11 @@ def test_init_stops_existing_update_thread_before_reinit():
 
     with patch("fixgw.database.cfg.from_yaml", return_value=cfg_data), patch(
         "fixgw.database.logging.getLogger", return_value=MagicMock()
-    ), patch("fixgw.database.UpdateThread", fake_thread):
+    ), patch("fixgw.database.StaleThread", fake_thread):
         database.init(io.StringIO("entries: []"))
 
-    old_stop.set.assert_called_once()
-    old_thread.join.assert_called_once_with(timeout=2.0)
+    old_thread.stop.assert_called_once()
+    old_thread.join.assert_called_once_with(timeout=1.0)
 
 
 def test_getters_and_setters_for_quality_flags(database):
@@ -1295,3 +1292,449 @@ def test_getters_and_setters_for_quality_flags(database):
     assert item.bad is True
     item.old = True
     assert item.old is True
+
+
+def test_write_many_stores_batch_then_sends_one_callback_per_item(database):
+    seen = []
+
+    def cb(key, value, udata):
+        # Every item in the batch is already stored when callbacks run
+        seen.append((key, database.read("PITCH")[0], database.read("ROLL")[0]))
+
+    database.callback_add("test", "PITCH", cb, None)
+    database.callback_add("test", "ROLL", cb, None)
+    database.callback_add("test", "AOA", cb, None)
+
+    database.write_many({"PITCH": 10.5, "ROLL": (-20.0, True, False, False), "AOA.Warn": 12.0})
+
+    assert sorted(seen) == [
+        ("AOA.Warn", 10.5, -20.0),
+        ("PITCH", 10.5, -20.0),
+        ("ROLL", 10.5, -20.0),
+    ]
+    assert database.read("ROLL")[:2] == (-20.0, True)
+    assert database.read("AOA.Warn") == 12.0
+
+
+def test_write_many_leaves_batch_unapplied_on_bad_entry(database):
+    cb = MagicMock()
+    database.callback_add("test", "PITCH", cb, None)
+    database.write("PITCH", 1.0)
+    cb.reset_mock()
+
+    with pytest.raises(KeyError):
+        database.write_many({"PITCH": 5.0, "NOSUCHKEY": 1.0})
+    with pytest.raises(ValueError):
+        database.write_many({"PITCH": 5.0, "ROLL": "bad-value"})
+
+    assert database.read("PITCH")[0] == 1.0
+    cb.assert_not_called()
+
+
+def test_update_sets_value_and_flags_with_one_callback():
+    item = database.db_item("TEST", "float")
+    cb = MagicMock()
+    item.callbacks = {("cb", cb, None): None}
+
+    assert item.update(5.0, annunciate=1, bad=True, fail=False, secfail=True) is True
+    cb.assert_called_once_with("TEST", (5.0, True, False, True, False, True), None)
+
+    cb.reset_mock()
+    assert item.update(5.0, annunciate=True) is False
+    cb.assert_called_once()
+
+    cb.reset_mock()
+    assert item.update(6.0) is True
+    assert item.value == (6.0, True, False, True, False, True)
+    cb.assert_called_once()
+
+    with pytest.raises(ValueError):
+        item.update("bad-value", fail=True)
+    assert item.value[4] is False
+
+
+def test_dispatcher_runs_callbacks_on_owner_thread(database):
+    done = threading.Event()
+    threads = []
+
+    def cb(key, value, udata):
+        threads.append(threading.current_thread())
+        done.set()
+
+    database.start_dispatcher()
+    try:
+        database.callback_add("owner", "PITCH", cb, None)
+        database.write("PITCH", 2.0)
+        assert done.wait(1.0)
+        assert threads[0] is not threading.current_thread()
+        assert threads[0].owner == "owner"
+        status = database.dispatch_status()
+        assert status["owner"]["Dispatched"] == 1
+        assert status["owner"]["Queue Depth"] == 0
+    finally:
+        database.stop_dispatcher()
+    assert database.dispatch_status() is None
+
+
+def test_origin_is_passed_to_callbacks_with_and_without_dispatcher(database):
+    seen = []
+    done = threading.Event()
+
+    def cb(key, value, udata):
+        seen.append(database.get_origin())
+        done.set()
+
+    database.callback_add("owner", "PITCH", cb, None)
+    with database.origin("client"):
+        database.write("PITCH", 1.0)
+    database.write("PITCH", 2.0)
+    assert seen == ["client", None]
+
+    database.start_dispatcher()
+    try:
+        done.clear()
+        with database.origin("other"):
+            database.write("PITCH", 3.0)
+        assert database.get_origin() is None
+        assert done.wait(1.0)
+    finally:
+        database.stop_dispatcher()
+    assert seen[2] == "other"
+
+
+def test_callback_worker_overflow_policies():
+    cb = MagicMock()
+    conflate = database.CallbackWorker("c", 2, "conflate")
+    conflate.post(cb, "A", 1, None)
+    conflate.post(cb, "B", 1, None)
+    conflate.post(cb, "A", 2, None)
+    conflate.post(cb, "C", 1, None)
+    assert [e[1:3] for e in conflate.pending.values()] == [("B", 1), ("C", 1)]
+    assert conflate.conflated == 1
+    assert conflate.dropped == 1
+
+    drop = database.CallbackWorker("d", 2, "drop-oldest")
+    for i in range(4):
+        drop.post(cb, "A", i, None)
+    assert [e[2] for e in drop.pending.values()] == [2, 3]
+    assert drop.dropped == 2
+
+    with pytest.raises(ValueError):
+        database.CallbackWorker("x", 2, "nonsense")
+
+
+def test_callback_worker_block_waits_for_room():
+    release = threading.Event()
+    seen = []
+
+    def cb(key, value, udata):
+        release.wait(1.0)
+        seen.append(value)
+
+    worker = database.CallbackWorker("b", 1, "block")
+    worker.start()
+    try:
+        worker.post(cb, "A", 1, None)
+        worker.post(cb, "A", 2, None)
+        writer = threading.Thread(target=worker.post, args=(cb, "A", 3, None))
+        writer.start()
+        writer.join(0.1)
+        assert writer.is_alive()
+        release.set()
+        writer.join(1.0)
+        assert not writer.is_alive()
+        while len(seen) < 3:
+            time.sleep(0.01)
+        assert seen == [1, 2, 3]
+    finally:
+        worker.stop()
+
+
+def test_stale_thread_sets_old_when_time_to_live_expires(database):
+    item = database.get_raw_item("PITCH")
+    item.tol = 400
+    went_old = threading.Event()
+    cb = MagicMock(side_effect=lambda key, value, udata: value[2] and went_old.set())
+    database.callback_add("test", "PITCH", cb, None)
+
+    database.write("PITCH", 1.0)
+    time.sleep(0.1)
+    # Writing again moves the deadline out
+    database.write("PITCH", 2.0)
+    written = time.monotonic()
+    cb.reset_mock()
+    assert item._deadline == pytest.approx(written + 0.4, abs=0.05)
+    # Wait much longer than needed, the event says when it actually happened
+    assert went_old.wait(5.0)
+    assert time.monotonic() - written >= 0.39
+    assert item.old is True
+    cb.assert_called_with("PITCH", (2.0, False, True, False, False, False), None)
+    assert item._armed is None
+    # and it is armed again by the next write
+    database.write("PITCH", 3.0)
+    assert item._armed == item._deadline
+
+
+def test_zero_time_to_live_items_are_never_armed(database):
+    item = database.get_raw_item("PITCH")
+    item.tol = 0
+    item._armed = None
+    item._deadline = None
+
+    database.write("PITCH", 1.0)
+
+    assert item._armed is None
+    assert item._deadline is None
+
+
+def test_items_are_compact_and_share_locks():
+    items = [database.db_item("ITEM{}".format(i)) for i in range(database.LOCK_STRIPES * 2)]
+
+    assert not hasattr(items[0], "__dict__")
+    assert len({id(i.lock) for i in items}) <= database.LOCK_STRIPES
+    assert items[0].aux is items[1].aux
+    items[0].init_aux(["Min"])
+    assert items[0].get_aux_list() == ["Min"]
+    assert items[1].get_aux_list() == []
+
+
+def test_callback_handle_removes_only_that_callback(database):
+    cb = MagicMock()
+    handle = database.callback_add("test", "PITCH", cb, None)
+    database.callback_add("other", "PITCH", cb, None)
+    database.callback_add("test", "PITCH", cb, "udata")
+
+    database.callback_remove(handle)
+    database.write("PITCH", 5.0)
+
+    assert list(database.get_raw_item("PITCH").callbacks) == [
+        ("other", cb, None),
+        ("test", cb, "udata"),
+    ]
+    assert cb.call_count == 2
+
+
+def test_callback_delete_wildcard_leaves_other_owners(database):
+    cb = MagicMock()
+    database.callback_add("test", "PITCH", cb, None)
+    database.callback_add("test", "ROLL", cb, None)
+    database.callback_add("other", "ROLL", cb, None)
+
+    database.callback_del("test", "*", cb, None)
+    database.callback_del("test", "*", cb, None)
+
+    assert database.get_raw_item("PITCH").callbacks == {}
+    assert list(database.get_raw_item("ROLL").callbacks) == [("other", cb, None)]
+    # Deleting a single key that is no longer registered is harmless
+    database.callback_del("test", "ROLL", cb, None)
+    with pytest.raises(KeyError):
+        database.callback_del("test", "NOSUCHKEY", cb, None)
+
+
+def test_duplicate_callbacks_are_merged_and_udata_must_be_hashable(database):
+    cb = MagicMock()
+    database.callback_add("test", "PITCH", cb, "udata")
+    database.callback_add("test", "PITCH", cb, "udata")
+    database.write("PITCH", 5.0)
+    assert cb.call_count == 1
+
+    database.callback_del("test", "PITCH", cb, "udata")
+    assert database.get_raw_item("PITCH").callbacks == {}
+    with pytest.raises(TypeError):
+        database.callback_add("test", "PITCH", cb, ["not", "hashable"])
+
+
+def test_callback_can_delete_itself_while_being_called(database):
+    calls = []
+
+    def cb(key, value, udata):
+        calls.append(key)
+        database.callback_del("test", key, cb, None)
+
+    database.callback_add("test", "PITCH", cb, None)
+    database.write("PITCH", 1.0)
+    database.write("PITCH", 2.0)
+
+    assert calls == ["PITCH"]
+
+
+def test_prefix_subscription_covers_existing_and_new_keys(database):
+    cb = MagicMock()
+    handle = database.callback_add_prefix("test", "EGT1", cb)
+
+    database.add_item({"key": "EGT1X", "type": "int", "min": 0, "max": 1000, "initial": 0, "tol": 0})
+    for key in ["EGT11", "EGT12", "EGTAVG1", "EGT1X"]:
+        database.write(key, 100.0)
+
+    assert sorted(call.args[0] for call in cb.call_args_list) == [
+        "EGT11",
+        "EGT12",
+        "EGT1X",
+    ]
+
+    database.callback_remove(handle)
+    cb.reset_mock()
+    database.write("EGT11", 110.0)
+    database.add_item({"key": "EGT1Y", "type": "int", "min": 0, "max": 1000, "initial": 0, "tol": 0})
+    database.write("EGT1Y", 110.0)
+    cb.assert_not_called()
+    with pytest.raises(KeyError):
+        database.callback_del_prefix("test", "EGT1", cb)
+
+
+def test_overlapping_key_and_pattern_subscriptions(database):
+    cb = MagicMock()
+    database.callback_add("test", "EGT11", cb, None)
+    database.callback_add_prefix("test", "EGT1", cb)
+    database.callback_add_prefix("test", "EGT", cb)
+
+    # EGT11 was added on its own and EGT12 is still covered by EGT
+    database.callback_del_prefix("test", "EGT1", cb)
+    database.write("EGT11", 100.0)
+    database.write("EGT12", 100.0)
+    assert [call.args[0] for call in cb.call_args_list] == ["EGT11", "EGT12"]
+
+    # Removing EGT11 on its own leaves it to the EGT prefix
+    database.callback_del("test", "EGT11", cb, None)
+    cb.reset_mock()
+    database.write("EGT11", 110.0)
+    cb.assert_called_once()
+
+    database.callback_del_prefix("test", "EGT", cb)
+    assert database.get_raw_item("EGT11").callbacks == {}
+    assert database.get_raw_item("EGT12").callbacks == {}
+
+
+def test_regex_subscription_and_wildcard_delete(database):
+    cb = MagicMock()
+    database.callback_add_regex("test", "^(PITCH|ROLL)$", cb)
+
+    database.write("PITCH", 1.0)
+    database.write("ROLL", 2.0)
+    database.write("AOA", 3.0)
+    assert [call.args[0] for call in cb.call_args_list] == ["PITCH", "ROLL"]
+
+    database.callback_del("test", "*", cb, None)
+    database.add_item({"key": "PITCH", "type": "int", "min": 0, "max": 1000, "initial": 0, "tol": 0})
+    database.write("PITCH", 1.0)
+    database.write("ROLL", 2.0)
+    assert cb.call_count == 2
+
+
+def test_notify_on_change_suppresses_repeated_writes(database):
+    item = database.get_raw_item("PITCH")
+    item.notify_on_change = True
+    cb = MagicMock()
+    database.callback_add("test", "PITCH", cb, None)
+
+    database.write("PITCH", 5.0)
+    stamp = item.timestamp
+    database.write("PITCH", 5.0)
+    database.write_many({"PITCH": 5.0})
+    assert item.update(5.0, bad=False) is False
+    assert cb.call_count == 1
+    assert item.timestamp > stamp
+
+    database.write("PITCH", (5.0, False, True, False))
+    assert cb.call_count == 2
+
+    # The clearing of the old flag always gets through
+    item.timestamp -= 1
+    item.old = True
+    assert cb.call_args.args[1][2] is True
+    cb.reset_mock()
+    database.write("PITCH", (5.0, False, True, False))
+    cb.assert_called_once()
+    assert cb.call_args.args[1][2] is False
+
+
+def test_deadband_compares_against_last_sent_value(database):
+    item = database.get_raw_item("PITCH")
+    item.tol = 0
+    item.deadband = "1%"  # of -90 to 90
+    assert item.deadband == pytest.approx(1.8)
+    cb = MagicMock()
+    database.callback_add("test", "PITCH", cb, None)
+
+    for value in [10.0, 11.0, 11.7, 11.9, 12.0]:
+        database.write("PITCH", value)
+
+    assert [call.args[1][0] for call in cb.call_args_list] == [10.0, 11.9]
+    assert database.read("PITCH")[0] == 12.0
+
+    item.deadband = 0.5
+    assert item.deadband == 0.5
+    database.log = MagicMock()
+    item.deadband = "bad"
+    assert item.deadband == 0.5
+    database.get_raw_item("BTN1").deadband = 1
+    assert database.get_raw_item("BTN1").deadband == 0
+
+
+def test_snapshot_returns_read_only_consistent_item_states(database):
+    database.write("PITCH", (5.0, True, False, False))
+    database.write("IAS.Vne", 180.0)
+
+    snap = database.snapshot(keys=["PITCH", "IAS"])
+
+    assert list(snap) == ["PITCH", "IAS"]
+    assert snap["PITCH"][:6] == database.read("PITCH")
+    assert snap["PITCH"].timestamp == database.get_raw_item("PITCH").timestamp
+    assert snap["IAS"].aux["Vne"] == 180.0
+    with pytest.raises(TypeError):
+        snap["IAS"].aux["Vne"] = 1.0
+    with pytest.raises(TypeError):
+        snap["PITCH"] = None
+
+    # Later writes do not change a snapshot
+    database.write("PITCH", 6.0)
+    assert snap["PITCH"].value == 5.0
+    with pytest.raises(KeyError):
+        database.snapshot(keys=["NOSUCHKEY"])
+
+
+def test_snapshot_by_prefix_and_since(database):
+    first = database.snapshot(prefix=["EGT1", "CHT1"])
+    assert set(first) == {"EGT1" + c for c in "123456"} | {"CHT1" + c for c in "123456"}
+    assert len(database.snapshot()) == len(database.listkeys())
+
+    database.write("EGT12", 500.0)
+    database.get_raw_item("CHT13").bad = True
+    database.write("ALT", 1000.0)
+
+    changed = database.snapshot(prefix=["EGT1", "CHT1"], since=first.seq)
+    assert set(changed) == {"EGT12", "CHT13"}
+    assert changed.seq > first.seq
+    assert len(database.snapshot(since=changed.seq)) == 0
+
+
+def test_changes_since_returns_keys_in_order_of_last_change(database):
+    start = database.snapshot(keys=[]).seq
+
+    database.write("PITCH", 1.0)
+    database.write("ROLL", 2.0)
+    database.write("IAS.Vne", 180.0)
+    database.write("PITCH", 3.0)
+
+    changes = database.changes_since(start)
+    assert list(changes) == ["ROLL", "IAS.Vne", "PITCH"]
+    assert changes["PITCH"] == database.get_raw_item("PITCH").seq
+    assert database.changes_since(changes["PITCH"]) == {}
+
+
+def test_changes_since_returns_none_past_the_journal_horizon(database):
+    start = database.snapshot(keys=[]).seq
+    for i in range(database.JOURNAL_SIZE + 1):
+        database.write("PITCH", float(i % 90))
+
+    assert database.changes_since(start) is None
+    latest = database.get_raw_item("PITCH").seq
+    assert list(database.changes_since(latest - 1)) == ["PITCH"]
+
+
+def test_item_timestamps_are_monotonic(database):
+    before = time.monotonic()
+    database.write("PITCH", 1.0)
+
+    assert before <= database.get_raw_item("PITCH").timestamp <= time.monotonic()
+    assert database.get_raw_item("PITCH").age < 1000
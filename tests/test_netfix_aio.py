@@ -0,0 +1,168 @@
+import asyncio
+import time
+
+import pytest
+
+import fixgw.plugins.netfix
+from fixgw.netfix import NotConnectedError, ResponseError
+from fixgw.netfix.aio import Client, Database
+
+
+def start_server(path=None, port=34904):
+    config = {
+        "type": "server",
+        "mode": "select",
+        "host": "127.0.0.1",
+        "port": port,
+        "timeout": 0.1,
+    }
+    if path:
+        config["tcp"] = False
+        config["unix_socket"] = path
+    pl = fixgw.plugins.netfix.Plugin("netfix", config, None)
+    pl.start()
+    time.sleep(0.1)
+    return pl
+
+
+@pytest.fixture
+def server(database, tmp_path):
+    path = str(tmp_path / "netfix.sock")
+    pl = start_server(path)
+    yield "unix:" + path
+    pl.stop()
+
+
+async def next_update(updates):
+    return await asyncio.wait_for(updates.__anext__(), 1.0)
+
+
+def test_commands_and_updates(server, database):
+    async def run():
+        client = Client(server)
+        assert await client.connect()
+        assert await client.read("ALT") == ("ALT", "0.0", "")
+        report = await client.report("ALT")
+        assert report.desc == "Indicated Altitude"
+        assert await client.writeValue("ALT", 1200) == "ALT;1200.0;00000"
+        await client.flag("ALT", "b", True)
+        assert await client.read("ALT") == ("ALT", "1200.0", "b")
+        with pytest.raises(ResponseError, match="Key Not Found NOPE"):
+            await client.flag("NOPE", "b", True)
+        assert "ALT" in await client.getList()
+
+        updates = client.updates()
+        await client.subscribe("IAS")
+        database.write("IAS", 105.5)
+        assert await next_update(updates) == ("IAS", "105.5", "")
+        await client.close()
+        assert not client.isConnected()
+
+    asyncio.run(run())
+
+
+def test_commands_are_pipelined(server, database):
+    database.write("ALT", 2500)
+
+    async def run():
+        client = Client(server)
+        await client.connect()
+        keys = ["ALT", "IAS", "ALT", "NOPE"] * 25
+        values = await asyncio.gather(*[client.read(key) for key in keys])
+        assert values[:4] == [
+            ("ALT", "2500.0", ""),
+            ("IAS", "0.0", ""),
+            ("ALT", "2500.0", ""),
+            1,
+        ]
+        assert values[4:8] == values[:4]
+        assert client.requests == {}
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_binary_updates(server, database):
+    async def run():
+        client = Client(server, binary=True)
+        await client.connect()
+        assert client.isBinary()
+        updates = client.updates()
+        await client.subscribe("ALT")
+        database.write("ALT", 3100)
+        assert await next_update(updates) == ("ALT", 3100.0, "")
+        await client.write("ALT", 3200)
+        await client.close()
+
+    asyncio.run(run())
+    assert database.read("ALT")[0] == 3200
+
+
+def test_reconnects_and_subscribes_again(database):
+    pl = start_server()
+
+    async def run():
+        nonlocal pl
+        client = Client("127.0.0.1", 34904, backoff=0.05, max_backoff=0.1)
+        states = []
+        client.connectCallback = states.append
+        assert await client.connect()
+        await client.subscribe("ALT")
+        updates = client.updates()
+
+        await asyncio.get_event_loop().run_in_executor(None, pl.stop)
+        while client.isConnected():
+            await asyncio.sleep(0.01)
+        with pytest.raises(NotConnectedError):
+            await client.read("ALT")
+        pl = start_server()
+        assert await client.connectWait(2.0)
+
+        database.write("ALT", 4200)
+        assert await next_update(updates) == ("ALT", "4200.0", "")
+        assert states == [True, False, True]
+        await client.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        pl.stop()
+
+
+def test_database_replica(server, database):
+    database.write("OILP1.lowWarn", 25)
+
+    async def run():
+        client = Client(server)
+        await client.connect()
+        db = Database(client)
+        await asyncio.wait_for(db.init_event.wait(), 2.0)
+        item = db.get_item("OILP1")
+        assert item.description == "Oil Pressure Engine 1"
+        assert item.get_aux_value("lowWarn") == 25.0
+
+        changed = asyncio.Event()
+        item.valueChanged = lambda x: changed.set()
+        database.write("OILP1", 55.0)
+        await asyncio.wait_for(changed.wait(), 1.0)
+        assert db.get_value("OILP1") == 55.0
+
+        # Our copy changes once the server has it
+        await db.set_value("OILP1", 250.0)
+        assert item.value == 200.0
+        await db.set_flag("OILP1", "f", True)
+        assert item.fail
+        assert database.read("OILP1")[4]
+
+        await db.set_state("OILP1", 80.0, "a")
+        assert (item.value, item.annunciate, item.fail) == (80.0, True, False)
+        assert database.read("OILP1")[:5] == (80.0, True, False, False, False)
+
+        # Setting the item only changes our copy
+        item.value = 10.0
+        assert database.read("OILP1")[0] == 80.0
+
+        await client.close()
+        assert db.get_item_list() == []
+
+    asyncio.run(run())
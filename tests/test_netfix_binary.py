@@ -0,0 +1,65 @@
+import struct
+
+import pytest
+
+import fixgw.netfix.binary as binary
+
+
+def test_values_round_trip_every_type():
+    records = [
+        (1, (1234.5, True, False, True, False, True)),
+        (2, (7, False, True, False, True, False)),
+        (3, (2**40, False, False, False, False, False)),
+        (4, (True, False, False, False, False, False)),
+        (5, ("hello wörld", False, False, False, False, False)),
+        (6, None),
+        (65535, 12.5),
+    ]
+    frame = binary.values_frame(records)
+    ftype, payload = binary.next_frame(bytearray(frame))
+
+    assert ftype == binary.VALUES
+    assert binary.decode_values(payload) == [
+        (1, 1234.5, (True, False, True, False, True)),
+        (2, 7, (False, True, False, True, False)),
+        (3, 2**40, (False, False, False, False, False)),
+        (4, True, (False, False, False, False, False)),
+        (5, "hello wörld", (False, False, False, False, False)),
+        (6, None, None),
+        (65535, 12.5, None),
+    ]
+
+
+def test_value_frame_is_smaller_than_ascii():
+    frame = binary.values_frame([(12, (1234.5678, False, False, False, False, False))])
+    assert len(frame) < len(b"ROLL;1234.5678;00000\n")
+
+
+def test_text_and_key_frames():
+    buf = bytearray(binary.text_frame("@rALT\n") + binary.key_frame(300, "ALT"))
+
+    assert binary.next_frame(buf) == (binary.TEXT, b"@rALT")
+    ftype, payload = binary.next_frame(buf)
+    assert ftype == binary.KEY
+    assert binary.decode_key(payload) == (300, "ALT")
+    assert buf == b""
+
+
+def test_next_frame_waits_for_the_whole_frame():
+    data = binary.text_frame(b"@sIAS") + binary.text_frame(b"@sALT")
+    buf = bytearray()
+    frames = []
+    # Feed it a byte at a time
+    for i in range(len(data)):
+        buf += data[i : i + 1]
+        frame = binary.next_frame(buf)
+        if frame is not None:
+            frames.append(frame)
+
+    assert frames == [(binary.TEXT, b"@sIAS"), (binary.TEXT, b"@sALT")]
+    assert buf == b""
+
+
+def test_decode_values_rejects_unknown_types():
+    with pytest.raises(ValueError):
+        binary.decode_values(struct.pack("<HBB", 1, 0, 99))
@@ -1,3 +1,5 @@
+import concurrent.futures
+import contextlib
 import logging
 
 import pytest
@@ -16,6 +18,8 @@ class FakeSocket:
     def send(self, data):
         self.sent.append(data)
 
+    sendall = send
+
 
 class ScriptedSocket:
     def __init__(self, recv_results=None, connect_error=None):
@@ -25,6 +29,7 @@ class ScriptedSocket:
         self.options = []
         self.timeout = None
         self.connected_to = None
+        self.sent = []
 
     def setsockopt(self, *args):
         self.options.append(args)
@@ -37,6 +42,9 @@ class ScriptedSocket:
             raise self.connect_error
         self.connected_to = addr
 
+    def sendall(self, data):
+        self.sent.append(data)
+
     def recv(self, _size):
         result = self.recv_results.pop(0)
         if isinstance(result, Exception):
@@ -78,9 +86,24 @@ class FakeClientThread:
         if not self.responses:
             raise netfix.ResponseError("empty")
         actual, payload = self.responses.pop(0)
-        assert actual == command
+        assert actual in command
         return [actual, payload]
 
+    def request(self, line, command, key, parse=None):
+        self.send(line)
+        actual, payload = self.getResponse(command)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(payload if parse is None else parse(payload))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @contextlib.contextmanager
+    def stream(self, line):
+        self.send(line)
+        yield
+
 
 def make_client(responses=None):
     client = netfix.Client("example.test", 3490)
@@ -256,15 +279,26 @@ def test_client_thread_run_logs_receive_failure_and_reconnects(monkeypatch, capl
     assert second_socket.closed
 
 
-def test_client_thread_run_bad_utf8_uses_legacy_error_path(monkeypatch):
-    fake_socket = ScriptedSocket([b"\xff\n"])
+def test_client_thread_run_logs_bad_utf8_and_keeps_reading(monkeypatch, caplog):
+    fake_socket = ScriptedSocket([b"\xff\nALT;1200\n", b""])
     thread = netfix.ClientThread("example.test", 3490)
+    data = []
+    thread.dataCallback = data.append
 
+    caplog.set_level(logging.ERROR, logger="fixgw.netfix")
     monkeypatch.setattr(netfix.socket, "socket", lambda *_args: fake_socket)
 
-    with pytest.raises(AttributeError, match="'ClientThread' object has no attribute 'log'"):
+    def stop_after_disconnect(_seconds):
+        raise DoneRunning()
+
+    monkeypatch.setattr(netfix.time, "sleep", stop_after_disconnect)
+
+    with pytest.raises(DoneRunning):
         thread.run()
 
+    assert "Error handling request b'\\xff'" in caplog.text
+    assert data == [["ALT", "1200"]]
+
 
 def test_client_thread_run_logs_handle_request_errors(monkeypatch, caplog):
     fake_socket = ScriptedSocket([b"ALT;1200\n", b""])
@@ -285,6 +319,82 @@ def test_client_thread_run_logs_handle_request_errors(monkeypatch, caplog):
     assert "Error handling request ALT;1200 - callback failed" in caplog.text
 
 
+def _run_binary(monkeypatch, recv_results):
+    fake_socket = ScriptedSocket(recv_results)
+    thread = netfix.ClientThread("example.test", 3490)
+    thread.useBinary = True
+    data = []
+    states = []
+    thread.dataCallback = data.append
+    thread.connectCallback = states.append
+    monkeypatch.setattr(netfix.socket, "socket", lambda *_args: fake_socket)
+
+    def stop_after_disconnect(_seconds):
+        raise DoneRunning()
+
+    monkeypatch.setattr(netfix.time, "sleep", stop_after_disconnect)
+    with pytest.raises(DoneRunning):
+        thread.run()
+    assert fake_socket.sent[0] == b"@xbinary\n"
+    return thread, data, states
+
+
+def test_client_thread_switches_to_binary_when_server_agrees(monkeypatch):
+    frames = (
+        netfix.binary.key_frame(7, "ALT")
+        + netfix.binary.values_frame([(7, (99.5, False, False, True, False, False))])
+        + netfix.binary.text_frame("@rIAS;120.0;00000")
+    )
+    # The switch can land in the middle of a receive
+    thread, data, states = _run_binary(
+        monkeypatch, [b"@xbinary\n" + frames[:5], frames[5:], b""]
+    )
+
+    assert thread.binary is True
+    assert thread.key_ids == {"ALT": 7}
+    assert data == [["ALT", 99.5, "b"]]
+    assert thread.cmdqueue.get_nowait() == ["r", "IAS;120.0;00000"]
+    assert states == [True, False]
+
+
+def test_client_thread_stays_ascii_when_server_refuses_binary(monkeypatch):
+    thread, data, states = _run_binary(
+        monkeypatch, [b"@xbinary!001\nALT;99;00000\n", b""]
+    )
+
+    assert thread.binary is False
+    assert thread.cmdqueue.empty()
+    assert data == [["ALT", "99", ""]]
+    assert states == [True, False]
+
+
+def test_client_thread_stays_ascii_when_server_does_not_answer(monkeypatch):
+    thread, data, states = _run_binary(
+        monkeypatch, [netfix.socket.timeout(), b"ALT;99\n", b""]
+    )
+
+    assert thread.binary is False
+    assert data == [["ALT", "99"]]
+    assert states == [True, False]
+
+
+def test_client_write_uses_binary_for_known_keys():
+    client = netfix.Client("example.test", 3490)
+    fake = FakeSocket()
+    client.cthread.s = fake
+    client.cthread.connectedState(True)
+    client.cthread.binary = True
+    client.cthread.key_ids = {"ALT": 3}
+
+    client.write("ALT", 1000.0, "af")
+    client.write("IAS", 100, "")
+
+    assert fake.sent[0] == netfix.binary.values_frame(
+        [(3, (1000.0, True, False, False, True, False))]
+    )
+    assert fake.sent[1] == netfix.binary.text_frame("IAS;100;0000")
+
+
 def test_client_thread_connection_state_callbacks_and_waits():
     thread = netfix.ClientThread("example.test", 3490)
     states = []
@@ -358,8 +468,8 @@ def test_client_connect_disconnect_and_callbacks():
 def test_client_sends_protocol_commands_and_decodes_responses():
     client = make_client(
         [
-            ("l", "0;2;ALT,IAS"),
-            ("l", "done"),
+            ("l", "3;0;ALT,IAS"),
+            ("l", "3;2;ROLL"),
             ("q", "ALT;Altitude;float;0;50000;ft;100;"),
             ("r", "ALT;1200;10101"),
             ("s", "ALT"),
@@ -371,7 +481,7 @@ def test_client_sends_protocol_commands_and_decodes_responses():
         ]
     )
 
-    assert client.getList() == ["ALT", "IAS"]
+    assert client.getList() == ["ALT", "IAS", "ROLL"]
     assert client.getReport("ALT") == [
         "ALT",
         "Altitude",
@@ -392,7 +502,7 @@ def test_client_sends_protocol_commands_and_decodes_responses():
     client.stop()
 
     assert client.cthread.sent == [
-        b"@l<built-in function id>\n",
+        b"@l\n",
         b"@qALT\n",
         b"@rALT\n",
         b"ALT;1300;1101\n",
@@ -432,3 +542,163 @@ def test_client_flag_raises_response_errors(payload, message):
 
     with pytest.raises(netfix.ResponseError, match=message):
         client.flag("ALT", "a", False)
+
+
+def test_client_sync_collects_reports_values_and_aux_in_one_command():
+    client = make_client(
+        [
+            ("q", "ALT;Altitude;float;0;50000;ft;100;Min,Max"),
+            ("r", "ALT;1200;00100"),
+            ("r", "ALT.Min;0"),
+            ("r", "ALT.Max;None"),
+            ("q", "NOPE!001"),
+            ("q", "IAS;Airspeed;float;0;300;knots;100;"),
+            ("r", "IAS;98.5;00000"),
+            ("x", "sync;2"),
+        ]
+    )
+
+    result = client.sync(["ALT", "NOPE", "IAS"], subscribe=True)
+
+    assert client.cthread.sent == [b"@xsync;ALT,NOPE,IAS;s\n"]
+    assert [(key, value, aux) for key, report, value, aux in result] == [
+        ("ALT", ("ALT", "1200", "b"), {"Min": "0", "Max": "None"}),
+        ("IAS", ("IAS", "98.5", ""), {}),
+    ]
+    assert result[0][1].aux == ["Min", "Max"]
+
+
+def test_client_sync_raises_when_the_server_does_not_have_it():
+    client = make_client([("x", "sync;*!001")])
+
+    with pytest.raises(netfix.ResponseError, match="does not support sync"):
+        client.sync()
+
+
+def test_client_thread_connects_to_a_unix_socket(monkeypatch):
+    fake_socket = ScriptedSocket([netfix.socket.timeout()])
+    families = []
+    thread = netfix.ClientThread("unix:/run/fixgw/netfix.sock", 3490)
+    thread.stop()
+
+    def make_socket(family, *_args):
+        families.append(family)
+        return fake_socket
+
+    monkeypatch.setattr(netfix.socket, "socket", make_socket)
+
+    thread.run()
+
+    assert families == [netfix.socket.AF_UNIX]
+    assert fake_socket.connected_to == "/run/fixgw/netfix.sock"
+    assert fake_socket.options == []
+
+
+def connected_thread():
+    thread = netfix.ClientThread("example.test", 3490)
+    thread.s = FakeSocket()
+    thread.connectedState(True)
+    return thread
+
+
+def test_client_thread_matches_pipelined_responses_to_their_commands():
+    thread = connected_thread()
+    alt1 = thread.request(b"@rALT\n", "r", "ALT", netfix.decodeDataString)
+    ias = thread.request(b"@rIAS\n", "r", "IAS", netfix.decodeDataString)
+    alt2 = thread.request(b"@rALT\n", "r", "ALT", netfix.decodeDataString)
+    flag = thread.request(b"@fALT;a;1\n", "f", "ALT")
+
+    assert thread.s.sent == [b"@rALT\n", b"@rIAS\n", b"@rALT\n", b"@fALT;a;1\n"]
+    assert not alt1.done()
+    thread.handle_request("@fALT;a;1")
+    thread.handle_request("@rALT;1200;00000")
+    thread.handle_request("@rIAS;98;00000")
+    thread.handle_request("@rALT;1300;00000")
+
+    assert flag.result(0) == "ALT;a;1"
+    assert alt1.result(0) == ("ALT", "1200", "")
+    assert ias.result(0) == ("IAS", "98", "")
+    assert alt2.result(0) == ("ALT", "1300", "")
+    assert thread.requests == {}
+    assert thread.cmdqueue.empty()
+
+
+def test_client_thread_late_response_is_not_given_to_the_next_caller():
+    thread = connected_thread()
+    first = thread.request(b"@rALT\n", "r", "ALT")
+    # The caller gave up waiting before the response came
+    first.cancel()
+    second = thread.request(b"@rALT\n", "r", "ALT")
+
+    thread.handle_request("@rALT;1200;00000")
+    assert not second.done()
+    thread.handle_request("@rALT;1300;00000")
+
+    assert second.result(0) == "ALT;1300;00000"
+
+
+def test_client_thread_parse_errors_go_to_the_future():
+    thread = connected_thread()
+    client = netfix.Client("example.test", 3490)
+    client.cthread = thread
+    future = client.getReportFuture("NOPE")
+
+    thread.handle_request("@qNOPE!001")
+
+    with pytest.raises(netfix.ResponseError, match="Key Not Found NOPE"):
+        client.wait(future)
+
+
+def test_client_thread_fails_waiting_commands_when_disconnected():
+    thread = connected_thread()
+    future = thread.request(b"@sALT\n", "s", "ALT")
+
+    thread.connectedState(False)
+
+    with pytest.raises(netfix.NotConnectedError):
+        future.result(0)
+    assert thread.requests == {}
+
+
+def test_client_wait_times_out_and_cancels_the_command():
+    thread = connected_thread()
+    thread.timeout = 0.01
+    client = netfix.Client("example.test", 3490)
+    client.cthread = thread
+
+    with pytest.raises(netfix.ResponseError, match="Timeout"):
+        client.read("ALT")
+
+    thread.handle_request("@rALT;1200;00000")
+    assert thread.cmdqueue.empty()
+
+
+def test_client_thread_stream_only_gets_responses_after_earlier_commands():
+    thread = connected_thread()
+    read = thread.request(b"@rALT\n", "r", "ALT")
+    thread.cmdqueue.put(["x", "stray"])
+
+    with thread.stream(b"@xsync;ALT\n"):
+        # The server answers the read before it starts on the sync
+        thread.handle_request("@rALT;1200;00000")
+        thread.handle_request("@qALT;Altitude;float;0;50000;ft;100;")
+        thread.handle_request("@rALT;1300;00000")
+        thread.handle_request("@xsync;1")
+        assert thread.getResponse("q")[0] == "q"
+        assert thread.getResponse("r") == ["r", "ALT;1300;00000"]
+        assert thread.getResponse("x") == ["x", "sync;1"]
+
+    assert read.result(0) == "ALT;1200;00000"
+    assert thread.streamNumber is None
+
+
+def test_client_write_state_sends_the_value_sentence_and_reads_it_back():
+    thread = connected_thread()
+    client = netfix.Client("example.test", 3490)
+    client.cthread = thread
+
+    future = client.writeStateFuture("ALT", 1200, "ab")
+
+    assert thread.s.sent == [b"ALT;1200;1100\n", b"@rALT\n"]
+    thread.handle_request("@rALT;1200.0;10100")
+    assert client.wait(future) == ("ALT", "1200.0", "ab")
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 
 import pytest
 
+import fixgw.netfix as netfix
 import fixgw.netfix.db as netfixdb
 
 
@@ -9,6 +10,9 @@ class FakeClient:
     def __init__(self, connected=False):
         self.connected = connected
         self.write_values = []
+        self.states = []
+        self.state_responses = {}
+        self.during_state = None
         self.flags = []
         self.subscriptions = []
         self.unsubscriptions = []
@@ -19,6 +23,8 @@ class FakeClient:
         self.reads = {}
         self.write_responses = {}
         self.flag_error = None
+        self.sync_response = None  # None acts like a server without @xsync
+        self.during_sync = None
 
     def isConnected(self):
         return self.connected
@@ -35,6 +41,14 @@ class FakeClient:
             return self.write_responses[key]
         return f"{key};{value};00000"
 
+    def writeState(self, key, value, flags=""):
+        self.states.append((key, value, flags))
+        if self.during_state is not None:
+            self.during_state()
+        if key in self.state_responses:
+            return self.state_responses[key]
+        return (key, str(value), flags)
+
     def flag(self, key, flag, setting):
         if self.flag_error is not None:
             raise self.flag_error
@@ -43,6 +57,15 @@ class FakeClient:
     def getList(self):
         return self.list_response
 
+    def sync(self, spec="*", subscribe=False):
+        if self.sync_response is None:
+            raise netfix.ResponseError("Server does not support sync")
+        if subscribe:
+            self.subscriptions.extend(x[0] for x in self.sync_response)
+        if self.during_sync is not None:
+            self.during_sync()
+        return self.sync_response
+
     def getReport(self, key):
         return self.reports[key]
 
@@ -343,6 +366,51 @@ def test_db_item_update_no_write_restores_suppress_write_after_error():
     assert item.supressWrite is False
 
 
+def test_db_item_set_state_sends_one_write_and_waits_for_the_server():
+    client = FakeClient()
+    item = netfixdb.DB_Item(client, "ALT", "float")
+    item.max = 50000
+    item.updateNoWrite(["ALT", "12.5", ""])
+    events = []
+    item.valueChanged = lambda x: events.append(("value", x))
+    item.annunciateChanged = lambda x: events.append(("annunciate", x))
+    item.badChanged = lambda x: events.append(("bad", x))
+    # Nothing has changed yet while the server has the write
+    client.during_state = lambda: events.append(("server", item.value, item.bad))
+    client.state_responses["ALT"] = ("ALT", "1300", "ab")
+
+    item.set_state(value="1200", flags="ab")
+
+    assert client.states == [("ALT", 1200.0, "ab")]
+    assert client.write_values == []
+    assert client.flags == []
+    assert events == [
+        ("server", 12.5, False),
+        ("value", 1300.0),
+        ("annunciate", True),
+        ("bad", True),
+    ]
+    assert item.supressWrite is False
+
+
+def test_db_item_set_state_keeps_what_is_not_given(caplog):
+    client = FakeClient()
+    item = netfixdb.DB_Item(client, "ALT", "float")
+    item.updateNoWrite(["ALT", "12.5", "fs"])
+
+    item.set_state(flags="a")
+    item.set_state(value=20)
+
+    assert client.states == [("ALT", 12.5, "a"), ("ALT", 20.0, "a")]
+    assert item.value == 20.0
+    assert item.annunciate and not item.fail and not item.secFail
+
+    client.state_responses["ALT"] = 1
+    item.set_state(value=30)
+    assert item.value == 20.0
+    assert "Unable to write ALT error 1" in caplog.text
+
+
 def test_db_item_str_and_age():
     item = netfixdb.DB_Item(FakeClient(), "ALT", "float")
     item.supressWrite = True
@@ -402,6 +470,33 @@ def test_database_initializes_defines_items_and_reads_aux(monkeypatch):
     assert database.timer.joined
 
 
+def test_database_initializes_with_one_sync_and_applies_early_updates(monkeypatch):
+    monkeypatch.setattr(netfixdb, "UpdateThread", DummyTimer)
+    client = FakeClient()
+    report = ["ALT", "Altitude", "float", "0", "50000", "ft", "250", "low"]
+    client.sync_response = [
+        ("ALT", netfix.Report(report), ("ALT", "1234.5", "b"), {"low": "100"}),
+    ]
+    database = netfixdb.Database(client)
+    # An update that arrives before the database has got to the key
+    client.during_sync = lambda: database.dataFunction(["ALT", "1300.0", ""])
+
+    database.initialize()
+
+    item = database.get_item("ALT")
+    assert item.value == 1300.0
+    assert item.bad is False
+    assert item.get_aux_value("low") == 100.0
+    assert client.subscriptions == ["ALT"]
+    # Nothing is written back to the server and there are no extra requests
+    assert client.write_values == []
+    assert client.flags == []
+
+    # Updates for keys we don't know about are an error again afterwards
+    with pytest.raises(KeyError):
+        database.dataFunction(["IAS", "100.0", ""])
+
+
 def test_database_data_function_updates_values_and_aux_without_writes(monkeypatch):
     monkeypatch.setattr(netfixdb, "UpdateThread", DummyTimer)
     client = FakeClient()
@@ -0,0 +1,48 @@
+import fixgw.netfix.binary as binary
+from fixgw.netfix.framing import Framer
+
+
+def test_lines_split_across_feeds_come_out_whole():
+    framer = Framer()
+    data = b"IAS;100.0;00000\nALT;3100.0;00000\n@sROLL\n"
+    messages = []
+    # Feed it a few bytes at a time
+    for i in range(0, len(data), 5):
+        framer.feed(data[i : i + 5])
+        messages.extend(bytes(payload) for ftype, payload in framer)
+
+    assert messages == [b"IAS;100.0;00000", b"ALT;3100.0;00000", b"@sROLL"]
+    assert framer.buf == b""
+
+
+def test_partial_line_stays_in_the_buffer():
+    framer = Framer()
+    framer.feed(b"@rALT\n@rI")
+
+    assert [(t, bytes(p)) for t, p in framer] == [(binary.TEXT, b"@rALT")]
+    assert framer.buf == b"@rI"
+
+
+def test_switching_to_binary_part_way_through():
+    framer = Framer()
+    frame = binary.key_frame(7, "ALT")
+    framer.feed(b"@xbinary\n" + frame + binary.text_frame("@rALT")[:4])
+    messages = []
+    for ftype, payload in framer:
+        messages.append((ftype, bytes(payload)))
+        if payload == b"@xbinary":
+            framer.binary = True
+
+    assert messages == [(binary.TEXT, b"@xbinary"), (binary.KEY, frame[5:])]
+    assert framer.buf == binary.text_frame("@rALT")[:4]
+    framer.feed(binary.text_frame("@rALT")[4:])
+    assert [(t, bytes(p)) for t, p in framer] == [(binary.TEXT, b"@rALT")]
+
+
+def test_stopping_early_keeps_the_rest():
+    framer = Framer()
+    framer.feed(b"one\ntwo\n")
+    for ftype, payload in framer:
+        break
+
+    assert framer.buf == b"two\n"
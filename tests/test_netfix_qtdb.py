@@ -200,3 +200,43 @@ def test_qt_database_initialize_logs_inner_database_errors(monkeypatch, caplog):
     database.initialize()
 
     assert "ALT failed" in caplog.text
+
+
+def test_qt_item_coalesces_signals_to_the_latest_change(qtbot):
+    coalescer = qtdb.SignalCoalescer(rate=30)
+    coalescer.timer.stop()
+    item = PlainItem()
+    qt_item = qtdb.QtDB_Item("ALT", item, coalescer)
+    values = []
+    aux = []
+    qt_item.valueChanged.connect(values.append)
+    qt_item.auxChanged.connect(lambda name, value: aux.append((name, value)))
+
+    for x in range(50):
+        item.valueChanged(x)
+    item.auxChanged("low", 1.0)
+    item.auxChanged("high", 9.0)
+    item.auxChanged("low", 2.0)
+    assert values == []
+
+    coalescer.flush()
+    assert values == [49]
+    assert aux == [("low", 2.0), ("high", 9.0)]
+
+    coalescer.flush()
+    assert values == [49]
+
+
+def test_qt_database_frame_rate_emits_from_the_timer(monkeypatch, qtbot):
+    inner = FakeInnerDatabase(connected=True)
+    monkeypatch.setattr(qtdb.fixgw.netfix.db, "Database", lambda client: inner)
+    database = qtdb.Database(client=object(), frame_rate=50)
+    qt_item = database.get_item("ALT")
+    assert qt_item.coalescer is database.coalescer
+    assert database.coalescer.timer.interval() == 20
+
+    with qtbot.waitSignal(qt_item.valueChanged, timeout=1000) as blocker:
+        inner.item.valueChanged(11)
+        inner.item.valueChanged(12)
+    assert blocker.args == [12]
+    database.coalescer.stop()
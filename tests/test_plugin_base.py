@@ -6,3 +6,25 @@ def test_plugin_base_running_state_and_default_status():
 
     assert base.is_running() is False
     assert base.get_status() is None
+
+
+def test_plugin_base_write_many_passes_batch_to_database(monkeypatch):
+    base = plugin.PluginBase("base", {}, {})
+    calls = []
+    monkeypatch.setattr(plugin.database, "write_many", calls.append)
+
+    base.db_write_many({"IAS": 100.0, "ALT": 2500.0})
+
+    assert calls == [{"IAS": 100.0, "ALT": 2500.0}]
+
+
+def test_plugin_base_callback_handle_round_trip(monkeypatch):
+    base = plugin.PluginBase("base", {}, {})
+    removed = []
+    monkeypatch.setattr(plugin.database, "callback_add", lambda *args: args)
+    monkeypatch.setattr(plugin.database, "callback_remove", removed.append)
+
+    handle = base.db_callback_add("IAS", print)
+    base.db_callback_remove(handle)
+
+    assert removed == [("base", "IAS", print, None)]
@@ -201,3 +201,18 @@ def test_dict2string_non_dict_values():
     data = {"Key": "Value", "Number": 42, "Nested": {"SubKey": "SubValue"}}
     expected = "Key: Value\n" "Number: 42\n" "Nested\n" "   SubKey: SubValue\n"
     assert dict2string(data) == expected
+
+
+def test_status_get_dict_includes_callback_dispatch(mock_database, mock_plugins, mock_fixgw):
+    status = Status(mock_plugins, {})
+    dispatch = {"netfix": {"Queue Depth": 3}}
+
+    with patch("fixgw.status.get_system_status", return_value={}), patch(
+        "fixgw.database.dispatch_status", return_value=dispatch
+    ):
+        result = status.get_dict()
+
+    assert result["Database Statistics"] == {
+        "Item Count": 2,
+        "Callback Dispatch": dispatch,
+    }